@@ -4,12 +4,14 @@ Simple test for agora package.
 This script tests the basic functionality of agora by submitting a simple job.
 """
 
+import itertools
 import os
 import re
+import subprocess
 import tempfile
 from typing import Optional
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
 from agora.interfaces import Job
 from agora.job_submitter import JobSubmitter
@@ -28,6 +30,14 @@ class TestJrunSimple(unittest.TestCase):
         fd, self.db_path = tempfile.mkstemp(suffix=".db")
         os.close(fd)
 
+        # Mock sbatch (job scripts are piped to sbatch over stdin)
+        self.sbatch_ids = itertools.count(12345)
+        self.sbatch_scripts = []
+        self.slurm_calls = []
+        run_patcher = patch("subprocess.run", side_effect=self.mock_subprocess_run)
+        run_patcher.start()
+        self.addCleanup(run_patcher.stop)
+
         # Create commond preamble map
         self.preamble_map = {
             "base": "\n".join(
@@ -50,45 +60,21 @@ class TestJrunSimple(unittest.TestCase):
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
-    def get_popen_mock_fn(self):
-        """Setup mocks for os.popen."""
-
-        def mock_popen_func(command):
-            # Only mock sbatch calls, let other calls through or return empty
-            if "sbatch" in command:
-                # Track how many sbatch calls we've made
-                if not hasattr(mock_popen_func, "sbatch_count"):
-                    mock_popen_func.sbatch_count = 0
-
-                mock_popen_func.sbatch_count += 1
-                if mock_popen_func.sbatch_count in [1, 2, 3, 4, 5, 6, 7, 8]:
-                    return_value = {
-                        1: "Submitted batch job 12345",
-                        2: "Submitted batch job 12346",
-                        3: "Submitted batch job 12347",
-                        4: "Submitted batch job 12348",
-                        5: "Submitted batch job 12349",
-                        6: "Submitted batch job 12350",
-                        7: "Submitted batch job 12351",
-                        8: "Submitted batch job 12352",
-                    }[mock_popen_func.sbatch_count]
-                    return MagicMock(read=MagicMock(return_value=return_value))
-                else:
-                    return MagicMock(
-                        read=MagicMock(return_value="Submitted batch job 99999")
-                    )
-            else:
-                # For non-sbatch calls, return empty result
-                return MagicMock(read=MagicMock(return_value=""))
-
-        return mock_popen_func
-
-    @patch("os.popen")
-    def test_pll_root_workflow(self, mock_popen):
+    def mock_subprocess_run(self, args, input=None, **kwargs):
+        """Mock subprocess.run: sbatch returns job IDs 12345, 12346, ...
+
+        Other SLURM commands (sacct, squeue, ...) return empty results.
+        """
+        self.slurm_calls.append(args)
+        if args[0] == "sbatch":
+            self.sbatch_scripts.append(input)
+            stdout = f"Submitted batch job {next(self.sbatch_ids)}\n"
+            return subprocess.CompletedProcess(args, 0, stdout=stdout, stderr="")
+        return subprocess.CompletedProcess(args, 0, stdout="", stderr="")
+
+    def test_pll_root_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
 
         ##### Setup test
         submitter = JobSubmitter(self.db_path)
@@ -143,12 +129,9 @@ class TestJrunSimple(unittest.TestCase):
         assert jobs[0].node_id != jobs[1].node_id
         print("Test completed successfully!")
 
-    @patch("os.popen")
-    def test_pll_sweep_root_workflow(self, mock_popen):
+    def test_pll_sweep_root_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
 
         ##### Setup test
         submitter = JobSubmitter(self.db_path)
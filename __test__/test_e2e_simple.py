@@ -4,16 +4,23 @@ Simple test for agora package.
 This script tests the basic functionality of agora by submitting a simple job.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import os
 import re
+import sqlite3
+import subprocess
+import sys
 import tempfile
 from typing import Optional
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
-from agora.interfaces import Job
+from agora._base import MIGRATIONS
+from agora.interfaces import Job, JobInsert, PGroup, PJob, SweepSpec, to_array_script
 from agora.job_submitter import JobSubmitter
 from agora.job_viewer import JobViewer
+from agora.poller import StatusPoller
 
 
 class TestJrunSimple(unittest.TestCase):
@@ -28,6 +35,14 @@ class TestJrunSimple(unittest.TestCase):
         fd, self.db_path = tempfile.mkstemp(suffix=".db")
         os.close(fd)
 
+        # Mock sbatch (job scripts are piped to sbatch over stdin)
+        self.sbatch_ids = itertools.count(12345)
+        self.sbatch_scripts = []
+        self.slurm_calls = []
+        run_patcher = patch("subprocess.run", side_effect=self.mock_subprocess_run)
+        run_patcher.start()
+        self.addCleanup(run_patcher.stop)
+
         # Create commond preamble map
         self.preamble_map = {
             "base": "\n".join(
@@ -50,45 +65,21 @@ class TestJrunSimple(unittest.TestCase):
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
-    def get_popen_mock_fn(self):
-        """Setup mocks for os.popen."""
-
-        def mock_popen_func(command):
-            # Only mock sbatch calls, let other calls through or return empty
-            if "sbatch" in command:
-                # Track how many sbatch calls we've made
-                if not hasattr(mock_popen_func, "sbatch_count"):
-                    mock_popen_func.sbatch_count = 0
-
-                mock_popen_func.sbatch_count += 1
-                if mock_popen_func.sbatch_count in [1, 2, 3, 4, 5, 6, 7, 8]:
-                    return_value = {
-                        1: "Submitted batch job 12345",
-                        2: "Submitted batch job 12346",
-                        3: "Submitted batch job 12347",
-                        4: "Submitted batch job 12348",
-                        5: "Submitted batch job 12349",
-                        6: "Submitted batch job 12350",
-                        7: "Submitted batch job 12351",
-                        8: "Submitted batch job 12352",
-                    }[mock_popen_func.sbatch_count]
-                    return MagicMock(read=MagicMock(return_value=return_value))
-                else:
-                    return MagicMock(
-                        read=MagicMock(return_value="Submitted batch job 99999")
-                    )
-            else:
-                # For non-sbatch calls, return empty result
-                return MagicMock(read=MagicMock(return_value=""))
-
-        return mock_popen_func
-
-    @patch("os.popen")
-    def test_basic_workflow(self, mock_popen):
+    def mock_subprocess_run(self, args, input=None, **kwargs):
+        """Mock subprocess.run: sbatch returns job IDs 12345, 12346, ...
+
+        Other SLURM commands (sacct, squeue, ...) return empty results.
+        """
+        self.slurm_calls.append(args)
+        if args[0] == "sbatch":
+            self.sbatch_scripts.append(input)
+            stdout = f"Submitted batch job {next(self.sbatch_ids)}\n"
+            return subprocess.CompletedProcess(args, 0, stdout=stdout, stderr="")
+        return subprocess.CompletedProcess(args, 0, stdout="", stderr="")
+
+    def test_basic_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
 
         ##### Setup test
         submitter = JobSubmitter(self.db_path)
@@ -150,12 +141,9 @@ class TestJrunSimple(unittest.TestCase):
 
         print("Test completed successfully!")
 
-    @patch("os.popen")
-    def test_nested_workflow(self, mock_popen):
+    def test_nested_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
 
         ##### Setup test
         viewer = JobViewer(self.db_path)
@@ -231,12 +219,9 @@ class TestJrunSimple(unittest.TestCase):
         self.assertIn("12345", jobs[2].parents)
         self.assertIn("12346", jobs[2].parents)
 
-    @patch("os.popen")
-    def test_sweep_workflow(self, mock_popen):
+    def test_sweep_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -288,12 +273,9 @@ class TestJrunSimple(unittest.TestCase):
         self.assertIn("12347", job_ids_list)
         self.assertIn("12348", job_ids_list)
 
-    @patch("os.popen")
-    def test_nested_seqs_workflow(self, mock_popen):
+    def test_nested_seqs_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -355,12 +337,9 @@ class TestJrunSimple(unittest.TestCase):
         self.assertIn("12345", jobs[1].parents)
         self.assertIn("12346", jobs[2].parents)
 
-    @patch("os.popen")
-    def test_groupid_workflow(self, mock_popen):
+    def test_groupid_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -400,12 +379,9 @@ class TestJrunSimple(unittest.TestCase):
         jobs = viewer.get_jobs()
         self.assertIn("--dry", jobs[0].command)
 
-    @patch("os.popen")
-    def test_dryrun_workflow(self, mock_popen):
+    def test_dryrun_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -459,12 +435,9 @@ class TestJrunSimple(unittest.TestCase):
             group_id_first,
         )
 
-    @patch("os.popen")
-    def test_groupname_workflow(self, mock_popen):
+    def test_groupname_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -528,12 +501,9 @@ class TestJrunSimple(unittest.TestCase):
             elif job.command.startswith("echo 'Third job'"):
                 self.assertEqual(job.node_name, "a:c")
 
-    @patch("os.popen")
-    def test_nested_loop_workflow(self, mock_popen):
+    def test_nested_loop_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -615,12 +585,9 @@ class TestJrunSimple(unittest.TestCase):
             self.assertIsNotNone(match, f"Loop index not found in job {i} command")
             self.assertEqual(int(match.group(1)), i, f"Loop index mismatch for job {i}")  # type: ignore
 
-    @patch("os.popen")
-    def test_loop_seq_workflow(self, mock_popen):
+    def test_loop_seq_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -700,12 +667,9 @@ class TestJrunSimple(unittest.TestCase):
             f"Loop IDs should be the same for job {i} and {i + 1}",
         )
 
-    @patch("os.popen")
-    def test_loop_parallel_workflow(self, mock_popen):
+    def test_loop_parallel_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -791,12 +755,9 @@ class TestJrunSimple(unittest.TestCase):
             "Node IDs should match the expected pattern",
         )
 
-    @patch("os.popen")
-    def test_loop_parallel_node_id_workflow(self, mock_popen):
+    def test_loop_parallel_node_id_workflow(self):
         """Test that jobs are submitted correctly."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -895,12 +856,9 @@ class TestJrunSimple(unittest.TestCase):
             "Node IDs should match the expected pattern",
         )
 
-    @patch("os.popen")
-    def test_node_ids_workflow(self, mock_popen):
+    def test_node_ids_workflow(self):
         """Test that jobs are submitted correctly with node IDs."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -957,12 +915,9 @@ class TestJrunSimple(unittest.TestCase):
             [j.node_id for j in jobs], [jobs[0].node_id] * 2 + [jobs[2].node_id] * 2
         )
 
-    @patch("os.popen")
-    def test_node_idx_workflow(self, mock_popen):
+    def test_node_idx_workflow(self):
         """Test that jobs are submitted correctly with node IDs."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -1021,12 +976,9 @@ class TestJrunSimple(unittest.TestCase):
         jobs = viewer.get_jobs()
         self.assertEqual([parse_idx(j.command) for j in jobs], [None, None, "0", "1"])
 
-    @patch("os.popen")
-    def test_group_node_id_workflow(self, mock_popen):
+    def test_group_node_id_workflow(self):
         """Test that jobs are submitted correctly with node IDs."""
 
-        ##### Setup mocks
-        mock_popen.side_effect = self.get_popen_mock_fn()
         viewer = JobViewer(self.db_path)
         submitter = JobSubmitter(self.db_path)
         root = {
@@ -1096,8 +1048,773 @@ class TestJrunSimple(unittest.TestCase):
             "Node IDs should be the same for parallel group",
         )
 
+    def test_array_sweep_workflow(self):
+        """Test that array sweeps are submitted as a single job array."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "name": "root",
+                "type": "sequential",
+                "jobs": [
+                    {
+                        "group": {
+                            "name": "sweep",
+                            "type": "sweep",
+                            "preamble": "base",
+                            "array": True,
+                            "sweep": {
+                                "param1": [1, 2],
+                                "param2": ["a", "b"],
+                            },
+                            "sweep_template": "python test.py --p1 {param1} --p2 {param2}",
+                        }
+                    },
+                    {
+                        "job": {
+                            "preamble": "base",
+                            "command": "echo 'After sweep'",
+                        },
+                    },
+                ],
+            }
+        }
+
+        submitter.walk(
+            node=submitter._parse_group_dict(root["group"]),
+            node_name=root["group"]["name"],
+            preamble_map=self.preamble_map,
+            depends_on=[],
+            submitted_jobs=[],
+        )
+
+        # Verify submission (one sbatch for the array, one for the last job)
+        self.assertEqual(len(self.sbatch_scripts), 2)
+        self.assertIn("#SBATCH --array=0-3", self.sbatch_scripts[0])
+        # The child of the whole array depends on the array, not on each task
+        self.assertIn("#SBATCH --dependency=afterok:12345\n", self.sbatch_scripts[1])
+
+        jobs = viewer.get_jobs()
+        self.assertEqual(
+            [j.id for j in jobs],
+            ["12345_0", "12345_1", "12345_2", "12345_3", "12346"],
+        )
+        self.assertEqual(jobs[4].parents, [f"12345_{i}" for i in range(4)])
+        self.assertIn("--p1 2 --p2 b", jobs[3].command)
+
+    def test_array_script(self):
+        """Test that array scripts select commands by SLURM_ARRAY_TASK_ID."""
+        jobs = [
+            Job(
+                id=str(i),
+                command=f"python test.py --idx {i}",
+                preamble="#!/bin/bash\n#SBATCH --output=logs/%j.out",
+                parents=["111"],
+            )
+            for i in range(3)
+        ]
+        script = to_array_script(jobs)
+        self.assertIn("#SBATCH --array=0-2", script)
+        self.assertIn("#SBATCH --output=logs/%A_%a.out", script)
+        self.assertIn("#SBATCH --dependency=afterok:111", script)
+        self.assertIn("'python test.py --idx 2'", script)
+        self.assertIn("${AGORA_CMDS[$SLURM_ARRAY_TASK_ID]}", script)
+
+        # Array task IDs resolve log paths and pending array records
+        submitter = JobSubmitter(self.db_path)
+        out, _ = submitter._parse_preamble("#SBATCH --output=logs/%A_%a.out", "12_3")
+        self.assertEqual(out, "logs/12_3.out")
+        self.assertEqual(
+            submitter._expand_array_id("12_[0-2,5%2]"),
+            ["12_0", "12_1", "12_2", "12_5"],
+        )
+
+        # A task resubmitted alone logs to %j again
+        task = Job(id="12_3", command="python test.py --idx 3", preamble="#SBATCH --output=logs/%A_%a.out")
+        submitter._submit_job(task, prev_job_id="12_3")
+        self.assertIn("#SBATCH --output=logs/%j.out", self.sbatch_scripts[-1])
+        self.assertEqual(submitter._parse_preamble(task.preamble, task.id)[0], "logs/12345.out")
+
+    def test_submit_plan_waves(self):
+        """Test that plans are submitted wave by wave with resolved parents."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "name": "root",
+                "type": "sequential",
+                "jobs": [
+                    {
+                        "group": {
+                            "type": "sweep",
+                            "preamble": "base",
+                            "sweep": {"param1": [1, 2, 3]},
+                            "sweep_template": "python test.py --p1 {param1}",
+                        }
+                    },
+                    {
+                        "job": {
+                            "preamble": "base",
+                            "command": "echo 'After sweep'",
+                        },
+                    },
+                ],
+            }
+        }
+
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        self.assertEqual(len(self.sbatch_scripts), 0)
+        self.assertEqual([len(w) for w in submitter._plan_waves(plan)], [1, 1])
+
+        resolved = submitter.submit_plan(plan, max_workers=3, batch_size=2)
+        self.assertEqual([len(ids) for ids in resolved.values()], [3, 1])
+
+        jobs = viewer.get_jobs()
+        self.assertEqual(len(jobs), 4)
+        last = [j for j in jobs if j.command == "echo 'After sweep'"][0]
+        self.assertEqual(last.id, "12348")
+        self.assertEqual(
+            sorted(last.parents), sorted(j.id for j in jobs if j.id != last.id)
+        )
+
+    def test_submit_plan_wave_dedup(self):
+        """Test that duplicate commands in one wave are submitted once."""
+
+        submitter = JobSubmitter(self.db_path)
+        job = {"job": {"preamble": "base", "command": "echo 'same'"}}
+        root = {"group": {"type": "parallel", "jobs": [job, job, job]}}
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+
+        with submitter.submit_session():
+            resolved = submitter.submit_plan(plan, max_workers=3)
+        self.assertEqual(len(self.sbatch_scripts), 1)
+        self.assertEqual(sorted(resolved.values()), [["12345"]] * 3)
+
+    def test_submit_session_dedup(self):
+        """Test that a submit session dedups commands without extra sacct calls."""
+
+        submitter = JobSubmitter(self.db_path)
+        job = lambda: Job(id="0", command="echo 'same'", preamble="#!/bin/bash")
+
+        with submitter.submit_session():
+            first_id = submitter._submit_job(job())
+            second_id = submitter._submit_job(job())
+
+        self.assertEqual(first_id, "12345")
+        self.assertEqual(second_id, "12345")
+        self.assertEqual(len(self.sbatch_scripts), 1)
+        self.assertNotIn("sacct", [args[0] for args in self.slurm_calls])
+
+    def test_bulk_writes_fallback(self):
+        """Test that a failed batch write records the other jobs and keeps the submit error."""
+
+        submitter = JobSubmitter(self.db_path)
+        rec = lambda i: JobInsert(
+            id=str(i), command=f"echo {i}", preamble="", created_at="2024", updated_at="2024"
+        )
+        submitter.create_job(rec(2))  # Conflicts with the second buffered insert
+        write_jobs = submitter.write_jobs
+
+        def failing_write_jobs(inserts, updates=None, deps=None):
+            if any(r.id == "4" for r in inserts):
+                raise sqlite3.OperationalError("disk I/O error")
+            write_jobs(inserts, updates, deps)
+
+        parents = {3: ["1"], 5: ["1", "4"]}  # Job 4 is never recorded
+        with patch.object(submitter, "write_jobs", side_effect=failing_write_jobs):
+            with self.assertRaisesRegex(RuntimeError, "sbatch failed"):
+                with submitter.bulk_writes():
+                    for i in (1, 2, 3, 4, 5):
+                        submitter._record_job(rec(i), parents.get(i, []))
+                    raise RuntimeError("sbatch failed")
+
+        jobs = {job.id: job for job in JobViewer(self.db_path).get_jobs(ignore_status=True)}
+        self.assertEqual(sorted(jobs), ["1", "2", "3", "5"])
+        self.assertEqual((jobs["3"].parents, jobs["5"].parents), (["1"], ["1"]))
+
+    def test_script_cache(self):
+        """Test that scripts are piped to sbatch and kept by content hash."""
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            submitter = JobSubmitter(self.db_path, script_cache_dir=cache_dir)
+            job = Job(id="0", command="echo 'cached'", preamble="#!/bin/bash")
+            submitter._submit_job(job)
+
+            self.assertEqual(len(self.sbatch_scripts), 1)
+            self.assertTrue(self.sbatch_scripts[0].endswith("echo 'cached'"))
+            cached = os.listdir(cache_dir)
+            self.assertEqual(len(cached), 1)
+            with open(os.path.join(cache_dir, cached[0])) as f:
+                self.assertEqual(f.read(), self.sbatch_scripts[0])
+
+    def test_sweep_sampling(self):
+        """Test that sampled sweeps never exceed k and stay within the grid."""
+        grid = {"a": list(range(100)), "b": list(range(100)), "c": ["x", "y"]}
+        spec = lambda sample: SweepSpec(template="", sweep=grid, sample=sample)
+
+        full = spec({})
+        self.assertEqual(full.size, 20000)
+        first = list(itertools.islice(full.iter_params(), 3))
+        self.assertEqual(first[2], {"a": 0, "b": 1, "c": "x"})
+        self.assertEqual(full._combination(2), first[2])
+
+        rand = list(spec({"mode": "random", "k": 50, "seed": 0}).iter_params())
+        self.assertEqual(len(rand), 50)
+        self.assertEqual(len({tuple(p.values()) for p in rand}), 50)
+
+        stride = list(spec({"mode": "stride", "step": 1000}).iter_params())
+        self.assertEqual(len(stride), 20)
+        self.assertEqual(stride[1], full._combination(1000))
+
+        latin = list(spec({"mode": "latin", "k": 10, "seed": 0}).iter_params())
+        self.assertEqual(len(latin), 10)
+        # One sample per stratum of each dimension
+        self.assertEqual(sorted(p["a"] // 10 for p in latin), list(range(10)))
+
+        with self.assertRaises(ValueError):
+            list(spec({"mode": "unknown"}).iter_params())
+
+    def test_compiled_plan_cache(self):
+        """Test that compiled plans are cached by file hash and get fresh IDs on load."""
+        workflow = "\n".join(
+            [
+                "preambles:",
+                "  base:",
+                "    - '#!/bin/bash'",
+                "group:",
+                "  type: sequential",
+                "  jobs:",
+                "    - job:",
+                "        preamble: base",
+                "        command: 'echo first --group_id {group_id}'",
+                "    - group:",
+                "        type: sweep",
+                "        preamble: base",
+                "        sweep: {p: [1, 2]}",
+                "        sweep_template: 'echo {p} --group_id {group_id}'",
+            ]
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "workflow.yaml")
+            with open(file, "w") as f:
+                f.write(workflow)
+            submitter = JobSubmitter(
+                self.db_path, plan_cache_dir=os.path.join(tmp_dir, "plans")
+            )
+
+            compiled = submitter.compile_plan(file)
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, "plans"))), 1)
+            with patch("yaml.safe_load") as mock_load:
+                self.assertEqual(submitter.compile_plan(file), compiled)
+                mock_load.assert_not_called()
+
+            first, second = submitter.load_plan(compiled), submitter.load_plan(compiled)
+            self.assertEqual([n.key for n in first], ["plan-0", "plan-1"])
+            self.assertEqual(first[1].parents, ["plan-0"])
+            self.assertRegex(first[0].job.command, r"^echo first --group_id \d+-\d+$")
+            self.assertNotEqual(first[0].job.command, second[0].job.command)
+
+            submitter.submit_plan(first)
+            jobs = submitter.get_jobs()
+            self.assertEqual(len(jobs), 3)
+            self.assertEqual(jobs[1].parents, [jobs[0].id])
+
+    def test_deep_workflow(self):
+        """Test that trees deeper than the recursion limit can be walked."""
+
+        submitter = JobSubmitter(self.db_path)
+        node = PJob(preamble="base", command="echo 'leaf'")
+        depth = sys.getrecursionlimit() + 100
+        for i in range(depth):
+            node = PGroup(type="sequential", name=f"g{i % 3}", jobs=[node])
+        node = PGroup(
+            type="sequential",
+            jobs=[PJob(preamble="base", command="echo 'first'"), node],
+        )
+
+        ids = []
+        result = submitter.walk(
+            node, self.preamble_map, submit_fn=lambda job: ids.append(job) or job.id
+        )
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(result, [ids[1].id])
+        self.assertEqual(ids[1].parents, [ids[0].id])
+        self.assertEqual(ids[1].node_name.count(":"), depth - 1)
+
+    def test_pack_workflow(self):
+        """Test that packed sweeps and parallel groups share one allocation each."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "sequential",
+                "jobs": [
+                    {
+                        "group": {
+                            "type": "sweep",
+                            "preamble": "base",
+                            "pack": 2,
+                            "sweep": {"param1": [1, 2, 3]},
+                            "sweep_template": "python test.py --p1 {param1}",
+                        }
+                    },
+                    {
+                        "group": {
+                            "type": "parallel",
+                            "pack": 4,
+                            "jobs": [
+                                {"job": {"preamble": "base", "command": "echo 'a'"}},
+                                {"job": {"preamble": "base", "command": "echo 'b'"}},
+                                {"group": {"type": "sequential", "jobs": [
+                                    {"job": {"preamble": "base", "command": "echo 'c'"}},
+                                ]}},
+                            ],
+                        }
+                    },
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)
+
+        # Sweep allocation, then the packed pair and the unpacked nested job
+        self.assertEqual(len(self.sbatch_scripts), 3)
+        self.assertIn("#SBATCH --ntasks=2", self.sbatch_scripts[0])
+        self.assertIn("srun --exact", self.sbatch_scripts[0])
+        self.assertIn("exit $AGORA_FAILED", self.sbatch_scripts[0])
+        # Children depend on the allocation, not on its steps
+        self.assertIn("#SBATCH --dependency=afterok:12345\n", self.sbatch_scripts[1])
+        self.assertIn("#SBATCH --dependency=afterok:12345\n", self.sbatch_scripts[2])
+
+        jobs = {job.command: job for job in viewer.get_jobs(ignore_status=True)}
+        self.assertEqual(jobs["python test.py --p1 3"].id, "12345.2")
+        self.assertEqual(jobs["python test.py --p1 3"].slurm_out, "test.out")
+        self.assertEqual(
+            sorted(jobs[c].id for c in ["echo 'a'", "echo 'b'", "echo 'c'"]),
+            ["12346", "12347.0", "12347.1"],
+        )
+
+        # Task states come from the steps (by name), or the allocation if not started
+        sacct = "\n".join(
+            [
+                "12345|RUNNING|2024-01-01T00:00:00|Unknown|/work|allocation",
+                "12345.batch|RUNNING|2024-01-01T00:00:00|Unknown||batch",
+                "12345.0|COMPLETED|2024-01-01T00:00:00|2024-01-01T00:01:00||agora-task-1",
+                "12345.1|RUNNING|2024-01-01T00:01:00|Unknown||agora-task-0",
+            ]
+        )
+        with patch.object(
+            submitter.slurm,
+            "run",
+            return_value=subprocess.CompletedProcess([], 0, stdout=sacct, stderr=""),
+        ) as mock_run:
+            states = submitter.get_job_states(["12345.0", "12345.1", "12345.2"])
+        self.assertEqual(mock_run.call_args_list[0].args[0][2], "12345")
+        self.assertEqual(states["12345.0"]["status"], "RUNNING")
+        self.assertEqual(states["12345.1"]["status"], "COMPLETED")
+        self.assertEqual(states["12345.2"]["status"], "PENDING")
+        self.assertEqual(states["12345.2"]["workdir"], "/work")
+
+    def test_visualize_packed_group(self):
+        """Test that packed task IDs are grouped like array tasks in `viz --mode group`."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "sequential",
+                "jobs": [
+                    {
+                        "group": {
+                            "type": "sweep",
+                            "preamble": "base",
+                            "pack": 2,
+                            "sweep": {"param1": [1, 2, 3]},
+                            "sweep_template": "python test.py --p1 {param1}",
+                        }
+                    },
+                    {"job": {"preamble": "base", "command": "echo 'after'"}},
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)
+
+        rows = []
+        with patch("agora.job_viewer.tabulate", side_effect=lambda data, **kw: rows.extend(data) or ""):
+            viewer.visualize_grouped()
+        # (IDS, ..., DEPENDENCIES) of the packed sweep and its child
+        self.assertEqual(
+            [(row[0], row[-1]) for row in rows], [("12345.[0,1,2]", ""), ("12346", "12345.[0,1,2]")]
+        )
+        self.assertEqual(viewer._smart_range_display(["12345_0", "12345_1"]), "12345_[0,1]")
+        self.assertEqual(viewer._smart_range_display(["1.0", "2_0", "3"]), "1.0...3 (3)")
+
+    def test_retry_dry(self):
+        """Test that repeated dry retries append --dry to the commands only once."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "type": "sequential",
+            "jobs": [
+                {
+                    "group": {
+                        "type": "sweep",
+                        "array": True,
+                        "preamble": "base",
+                        "sweep": {"param1": [1, 2]},
+                        "sweep_template": "python train.py param1={param1}",
+                    }
+                },
+                {"job": {"preamble": "base", "command": "python eval.py"}},
+            ],
+        }
+        submitter.submit_plan(
+            submitter.build_plan(submitter._parse_group_dict(root), self.preamble_map)
+        )
+        for _ in range(2):
+            job_ids = [job.id for job in viewer.get_jobs(ignore_status=True)]
+            submitter.retry_jobs(job_ids, dry=True)
+
+        commands = sorted(job.command for job in viewer.get_jobs(ignore_status=True))
+        self.assertEqual(
+            commands,
+            [
+                "python eval.py --dry",
+                "python train.py param1=1 --dry",
+                "python train.py param1=2 --dry",
+            ],
+        )
+        self.assertTrue(self.sbatch_scripts[-1].endswith("python eval.py --dry"))
+
+    def test_retry_subgraph(self):
+        """Test that a retry resubmits a diamond sub-DAG once, in order, with one sacct call."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "sequential",
+                "jobs": [
+                    {"job": {"preamble": "base", "command": "echo 'prep'"}},
+                    {"job": {"preamble": "base", "command": "echo 'train'"}},
+                    {
+                        "group": {
+                            "type": "parallel",
+                            "jobs": [
+                                {"job": {"preamble": "base", "command": "echo 'eval1'"}},
+                                {"job": {"preamble": "base", "command": "echo 'eval2'"}},
+                            ],
+                        }
+                    },
+                    {"job": {"preamble": "base", "command": "echo 'report'"}},
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)  # 12345 ... 12349
+        self.sbatch_scripts.clear()
+        self.slurm_calls.clear()
+
+        old_to_new = submitter.retry_jobs(["12346"])
+        # The two evals are submitted concurrently, in either order
+        self.assertEqual(old_to_new["12346"], ["12350"])
+        self.assertEqual(
+            sorted(old_to_new["12347"] + old_to_new["12348"]), ["12351", "12352"]
+        )
+        self.assertEqual(old_to_new["12349"], ["12353"])
+        # One sacct call for the parent outside of the sub-DAG
+        self.assertEqual(
+            [args[0] for args in self.slurm_calls], ["sacct"] + ["sbatch"] * 4
+        )
+        self.assertEqual(self.slurm_calls[0][2], "12345")
+        self.assertIn("#SBATCH --dependency=afterok:12345", self.sbatch_scripts[0])
+        self.assertRegex(
+            self.sbatch_scripts[3],
+            r"#SBATCH --dependency=afterok:(12351:12352|12352:12351)\n",
+        )
+
+        jobs = {job.command: job for job in viewer.get_jobs(ignore_status=True)}
+        self.assertEqual(len(jobs), 5)
+        self.assertEqual(jobs["echo 'report'"].id, "12353")
+        self.assertEqual(sorted(jobs["echo 'report'"].parents), ["12351", "12352"])
+        self.assertEqual(jobs["echo 'prep'"].children, ["12350"])
+
+    def test_delete_cascade(self):
+        """Test that a cascade delete removes the sub-DAG at once and batches scancel."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "sequential",
+                "jobs": [
+                    {"job": {"preamble": "base", "command": "echo 'prep'"}},
+                    {
+                        "group": {
+                            "type": "parallel",
+                            "jobs": [
+                                {"job": {"preamble": "base", "command": "echo 'a'"}},
+                                {"job": {"preamble": "base", "command": "echo 'b'"}},
+                            ],
+                        }
+                    },
+                    {"job": {"preamble": "base", "command": "echo 'report'"}},
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)  # 12345 ... 12348
+        self.slurm_calls.clear()
+
+        submitter.delete(["12346", "404"], cascade=True)
+        self.assertEqual([job.id for job in viewer.get_jobs(ignore_status=True)], ["12345", "12347"])
+        self.assertEqual(self.slurm_calls, [["scancel", "12346", "12348"]])
+
+        self.slurm_calls.clear()
+        submitter.cancel_jobs(["1", "2", "3"], chunk_size=2)
+        self.assertEqual(self.slurm_calls, [["scancel", "1", "2"], ["scancel", "3"]])
+
+    def test_chunked_sacct(self):
+        """Test that job states are fetched in -X chunks and merged in order."""
+
+        submitter = JobSubmitter(self.db_path)
+        submitter.sacct_chunk_size = 2
+        outputs = {
+            "1,2": "1|COMPLETED|s|e|/w|a\n2|CANCELLED by 42|s|e|/w|b",
+            "3,4": "3|FAILED|s|e|/w|c\nbogus line\n4_[0-1]|PENDING|||/w|d",
+            "5": "5|RUNNING|s||/w|e",
+        }
+
+        def sacct(args, input=None):
+            if args[0] != "sacct":
+                return subprocess.CompletedProcess(args, 0, stdout="", stderr="")
+            self.assertIn("-X", args)
+            return subprocess.CompletedProcess(args, 0, stdout=outputs[args[2]], stderr="")
+
+        with patch.object(submitter.slurm, "run", side_effect=sacct):
+            states = submitter.get_job_states(["1", "2", "3", "4", "5"])
+        self.assertEqual(
+            {job_id: state["status"] for job_id, state in states.items()},
+            {
+                "1": "COMPLETED",
+                "2": "CANCELLED",
+                "3": "FAILED",
+                "4_0": "PENDING",
+                "4_1": "PENDING",
+                "5": "RUNNING",
+            },
+        )
+        self.assertEqual([stat["ids"] for stat in submitter.fetch_stats], [2, 2, 1])
+
+    def test_pending_reasons(self):
+        """Test that BLOCKED jobs and pending reasons come from a single squeue call."""
+
+        submitter = JobSubmitter(self.db_path)
+        outputs = {
+            "sacct": "1|PENDING|||/w|a\n2|PENDING|||/w|b\n3_[0-1]|PENDING|||/w|c\n4|RUNNING|s||/w|d",
+            "squeue": "1|(DependencyNeverSatisfied)\n2|(Priority)\n3_[0-1]|(Resources)\n99|(Priority)",
+        }
+
+        def slurm(args, input=None):
+            return subprocess.CompletedProcess(args, 0, stdout=outputs[args[0]], stderr="")
+
+        with patch.object(submitter.slurm, "run", side_effect=slurm) as mock_run:
+            states = submitter.get_job_states(["1", "2", "3", "4"])
+        self.assertEqual([call.args[0][0] for call in mock_run.call_args_list], ["sacct", "squeue"])
+        self.assertEqual(
+            {job_id: (state["status"], state.get("reason")) for job_id, state in states.items()},
+            {
+                "1": ("BLOCKED", "DependencyNeverSatisfied"),
+                "2": ("PENDING", "Priority"),
+                "3_0": ("PENDING", "Resources"),
+                "3_1": ("PENDING", "Resources"),
+                "4": ("RUNNING", None),
+            },
+        )
+
+    def test_stored_states(self):
+        """Test that finished jobs are not re-queried and status filters run in SQL."""
+
+        viewer = JobViewer(self.db_path)
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "parallel",
+                "jobs": [
+                    {"job": {"preamble": "base", "command": "echo 'a'"}},
+                    {"job": {"preamble": "base", "command": "echo 'b'"}},
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)  # 12345, 12346
+        outputs = {
+            "12345,12346": "12345|COMPLETED|s|e|/w|a|0:0\n12346|RUNNING|s||/w|b|0:0",
+            "12346": "12346|FAILED|s|e|/w|b|1:0",
+        }
+        queried = []
+
+        def sacct(args, input=None):
+            if args[0] != "sacct":
+                return subprocess.CompletedProcess(args, 0, stdout="", stderr="")
+            ids = ",".join(sorted(args[2].split(",")))
+            queried.append(ids)
+            return subprocess.CompletedProcess(args, 0, stdout=outputs[ids], stderr="")
+
+        with patch.object(viewer.slurm, "run", side_effect=sacct):
+            jobs = {job.id: job for job in viewer.get_jobs()}
+            self.assertEqual(jobs["12345"].status, "COMPLETED")
+            self.assertEqual(jobs["12346"].status, "RUNNING")
+            self.assertEqual(jobs["12345"].slurm_out, "/w/test.out")
+            failed = viewer.get_jobs(filters=["status=failed"])
+            self.assertEqual([(job.id, job.exit_code) for job in failed], [("12346", "1:0")])
+            # Everything is finished: nothing left to poll
+            self.assertEqual(len(viewer.get_jobs()), 2)
+        self.assertEqual(queried, ["12345,12346", "12346"])
+
+    def test_status_poller(self):
+        """Test that the poller syncs states incrementally and readers use them."""
+
+        submitter = JobSubmitter(self.db_path)
+        root = {
+            "group": {
+                "type": "sequential",
+                "jobs": [
+                    {"job": {"preamble": "base", "command": "echo 'a'"}},
+                    {"job": {"preamble": "base", "command": "echo 'b'"}},
+                ],
+            }
+        }
+        plan = submitter.build_plan(
+            submitter._parse_group_dict(root["group"]), self.preamble_map
+        )
+        submitter.submit_plan(plan)  # 12345, 12346
+        poller = StatusPoller(self.db_path, interval=60)
+        outputs = {
+            "-j": "12345|RUNNING|s||/w|a|0:0\n12346|PENDING|||/w|b|0:0",
+            "-S": "12345|COMPLETED|s|e|/w|a|0:0\n12346|PENDING|||/w|b|0:0\n999|RUNNING|s||/w|x|0:0",
+        }
+        calls = []
+
+        def slurm(args, input=None):
+            calls.append(args[:2])
+            stdout = outputs[args[1]] if args[0] == "sacct" else "12346|(Dependency)"
+            return subprocess.CompletedProcess(args, 0, stdout=stdout, stderr="")
+
+        viewer = JobViewer(self.db_path)
+        with patch.object(poller.slurm, "run", side_effect=slurm):
+            self.assertEqual(
+                poller.poll_once(),
+                [("12345", "UNKNOWN", "RUNNING"), ("12346", "UNKNOWN", "PENDING")],
+            )
+            self.assertEqual(poller.poll_once(), [("12345", "RUNNING", "COMPLETED")])
+            self.assertEqual(calls[0], ["sacct", "-j"])
+            self.assertEqual([call[:2] for call in calls[2:]], [["sacct", "-S"], ["squeue", "--me"]])
+
+            # Readers trust the stored states while the poller is alive
+            calls.clear()
+            jobs = {job.id: job for job in viewer.get_jobs()}
+            self.assertEqual(calls, [])
+        self.assertEqual(jobs["12345"].status, "COMPLETED")
+        self.assertEqual(jobs["12346"].reason, "Dependency")
+        self.assertNotIn("999", jobs)
+
+    def test_schema_migration(self):
+        """Test that a DB with the original schema is upgraded in place."""
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        db_path = os.path.join(tmp_dir.name, "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.executescript(
+            """
+            CREATE TABLE jobs (
+                id TEXT PRIMARY KEY, command TEXT NOT NULL, preamble TEXT NOT NULL,
+                created_at TEXT NOT NULL, updated_at TEXT NOT NULL, node_id TEXT, node_name TEXT
+            );
+            CREATE TABLE deps (
+                parent TEXT NOT NULL, child TEXT NOT NULL, dep_type TEXT NOT NULL,
+                UNIQUE (parent, child, dep_type)
+            );
+            CREATE VIEW vw_jobs AS SELECT j.*,
+                (SELECT GROUP_CONCAT(d.child, ',') FROM deps d WHERE d.parent = j.id) AS children,
+                (SELECT GROUP_CONCAT(d2.parent, ',') FROM deps d2 WHERE d2.child = j.id) AS parents
+            FROM jobs j;
+            INSERT INTO jobs VALUES ('1', 'echo a', '', '2024-01-01', '2024-01-01', 'n', 'x');
+            INSERT INTO jobs VALUES ('2', 'echo b', '', '2024-01-02', '2024-01-02', 'n', 'x');
+            INSERT INTO deps VALUES ('1', '2', 'afterok');
+            """
+        )
+        conn.close()
+
+        submitter = JobSubmitter(db_path)
+        jobs = submitter.get_jobs(ignore_status=True)
+        self.assertEqual([(job.id, job.parents, job.children) for job in jobs], [("1", [], ["2"]), ("2", ["1"], [])])
+        self.assertEqual(submitter._find_prev_job("echo b").id, "2")
+        # Existing jobs are reported as changes since cursor 0
+        cursor, changed, deleted = submitter.get_changes(0, ignore_status=True)
+        self.assertEqual(([job.id for job in changed], deleted), (["1", "2"], []))
+        self.assertEqual(cursor, 1)
+
+        conn = sqlite3.connect(db_path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.close()
+        self.assertTrue({"idx_deps_child", "idx_jobs_node_id", "idx_jobs_command_hash"} <= indexes)
+
+        # Up to date DBs are left alone
+        JobSubmitter(db_path)
+        self.assertEqual(len(JobSubmitter(db_path).get_jobs(ignore_status=True)), 2)
+
+    def test_db_connections(self):
+        """Test that connections are reused per thread and concurrent writers don't fail."""
+
+        viewer = JobViewer(self.db_path)
+        conn = viewer._connection()
+        self.assertIs(JobViewer(self.db_path)._connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        def write(worker):
+            db = JobSubmitter(self.db_path)
+            self.assertIsNot(db._connection(), conn)
+            for i in range(25):
+                db.write_jobs(
+                    [
+                        JobInsert(
+                            id=f"{worker}-{i}",
+                            command=f"echo {worker} {i}",
+                            preamble="",
+                            created_at="2024-01-01",
+                            updated_at="2024-01-01",
+                        )
+                    ]
+                )
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(write, range(8)))
+        self.assertEqual(len(viewer.get_jobs(ignore_status=True)), 200)
+
     # @patch("os.popen")
-    # def test_sbatch_args(self, mock_popen):
+    # def test_sbatch_args(self):
     #     """Test that sbatch args are passed correctly."""
 
     #     ##### Setup mocks
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for job filter expressions (parsing, SQL compilation and get_jobs).
+"""
+
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from agora.filters import compile_filters, parse_filter
+from agora.interfaces import JobInsert
+from agora.job_viewer import JobViewer
+
+
+class TestFilters(unittest.TestCase):
+    """Tests for agora.filters and JobDB.get_jobs filtering."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.viewer = JobViewer(os.path.join(self.tmp.name, "jobs.db"))
+        self.sacct_ids = []
+        run_patcher = patch.object(
+            self.viewer.slurm, "run", side_effect=self.mock_slurm_run
+        )
+        run_patcher.start()
+        self.addCleanup(run_patcher.stop)
+
+        # (id, command, node_name, created_at, status)
+        jobs = [
+            ("1", "python train.py --lr 0.1", "train-a", "2024-05-01 10:00:00", "COMPLETED"),
+            ("2", "python train.py --lr 0.01", "train-b", "2024-05-02 10:00:00", "FAILED"),
+            ("3", "python eval.py", "eval", "2024-06-01 10:00:00", "TIMEOUT"),
+            ("4", "echo 50%_done", None, "2024-06-02 10:00:00", "RUNNING"),
+        ]
+        self.viewer.write_jobs(
+            [
+                JobInsert(
+                    id=job_id,
+                    command=command,
+                    preamble="",
+                    created_at=created_at,
+                    updated_at=created_at,
+                    node_name=node_name,
+                )
+                for job_id, command, node_name, created_at, _ in jobs
+            ]
+        )
+        self.viewer._store_states(
+            {job[0]: {"status": job[4]} for job in jobs}, [job[0] for job in jobs]
+        )
+
+    def mock_slurm_run(self, args, input=None):
+        """Mock SlurmClient.run: sacct reports job 4 as COMPLETED now."""
+        if args[0] == "sacct":
+            self.sacct_ids.append(args[2])
+            return subprocess.CompletedProcess(args, 0, "4|COMPLETED|s|e|/w|x|0:0", "")
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    def ids(self, *filters, ignore_status=True):
+        return [job.id for job in self.viewer.get_jobs(list(filters), ignore_status=ignore_status)]
+
+    def test_terms(self):
+        """Test IN-lists, negation, substrings, prefixes and ranges."""
+        self.assertEqual(self.ids("status=failed,TIMEOUT"), ["2", "3"])
+        self.assertEqual(self.ids("job_id=1,3"), ["1", "3"])
+        self.assertEqual(self.ids("node_name!=eval"), ["1", "2", "4"])
+        self.assertEqual(self.ids("command~TRAIN.PY"), ["1", "2"])
+        self.assertEqual(self.ids("command!~train"), ["3", "4"])
+        self.assertEqual(self.ids("command~50%_"), ["4"])
+        self.assertEqual(self.ids("group^=train-"), ["1", "2"])
+        self.assertEqual(self.ids("created_at>=2024-05-02", "created_at<2024-06-02"), ["2", "3"])
+        self.assertEqual(self.ids("created_at>2024-05-01T12:00"), ["2", "3", "4"])
+        self.assertEqual(self.ids('command="python eval.py"'), ["3"])
+        # Unquoted substrings with spaces, as the original LIKE filters
+        self.assertEqual(self.ids("command~python train.py --lr 0.01"), ["2"])
+        self.assertEqual(self.ids("command!~python train.py or status=FAILED"), ["2", "3", "4"])
+
+    def test_boolean_expressions(self):
+        """Test or/and/not, grouping and implicit AND between terms."""
+        self.assertEqual(self.ids("status=FAILED | node_name=eval"), ["2", "3"])
+        self.assertEqual(self.ids("command~train and not status=COMPLETED"), ["2"])
+        self.assertEqual(self.ids("!(status=COMPLETED or status=FAILED) command~py"), ["3"])
+        self.assertEqual(self.ids("not node_name^=train"), ["3", "4"])
+        self.assertEqual(
+            parse_filter("job_id=1 (status=X || id=2)"),
+            (
+                "and",
+                [
+                    ("term", "id", "=", ["1"]),
+                    ("or", [("term", "status", "=", ["X"]), ("term", "id", "=", ["2"])]),
+                ],
+            ),
+        )
+
+    def test_invalid_filters(self):
+        """Test that unknown fields, bad ranges and syntax errors are rejected."""
+        for bad in ["foo=1", "id; DROP TABLE jobs=1", "status>A", "(status=A", "status=A)", "or"]:
+            with self.assertRaises(ValueError, msg=bad):
+                compile_filters([bad])
+
+    def test_status_refresh(self):
+        """Test that only unfinished jobs that may match are refreshed."""
+        self.assertEqual(self.ids("status=COMPLETED", ignore_status=False), ["1", "4"])
+        self.assertEqual(self.sacct_ids, ["4"])
+        # Job 4 is finished now (and job 3 was already)
+        self.assertEqual(self.ids("node_name=eval", ignore_status=False), ["3"])
+        self.assertEqual(self.sacct_ids, ["4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
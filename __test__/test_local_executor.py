@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the local (process pool) executor.
+"""
+
+import os
+import tempfile
+import unittest
+
+from agora.executors import LocalExecutor, parse_sbatch_directives
+from agora.job_submitter import JobSubmitter
+from agora.job_viewer import JobViewer
+
+
+class TestLocalExecutor(unittest.TestCase):
+    """Run small workflows with agora.executors.LocalExecutor (no SLURM)."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = os.path.join(self.tmp.name, "jobs.db")
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def write_workflow(self, jobs, array=False):
+        path = os.path.join(self.tmp.name, "workflow.yaml")
+        lines = [
+            "group:",
+            "  name: root",
+            "  type: sequential",
+            "  jobs:",
+        ]
+        lines.extend(f"    {line}" for line in jobs)
+        lines.extend(
+            [
+                "preambles:",
+                "  base:",
+                '    - "#!/bin/bash"',
+                '    - "#SBATCH --cpus-per-task=2"',
+                '    - "#SBATCH --output=logs/%j.out"',
+                '    - "#SBATCH --error=logs/%j.err"',
+            ]
+        )
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def test_parse_sbatch_directives(self):
+        """Test that long and short #SBATCH flags are parsed."""
+        directives = parse_sbatch_directives(
+            "#!/bin/bash\n#SBATCH -c 4\n#SBATCH --exclusive\n"
+            "#SBATCH --output=logs/%j.out\n#SBATCH --dependency=afterok:1:2\necho hi"
+        )
+        self.assertEqual(directives["--cpus-per-task"], "4")
+        self.assertEqual(directives["--exclusive"], "")
+        self.assertEqual(directives["--output"], "logs/%j.out")
+        self.assertEqual(directives["--dependency"], "afterok:1:2")
+
+    def test_local_workflow(self):
+        """Test that a workflow runs in dependency order and is visible to the viewer."""
+        path = self.write_workflow(
+            [
+                "- job: {preamble: base, command: 'echo first > first.txt'}",
+                "- group:",
+                "    type: sweep",
+                "    preamble: base",
+                "    sweep: {x: [1, 2, 3]}",
+                "    sweep_template: 'cat first.txt && echo {x}'",
+                "- job: {preamble: base, command: 'exit 3'}",
+                "- job: {preamble: base, command: 'echo never'}",
+            ]
+        )
+        submitter = JobSubmitter(self.db_path, executor="local", local_cpus=4)
+        submitter.submit(path)
+
+        jobs = JobViewer(self.db_path).get_jobs()
+        self.assertEqual(len(jobs), 6)
+        statuses = {job.command: job.status for job in jobs}
+        self.assertEqual(statuses["echo first > first.txt"], "COMPLETED")
+        self.assertEqual(statuses["cat first.txt && echo 2"], "COMPLETED")
+        self.assertEqual(statuses["exit 3"], "FAILED")
+        self.assertEqual(statuses["echo never"], "BLOCKED")
+
+        # %j-expanded logs, found by the viewer
+        sweep_job = [job for job in jobs if job.command == "cat first.txt && echo 3"][0]
+        self.assertEqual(sweep_job.slurm_out, os.path.join(os.getcwd(), f"logs/{sweep_job.id}.out"))
+        with open(sweep_job.slurm_out) as f:
+            self.assertEqual(f.read(), "first\n3\n")
+
+        # Already completed commands are not rerun
+        submitter.submit(path)
+        self.assertEqual(len(JobViewer(self.db_path).get_jobs()), 6)
+
+    def test_local_array_afterany(self):
+        """Test array sweeps and afterany dependencies with a CPU cap."""
+        path = self.write_workflow(
+            [
+                "- group:",
+                "    type: sweep",
+                "    preamble: base",
+                "    array: true",
+                "    sweep: {x: [0, 1]}",
+                "    sweep_template: 'echo $SLURM_ARRAY_TASK_ID $SLURM_CPUS_PER_TASK; exit {x}'",
+                "- job: {preamble: base, command: 'echo after'}",
+            ]
+        )
+        submitter = JobSubmitter(
+            self.db_path, deptype="afterany", executor="local", local_cpus=1
+        )
+        self.assertIsInstance(submitter.executor, LocalExecutor)
+        submitter.submit(path)
+
+        jobs = JobViewer(self.db_path).get_jobs()
+        statuses = {job.id: job.status for job in jobs}
+        array_id = jobs[0].id.split("_")[0]
+        self.assertEqual(statuses[f"{array_id}_0"], "COMPLETED")
+        self.assertEqual(statuses[f"{array_id}_1"], "FAILED")
+        self.assertEqual([job.status for job in jobs if "_" not in job.id], ["COMPLETED"])
+        with open(f"logs/{array_id}_1.out") as f:
+            self.assertEqual(f.read(), "1 1\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests for seek-based log reads (line-offset index, tail and byte ranges) and log search.
+"""
+
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from agora import logs
+from agora.logs import LogFile, LogMatch, search_logs
+
+
+class TestLogFile(unittest.TestCase):
+    """Tests for agora.logs.LogFile."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "job.out")
+        self.index_dir = os.path.join(self.tmp.name, "index")
+        # Small strides and chunks, so checkpoints and chunk borders are exercised
+        for name, value in (("INDEX_STRIDE", 3), ("CHUNK_SIZE", 16)):
+            patcher = patch.object(logs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.lines = []
+
+    def append(self, text, mode="a"):
+        with open(self.path, mode) as f:
+            f.write(text)
+        with open(self.path) as f:
+            self.lines = f.readlines()
+
+    def log(self, **kwargs):
+        return LogFile(self.path, self.index_dir, **kwargs)
+
+    def assert_reads(self):
+        total = len(self.lines)
+        for start in range(-2, total + 2):
+            for end in (None, -1, 0, start + 1, start + 4, total + 1):
+                chunk = self.log().lines(start, end)
+                self.assertEqual(chunk.content, "".join(self.lines[start:end]), (start, end))
+                self.assertEqual(chunk.total_lines, total)
+        for n in range(total + 2):
+            chunk = self.log().tail(n)
+            expected = self.lines[max(0, total - n) :] if n else []
+            self.assertEqual(chunk.content, "".join(expected), n)
+            self.assertEqual((chunk.start, chunk.end), (total - len(expected), total))
+
+    def test_growing_file(self):
+        """Test that reads stay correct while the file grows and the index is extended."""
+        self.append("first\n")
+        self.assert_reads()
+        self.append("".join(f"line {i}\n" for i in range(20)) + "no newline yet")
+        self.assert_reads()
+        self.append(", now ended\nand one more\n")
+        self.assert_reads()
+        self.assertEqual(len(os.listdir(self.index_dir)), 1)
+        with patch.object(logs.LogFile, "_save") as save:
+            self.log().tail(1)
+        save.assert_not_called()  # Nothing appended: the stored index is reused
+
+    def test_rewritten_file(self):
+        """Test that the index is rebuilt when the file is truncated or rewritten."""
+        self.append("".join(f"line {i}\n" for i in range(20)))
+        self.assert_reads()
+        self.append("short\n", mode="w")
+        self.assert_reads()
+        self.append("".join(f"other {i}\n" for i in range(30)), mode="w")
+        self.assert_reads()
+
+    def test_byte_reads_and_limit(self):
+        """Test byte-offset reads and that reads are cut to whole lines within max_bytes."""
+        self.append("".join(f"line {i}\n" for i in range(10)))
+        chunk = self.log().read(7, 5)
+        self.assertEqual((chunk.content, chunk.next_offset), ("line ", 12))
+        self.assertEqual(self.log().read(1000).offset, 0)  # truncated since
+
+        chunk = self.log(max_bytes=16).lines(2)
+        self.assertEqual((chunk.content, chunk.end, chunk.truncated), ("line 2\nline 3\n", 4, True))
+        chunk = self.log(max_bytes=16).tail(5)
+        self.assertEqual((chunk.content, chunk.start, chunk.truncated), ("line 8\nline 9\n", 8, True))
+
+
+class TestSearchLogs(unittest.TestCase):
+    """Tests for agora.logs.search_logs."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.object(logs, "CHUNK_SIZE", 16)  # Matches across chunk borders
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_search(self):
+        """Test line numbers across chunks, missing files, ^ anchors and max_count."""
+        lines = [f"step {i}" for i in range(30)]
+        lines[4] = lines[17] = lines[18] = "RuntimeError: CUDA out of memory"
+        a = self.write("a.out", "\n".join(lines))  # No trailing newline
+        b = self.write("b.out", "ok\r\nCUDA out of memory\r\n")
+        files = [("1", a), ("2", b), ("3", os.path.join(self.tmp.name, "missing"))]
+
+        matches = search_logs(files, re.compile(b"CUDA out of memory"), workers=2)
+        found = sorted(matches, key=lambda m: (m.job_id, m.line_number))
+        self.assertEqual(
+            [(m.job_id, m.line_number) for m in found], [("1", 5), ("1", 18), ("1", 19), ("2", 2)]
+        )
+        self.assertEqual(found[0].line, lines[4])
+        self.assertEqual(found[-1], LogMatch("2", b, 2, "CUDA out of memory"))
+
+        found = list(search_logs(files, re.compile(b"^step 2\\d$", re.MULTILINE)))
+        self.assertEqual([m.line_number for m in found], list(range(21, 31)))
+        self.assertEqual(len(list(search_logs(files[:1], re.compile(b"CUDA"), max_count=2))), 2)
+
+    def test_search_without_newlines(self):
+        """Test that \\r progress output without \\n is searched in \\r-delimited pieces."""
+        progress = "".join(f"\r{i}%|###" for i in range(100))
+        path = self.write("tqdm.err", f"start\n{progress}\rCUDA out of memory{progress}\ndone\n")
+        found = list(search_logs([("1", path)], re.compile(b"CUDA|99%|done")))
+        self.assertEqual(
+            [(m.line_number, m.line) for m in found],
+            [(2, "99%|###"), (2, "CUDA out of memory"), (2, "99%|###"), (3, "done")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Tests for the web server API.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from agora.interfaces import JobInsert
+from agora.job_viewer import JobViewer
+from agora.server import EventHub, SnapshotCache, create_app
+
+
+class TestServer(unittest.TestCase):
+    """Tests for agora.server.create_app."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = os.path.join(self.tmp.name, "jobs.db")
+        JobViewer(self.db_path).write_jobs(
+            [
+                JobInsert(
+                    id=str(i),
+                    command=f"echo {i}",
+                    preamble="",
+                    created_at=f"2024-01-0{i} 00:00:00",
+                    updated_at=f"2024-01-0{i} 00:00:00",
+                )
+                for i in (1, 2)
+            ]
+        )
+        self.refreshes = 0
+        original = JobViewer.get_jobs
+
+        def get_jobs(viewer, filters=None, ignore_status=False):
+            self.refreshes += 1
+            time.sleep(0.05)  # a slow status refresh
+            return original(viewer, filters, ignore_status=True)
+
+        get_jobs_patcher = patch.object(JobViewer, "get_jobs", get_jobs)
+        get_jobs_patcher.start()
+        self.addCleanup(get_jobs_patcher.stop)
+        refresh_patcher = patch.object(JobViewer, "_refresh_states")
+        refresh_patcher.start()
+        self.addCleanup(refresh_patcher.stop)
+
+    def client(self, ttl=60):
+        return create_app(self.db_path, Path(self.tmp.name), ttl=ttl).test_client()
+
+    def test_jobs_cached_with_etag(self):
+        """Test that responses are cached and unchanged polls get a 304."""
+        client = self.client()
+        response = client.get("/api/jobs")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([job["id"] for job in response.get_json()], ["1", "2"])
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        response = client.get("/api/jobs", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(self.refreshes, 1)
+
+        # Other queries are cached separately
+        response = client.get("/api/jobs?format=json&filter=id=2")
+        self.assertEqual(response.get_json()["count"], 1)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(client.get("/api/jobs?filter=bogus=1").status_code, 400)
+
+    def test_single_flight(self):
+        """Test that concurrent requests share one refresh, and stale snapshots are rebuilt."""
+        app_client = self.client(ttl=0.5)
+        statuses = []
+
+        def request():
+            statuses.append(app_client.get("/api/jobs").status_code)
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(self.refreshes, 1)
+
+        time.sleep(0.5)
+        app_client.get("/api/jobs")
+        self.assertEqual(self.refreshes, 2)
+
+    def test_cache_eviction(self):
+        """Test that expired snapshots and the oldest ones over max_entries are dropped."""
+        cache = SnapshotCache(ttl=0.2, max_entries=2)
+        for key in "abc":
+            cache.get(key, lambda: key.encode())
+        self.assertEqual(list(cache._snapshots), ["b", "c"])
+        self.assertEqual(set(cache._locks), {"b", "c"})
+
+        time.sleep(0.2)
+        cache.get("d", lambda: b"d")
+        self.assertEqual(list(cache._snapshots), ["d"])
+        self.assertEqual(set(cache._locks), {"d"})
+
+    def test_delta(self):
+        """Test that ?since=<cursor> returns only inserted, changed and deleted jobs."""
+        client = self.client(ttl=0)
+        data = client.get("/api/jobs?since=0").get_json()
+        self.assertEqual([job["id"] for job in data["jobs"]], ["1", "2"])
+        self.assertEqual(data["deleted"], [])
+        cursor = data["cursor"]
+
+        # Nothing changed
+        data = client.get(f"/api/jobs?since={cursor}").get_json()
+        self.assertEqual((data["cursor"], data["jobs"], data["deleted"]), (cursor, [], []))
+
+        db = JobViewer(self.db_path)
+        db._store_states({"1": {"status": "RUNNING"}, "2": {}}, ["1", "2"])
+        db._store_states({"1": {"status": "RUNNING"}}, ["1"])  # a poll without changes
+        db.update_job(
+            "2",
+            JobInsert(id="3", command="echo 2", preamble="", created_at="2024-01-03", updated_at="2024-01-03"),
+        )
+        data = client.get(f"/api/jobs?since={cursor}").get_json()
+        self.assertEqual(
+            [(job["id"], job["status"]) for job in data["jobs"]], [("1", "RUNNING"), ("3", "UNKNOWN")]
+        )
+        self.assertEqual(data["deleted"], ["2"])
+        cursor = data["cursor"]
+
+        # New dependencies change both jobs, filtered out jobs are reported as deleted
+        db.upsert_deps("3", ["1"])
+        db.delete_jobs(["3"])
+        data = client.get(f"/api/jobs?since={cursor}&filter=status=RUNNING").get_json()
+        self.assertEqual([(job["id"], job["children"]) for job in data["jobs"]], [("1", [])])
+        self.assertEqual(data["deleted"], ["3"])
+
+    @patch.dict(os.environ, {"AGORA_EVENTS_INTERVAL": "0.05", "AGORA_LOG_MAX_BYTES": "12"})
+    def test_events(self):
+        """Test that job changes and log bytes are pushed to /api/events subscribers."""
+        log_path = os.path.join(self.tmp.name, "job.out")
+        with open(log_path, "w") as f:
+            f.write("loaded already\n")
+        client = self.client()
+        jobs_stream = client.get("/api/events", buffered=False)
+        log_stream = client.get(f"/api/events?log={log_path}", buffered=False)
+        self.assertEqual(jobs_stream.mimetype, "text/event-stream")
+        jobs_events, log_events = iter(jobs_stream.response), iter(log_stream.response)
+        self.assertEqual(next(jobs_events), b": connected\n\n")
+        self.assertEqual(next(log_events), b": connected\n\n")
+
+        JobViewer(self.db_path)._store_states({"1": {"status": "RUNNING"}}, ["1"])
+        with open(log_path, "a") as f:
+            f.write("new line\n")
+        event = next(jobs_events).decode()
+        self.assertTrue(event.startswith("event: jobs\ndata: "))
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual([(job["id"], job["status"]) for job in data["jobs"]], [("1", "RUNNING")])
+        event = next(log_events).decode()
+        self.assertEqual(
+            json.loads(event.split("data: ", 1)[1]),
+            {"path": log_path, "offset": 15, "next_offset": 24, "content": "new line\n"},
+        )
+        # Big appends are split into events of at most AGORA_LOG_MAX_BYTES (whole lines)
+        with open(log_path, "a") as f:
+            f.write("second line\nthird\n")
+        contents = [json.loads(next(log_events).decode().split("data: ", 1)[1]) for _ in range(2)]
+        self.assertEqual(
+            [(c["offset"], c["content"]) for c in contents], [(24, "second line\n"), (36, "third\n")]
+        )
+        jobs_stream.close()
+        log_stream.close()
+        self.assertEqual(client.get("/api/events?log=/does/not/exist").status_code, 404)
+
+    def test_event_hub_errors(self):
+        """Test that unreadable logs are skipped and a crashed producer is restarted."""
+        log_path = os.path.join(self.tmp.name, "job.out")
+        hub = EventHub(self.db_path, interval=0.01, refresh_interval=3600)
+        log_queue = hub.subscribe(log_path)
+        self.addCleanup(hub.unsubscribe, log_queue)
+        with open(log_path, "w") as f, patch("builtins.open", side_effect=PermissionError("denied")):
+            f.write("first\n")
+            f.flush()
+            time.sleep(0.05)
+        self.assertTrue(hub._thread.is_alive())
+        data = json.loads(log_queue.get(timeout=1).split("data: ", 1)[1])
+        self.assertEqual(data["content"], "first\n")
+
+        with patch.object(hub, "_publish", side_effect=RuntimeError("boom")), patch(
+            "threading.excepthook"
+        ) as excepthook:
+            with open(log_path, "a") as f:
+                f.write("second\n")
+            for _ in range(100):
+                if excepthook.called:
+                    break
+                time.sleep(0.01)
+        self.assertIsNone(hub._thread)
+        self.assertEqual(str(excepthook.call_args[0][0].exc_value), "boom")
+        self.addCleanup(hub.unsubscribe, hub.subscribe())
+        self.assertTrue(hub._thread.is_alive())
+
+    def test_logs(self):
+        """Test line-range, tail and byte-offset reads of /api/logs."""
+        log_path = os.path.join(self.tmp.name, "job.out")
+        with open(log_path, "w") as f:
+            f.write("".join(f"line {i}\n" for i in range(10)) + "partial")
+        client = self.client()
+
+        data = client.get(f"/api/logs/1?path={log_path}&start=2&end=4").get_json()
+        self.assertEqual(data["content"], "line 2\nline 3\n")
+        self.assertEqual((data["total_lines"], data["start"], data["end"]), (11, 2, 4))
+        data = client.get(f"/api/logs/1?path={log_path}&tail=2").get_json()
+        self.assertEqual((data["content"], data["start"]), ("line 9\npartial", 9))
+        data = client.get(f"/api/logs/1?path={log_path}&offset={data['next_offset'] - 3}").get_json()
+        self.assertEqual(data["content"], "ial")
+        self.assertTrue(os.listdir(os.path.join(self.tmp.name, "log-index")))
+        self.assertEqual(client.get("/api/logs/1?path=/does/not/exist").status_code, 404)
+
+    def test_logs_search(self):
+        """Test that /api/logs/search streams matches from the logs of filtered jobs."""
+        viewer = JobViewer(self.db_path)
+        for i in ("1", "2"):
+            viewer.update_job(
+                i,
+                JobInsert(
+                    id=i,
+                    command=f"echo {i}",
+                    preamble=f"#SBATCH --output={self.tmp.name}/%j.out",
+                    created_at=f"2024-01-0{i} 00:00:00",
+                    updated_at=f"2024-01-0{i} 00:00:00",
+                ),
+            )
+            with open(os.path.join(self.tmp.name, f"{i}.out"), "w") as f:
+                f.write("start\nCUDA out of memory\n")
+        client = self.client()
+
+        response = client.get("/api/logs/search?pattern=cuda&ignore_case=1&filter=id=2")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in response.get_data(as_text=True).splitlines()],
+            [
+                {
+                    "job_id": "2",
+                    "path": os.path.join(self.tmp.name, "2.out"),
+                    "line_number": 2,
+                    "line": "CUDA out of memory",
+                }
+            ],
+        )
+        response = client.get("/api/logs/search?pattern=CUDA")
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 2)
+        self.assertEqual(client.get("/api/logs/search?pattern=(").status_code, 400)
+        self.assertEqual(client.get("/api/logs/search").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
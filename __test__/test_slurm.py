@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the SLURM client (rate limiting, retries and circuit breaker).
+"""
+
+import subprocess
+import unittest
+from unittest.mock import patch
+
+from agora.slurm import SlurmClient, SlurmUnavailableError
+
+
+class TestSlurmClient(unittest.TestCase):
+    """Tests for agora.slurm.SlurmClient."""
+
+    def setUp(self):
+        self.outputs = []
+        self.calls = []
+        run_patcher = patch("subprocess.run", side_effect=self.mock_subprocess_run)
+        run_patcher.start()
+        self.addCleanup(run_patcher.stop)
+        sleep_patcher = patch("time.sleep")
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def mock_subprocess_run(self, args, input=None, **kwargs):
+        """Mock subprocess.run: pops (returncode, stdout, stderr) from self.outputs."""
+        self.calls.append(args)
+        returncode, stdout, stderr = self.outputs.pop(0)
+        return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+    def test_retry_transient_error(self):
+        """Test that transient errors are retried with backoff and slow the rate down."""
+        self.outputs = [
+            (1, "", "sbatch: error: Batch job submission failed: Socket timed out"),
+            (0, "", ""),  # squeue: the job was not queued
+            (0, "Submitted batch job 12345", ""),
+        ]
+        client = SlurmClient(rate=10, burst=10, max_retries=3)
+        result = client.run(["sbatch"], input="#!/bin/bash\n#SBATCH --job-name=train\n")
+
+        self.assertEqual(result.stdout, "Submitted batch job 12345")
+        self.assertEqual(self.calls[1][-1], "--name=train")
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(client.stats["sbatch"].calls, 2)
+        self.assertEqual(client.stats["sbatch"].retries, 1)
+        self.assertLess(client.buckets["sbatch"].rate, 10)
+        self.assertIn("sbatch: 2 calls | 1 retries", client.report())
+
+    def test_ambiguous_sbatch_error(self):
+        """Test that a timed out sbatch is not retried when its job may have been queued."""
+        timeout = (1, "", "sbatch: error: slurm_receive_msg: Socket timed out on send/recv")
+        client = SlurmClient(rate=10, burst=10, max_retries=3)
+
+        self.outputs = [timeout]  # No job name to look the job up by
+        result = client.run(["sbatch"], input="#!/bin/bash")
+        self.assertEqual((result.returncode, len(self.calls)), (1, 1))
+
+        self.outputs = [timeout, (0, "12345\n", "")]  # squeue finds the job
+        result = client.run(["sbatch", "--job-name=train", "job.sh"])
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(
+            self.calls[1:],
+            [
+                ["sbatch", "--job-name=train", "job.sh"],
+                ["squeue", "--me", "--noheader", "--format=%i", "--name=train"],
+            ],
+        )
+        self.assertEqual(client.stats["sbatch"].retries, 0)
+        self.assertEqual(client.stats["sbatch"].failures, 2)
+
+    def test_non_transient_error(self):
+        """Test that non-transient errors are returned without retrying."""
+        self.outputs = [(1, "", "sbatch: error: invalid partition specified")]
+        client = SlurmClient(rate=10, burst=10, max_retries=3)
+        result = client.run(["sbatch"], input="#!/bin/bash")
+
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(client.stats["sbatch"].retries, 0)
+
+    def test_missing_command(self):
+        """Test that a command that is not installed fails like the command would."""
+        client = SlurmClient(rate=10, burst=10, breaker_threshold=1)
+        with patch("subprocess.run", side_effect=FileNotFoundError("No such file: 'sacct'")):
+            for _ in range(2):  # Not transient, the breaker stays closed
+                result = client.run(["sacct"])
+        self.assertEqual((result.returncode, result.stdout), (127, ""))
+        self.assertEqual(client.stats["sacct"].failures, 2)
+
+    def test_circuit_breaker(self):
+        """Test that the breaker fails fast after repeated transient errors."""
+        self.outputs = [(1, "", "Socket timed out")] * 3
+        client = SlurmClient(
+            rate=10, burst=10, max_retries=2, breaker_threshold=3, breaker_cooldown=60
+        )
+        client.run(["sacct"])
+        self.assertEqual(client.stats["sacct"].failures, 1)
+
+        with self.assertRaises(SlurmUnavailableError):
+            client.run(["sacct"])
+        self.assertEqual(len(self.calls), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,290 @@
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import hashlib
+import itertools
+import json
 import os
 import os.path as osp
 import re
 import sqlite3
-from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from agora.executors import parse_array_spec
+from agora.filters import compile_filters, parse_filter
+from agora.interfaces import PACK_TASK_PREFIX, JobInsert, Job, PGroup, PJob
+from agora.slurm import SlurmClient, get_default_client
+
+ARRAY_TASK_RE = re.compile(r"^(\d+)_\[([^\]]+)\]$")
+PACK_TASK_RE = re.compile(r"^(\d+)\.(\d+)$")
+# SLURM states a job never leaves (stored states of these jobs are not re-queried)
+TERMINAL_STATES = [
+    "COMPLETED",
+    "FAILED",
+    "CANCELLED",
+    "TIMEOUT",
+    "OUT_OF_MEMORY",
+    "NODE_FAIL",
+    "BOOT_FAIL",
+    "DEADLINE",
+]
+# Columns of `jobs` holding the last known state (state key -> column)
+STATE_COLUMNS = {
+    "status": "status",
+    "start": "start_time",
+    "end": "end_time",
+    "workdir": "workdir",
+    "reason": "reason",
+    "exit_code": "exit_code",
+}
+# A status poller stores "<unix time>,<interval>" after every poll; readers
+# trust stored states while it is at most POLLER_STALE_INTERVALS intervals old
+POLLER_HEARTBEAT_KEY = "poller_heartbeat"
+POLLER_STALE_INTERVALS = 3
+# Clears the stored state of a resubmitted job
+RESET_STATES = ", ".join(f"{column} = NULL" for column in [*STATE_COLUMNS.values(), "last_polled_at"])
+
+
+def batched(iterable: Iterable[Any], n: int) -> Iterator[List[Any]]:
+    """Yield lists of up to `n` items from `iterable`."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, n)):
+        yield batch
+
+
+def command_hash(command: str) -> str:
+    """Return a short, stable hash of a job command (used for dedup lookups)."""
+    return hashlib.blake2b(command.encode(), digest_size=16).hexdigest()
+
+
+def _create_tables(cursor: sqlite3.Cursor) -> None:
+    """Schema v1: jobs, dependencies and local executor states."""
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        command TEXT NOT NULL,
+        preamble TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        node_id TEXT,
+        node_name TEXT
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS deps (
+        parent TEXT NOT NULL,
+        child TEXT NOT NULL,
+        dep_type TEXT NOT NULL,
+        FOREIGN KEY (parent) REFERENCES jobs(id) ON DELETE CASCADE ON UPDATE CASCADE, -- delete record if parent is deleted
+        FOREIGN KEY (child) REFERENCES jobs(id) ON DELETE CASCADE ON UPDATE CASCADE, -- delete record if child is deleted
+        UNIQUE (parent, child, dep_type)
+    )
+    """
+    )
+
+    # States of jobs run by the local executor (see `agora.executors`)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS local_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        start_time TEXT,
+        end_time TEXT,
+        workdir TEXT,
+        cpus INTEGER,
+        pid INTEGER,
+        exit_code INTEGER
+    )
+    """
+    )
+
+
+def _add_job_states(cursor: sqlite3.Cursor) -> None:
+    """Schema v2: last known job states and a key/value `meta` table."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(jobs)")}
+    for column in [*STATE_COLUMNS.values(), "last_polled_at"]:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    # Small key/value store (e.g., the status poller heartbeat)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """
+    )
+
+
+def _add_indexes(cursor: sqlite3.Cursor) -> None:
+    """Schema v3: indexes, hashed commands and a `vw_jobs` built from pre-aggregated joins.
+
+    `deps(parent)` lookups use the index of the UNIQUE (parent, child, dep_type) constraint.
+    """
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(jobs)")}
+    if "command_hash" not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN command_hash TEXT")
+    cursor.execute("UPDATE jobs SET command_hash = command_hash(command)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deps_child ON deps(child)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_node_id ON jobs(node_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_command_hash ON jobs(command_hash)")
+
+    cursor.execute("DROP VIEW IF EXISTS vw_jobs")
+    cursor.execute(
+        """
+    CREATE VIEW vw_jobs AS
+        SELECT
+            j.*,
+            c.children,
+            p.parents
+        FROM jobs j
+        LEFT JOIN (
+            SELECT parent AS id, GROUP_CONCAT(child, ',') AS children FROM deps GROUP BY parent
+        ) c ON c.id = j.id
+        LEFT JOIN (
+            SELECT child AS id, GROUP_CONCAT(parent, ',') AS parents FROM deps GROUP BY child
+        ) p ON p.id = j.id;
+    """
+    )
+
+
+def _add_change_tracking(cursor: sqlite3.Cursor) -> None:
+    """Schema v4: a change counter, job versions and tombstones of deleted jobs.
+
+    Triggers stamp every inserted or changed job (including changed
+    dependencies) with the next counter value, so `JobDB.get_changes` can
+    return what changed since a client's cursor.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS change_counter (value INTEGER NOT NULL)")
+    cursor.execute(
+        "INSERT INTO change_counter (value) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM change_counter)"
+    )
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(jobs)")}
+    if "version" not in columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_version ON jobs(version)")
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS deleted_jobs (
+        id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deleted_jobs_version ON deleted_jobs(version)")
+
+    bump = "UPDATE change_counter SET value = value + 1;"
+    counter = "(SELECT value FROM change_counter)"
+    # Polls rewrite the states of unfinished jobs, only real changes count
+    changed = " OR ".join(
+        f"NEW.{column} IS NOT OLD.{column}"
+        for column in [
+            "id",
+            "command",
+            "preamble",
+            "node_id",
+            "node_name",
+            *STATE_COLUMNS.values(),
+        ]
+    )
+    triggers = {
+        "trg_jobs_insert": f"""AFTER INSERT ON jobs BEGIN
+            {bump}
+            UPDATE jobs SET version = {counter} WHERE id = NEW.id;
+            DELETE FROM deleted_jobs WHERE id = NEW.id;
+        END""",
+        "trg_jobs_update": f"""AFTER UPDATE ON jobs WHEN {changed} BEGIN
+            {bump}
+            UPDATE jobs SET version = {counter} WHERE id = NEW.id;
+            INSERT OR REPLACE INTO deleted_jobs (id, version)
+                SELECT OLD.id, {counter} WHERE OLD.id IS NOT NEW.id;
+        END""",
+        "trg_jobs_delete": f"""AFTER DELETE ON jobs BEGIN
+            {bump}
+            INSERT OR REPLACE INTO deleted_jobs (id, version) VALUES (OLD.id, {counter});
+        END""",
+    }
+    for event, row in [("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")]:
+        triggers[f"trg_deps_{event.lower()}"] = f"""AFTER {event} ON deps BEGIN
+            {bump}
+            UPDATE jobs SET version = {counter} WHERE id IN ({row}.parent, {row}.child);
+        END"""
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def _version_existing_jobs(cursor: sqlite3.Cursor) -> None:
+    """Schema v5: give jobs from before v4 a version, so `get_changes(0)` returns them."""
+    if cursor.execute("SELECT 1 FROM jobs WHERE version = 0 LIMIT 1").fetchone():
+        cursor.execute("UPDATE change_counter SET value = value + 1")
+        cursor.execute(
+            "UPDATE jobs SET version = (SELECT value FROM change_counter) WHERE version = 0"
+        )
 
-from agora.interfaces import JobInsert, Job, PGroup, PJob
+
+# Schema migrations, MIGRATIONS[i] upgrades a DB from `PRAGMA user_version` i to i + 1
+# (append new ones, never edit released ones)
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _create_tables,
+    _add_job_states,
+    _add_indexes,
+    _add_change_tracking,
+    _version_existing_jobs,
+]
+
+# Connections are kept open per thread and DB path (see `JobDB._connection`)
+_local = threading.local()
+
+
+def _open_connection(db_path: str) -> sqlite3.Connection:
+    """Open a connection that waits for locks, and bring the schema up to date.
+
+    WAL lets readers (e.g., `agora serve`) run while another process writes;
+    set AGORA_DB_JOURNAL_MODE=DELETE on file systems without shared memory
+    support (e.g., a DB on NFS shared by several hosts).
+    """
+    conn = sqlite3.connect(
+        db_path,
+        timeout=float(os.environ.get("AGORA_DB_TIMEOUT", 30)),  # busy timeout
+        cached_statements=256,
+    )
+    conn.execute(f"PRAGMA journal_mode = {os.environ.get('AGORA_DB_JOURNAL_MODE', 'WAL')}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.create_function("command_hash", 1, command_hash, deterministic=True)
+
+    # Every migration newer than `PRAGMA user_version`, in one write transaction
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for i, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+                migrate(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {i}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+    return conn
 
 
 class JobDB:
@@ -15,96 +294,314 @@ class JobDB:
         self,
         db_path: str = "~/.cache/jobrunner/jobs.db",
         deptype: Literal["afterok", "afterany"] = "afterok",
+        slurm: Optional[SlurmClient] = None,
     ):
         """Initialize the job tracker.
 
         Args:
             db_path: Path to SQLite database for job tracking
+            slurm: Client used for all SLURM calls (defaults to the shared client)
         """
         self.db_path = os.path.expanduser(db_path)
         self.deptype: Literal["afterok", "afterany"] = deptype
+        self.slurm = slurm if slurm is not None else get_default_client()
+        # sacct is called with at most `sacct_chunk_size` IDs, `sacct_workers` calls at a time
+        self.sacct_chunk_size = int(os.environ.get("AGORA_SACCT_CHUNK_SIZE", 1000))
+        self.sacct_workers = int(os.environ.get("AGORA_SACCT_WORKERS", 4))
+        # One entry per sacct call (IDs, rows, seconds), see `report_fetch_stats`
+        self.fetch_stats: List[Dict[str, Any]] = []
+        self._fetch_lock = threading.Lock()
         dir = os.path.dirname(self.db_path)
         if dir:
             os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         self._init_db()
 
     def _init_db(self) -> None:
-        """Initialize the database if it doesn't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        conn.execute("PRAGMA foreign_keys = ON")
+        """Open this thread's connection, which creates or upgrades the database."""
+        self._connection()
 
-        # Create jobs table if it doesn't exist
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS jobs (
-            id TEXT PRIMARY KEY,
-            command TEXT NOT NULL,
-            preamble TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            node_id TEXT,
-            node_name TEXT
-        )
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection to the DB (reopened if the file was replaced)."""
+        conns = _local.__dict__.setdefault("conns", {})
+        entry = conns.get(self.db_path)
+        try:
+            inode = os.stat(self.db_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if entry is None or entry[1] != inode:
+            if entry is not None:
+                entry[0].close()
+            conn = _open_connection(self.db_path)
+            entry = conns[self.db_path] = (conn, os.stat(self.db_path).st_ino)
+        return entry[0]
+
+    @staticmethod
+    def _expand_array_id(job_id: str) -> List[str]:
+        """Expand a pending array record like '123_[0-3,7%2]' into task IDs."""
+        m = ARRAY_TASK_RE.match(job_id)
+        if not m:
+            return [job_id]
+        base, spec = m.groups()
+        return [f"{base}_{t}" for t in parse_array_spec(spec)]
+
+    def get_job_states(self, job_ids: list) -> Dict[str, Dict[str, str]]:
+        """Get the status, start/end time, workdir, pending reason and exit code of jobs.
+
+        Stored states of finished jobs (see `TERMINAL_STATES`) are returned as
+        is; only the other jobs are fetched, and their states are stored.
         """
-        )
+        if not job_ids:
+            return {}
+        job_ids = [str(j) for j in job_ids]
+        stored = {
+            row["id"]: {key: row[column] or "" for key, column in STATE_COLUMNS.items()}
+            for row in self._run_query(
+                f"SELECT id, {', '.join(STATE_COLUMNS.values())} FROM jobs "
+                "WHERE id IN (SELECT value FROM json_each(:job_ids))",
+                {"job_ids": json.dumps(job_ids)},
+            )
+        }
+        job_states = {
+            job_id: state
+            for job_id, state in stored.items()
+            if state["status"] in TERMINAL_STATES
+        }
+        poll_ids = [j for j in job_ids if j not in job_states]
+        if not poll_ids:
+            return job_states
+
+        fetched = self._fetch_job_states(poll_ids)
+        self._store_states(fetched, [j for j in poll_ids if j in stored])
+        for job_id in poll_ids:
+            if job_id in fetched:
+                job_states[job_id] = fetched[job_id]
+            elif stored.get(job_id, {}).get("status"):
+                job_states[job_id] = stored[job_id]
+        # Rows sacct reports besides the requested ones (e.g., array records)
+        for job_id, state in fetched.items():
+            job_states.setdefault(job_id, state)
+        return job_states
 
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS deps (
-            parent TEXT NOT NULL,
-            child TEXT NOT NULL,
-            dep_type TEXT NOT NULL,
-            FOREIGN KEY (parent) REFERENCES jobs(id) ON DELETE CASCADE ON UPDATE CASCADE, -- delete record if parent is deleted
-            FOREIGN KEY (child) REFERENCES jobs(id) ON DELETE CASCADE ON UPDATE CASCADE, -- delete record if child is deleted
-            UNIQUE (parent, child, dep_type)
-        )
+    def _store_states(
+        self, job_states: Dict[str, Dict[str, str]], polled_ids: List[str]
+    ) -> None:
+        """Write fetched states of `polled_ids` to `jobs` (in one transaction)."""
+        if not polled_ids:
+            return
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        set_clause = ", ".join(f"{column} = :{key}" for key, column in STATE_COLUMNS.items())
+        with self.get_connection() as conn:
+            conn.executemany(
+                f"UPDATE jobs SET {set_clause}, last_polled_at = :now WHERE id = :id",
+                [
+                    {
+                        **{key: job_states[job_id].get(key) for key in STATE_COLUMNS},
+                        "now": now,
+                        "id": job_id,
+                    }
+                    for job_id in polled_ids
+                    if job_id in job_states
+                ],
+            )
+            conn.executemany(
+                "UPDATE jobs SET last_polled_at = ? WHERE id = ?",
+                [(now, job_id) for job_id in polled_ids if job_id not in job_states],
+            )
+
+    def _fetch_job_states(self, job_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Fetch job states: jobs run by the local executor from the DB, the rest from sacct."""
+        job_states = self.get_local_states(job_ids)
+        slurm_ids = [str(j) for j in job_ids if str(j) not in job_states]
+        if slurm_ids:
+            job_states.update(self._get_slurm_states(slurm_ids))
+        return job_states
+
+    def get_local_states(self, job_ids: list) -> Dict[str, Dict[str, str]]:
+        """Get the states of jobs run by the local executor (others are left out)."""
+        job_ids = [str(j) for j in job_ids]
+        job_states = {}
+        for start in range(0, len(job_ids), 900):  # SQLite variable limit
+            chunk = job_ids[start : start + 900]
+            rows = self._run_query(
+                "SELECT id, status, start_time, end_time, workdir, exit_code FROM local_jobs "
+                f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for row in rows:
+                job_states[row["id"]] = {
+                    "status": row["status"],
+                    "start": row["start_time"] or "",
+                    "end": row["end_time"] or "",
+                    "workdir": row["workdir"] or "",
+                    "exit_code": "" if row["exit_code"] is None else str(row["exit_code"]),
+                }
+        return job_states
+
+    @staticmethod
+    def _state_keys(job_id: str, job_name: str) -> List[str]:
+        """Job IDs an sacct row reports on (array tasks expanded, packed steps by name).
+
+        Other step rows (`.batch`, `.extern`, unnamed steps) report on nothing.
         """
-        )
+        if "." in job_id:
+            if job_name.startswith(PACK_TASK_PREFIX):
+                return [f"{job_id.split('.')[0]}.{job_name[len(PACK_TASK_PREFIX):]}"]
+            return []
+        return JobDB._expand_array_id(job_id)
+
+    def _sacct_chunk(self, job_ids: List[str], steps: bool) -> Dict[str, Dict[str, str]]:
+        """Run one sacct call for `job_ids` (allocations only, unless `steps`)."""
+        return self._sacct(["-j", ",".join(job_ids)], steps, len(job_ids))
+
+    def _sacct(
+        self, select: List[str], steps: bool, n_ids: int = 0
+    ) -> Dict[str, Dict[str, str]]:
+        """Run one sacct call selecting jobs with `select` (e.g., ['-j', '1,2']) and parse its rows."""
+        start = time.monotonic()
+        output = self.slurm.run(
+            ["sacct"]
+            + select
+            + [
+                "--format",
+                "jobid,state,start,end,workdir,jobname,exitcode",
+                "--noheader",
+                "--parsable2",
+            ]
+            + ([] if steps else ["-X"])
+        ).stdout
+        job_states = {}
+        for line in output.strip().split("\n"):
+            parts = line.split("|")
+            if len(parts) < 5:
+                continue
+            for task_id in JobDB._state_keys(parts[0], parts[5] if len(parts) > 5 else ""):
+                job_states[task_id] = {
+                    "status": parts[1].split(" ")[0],  # e.g., "CANCELLED by 123"
+                    "start": parts[2],
+                    "end": parts[3],
+                    "workdir": parts[4],
+                    "exit_code": parts[6] if len(parts) > 6 else "",
+                }
+        with self._fetch_lock:
+            self.fetch_stats.append(
+                {
+                    "ids": n_ids,
+                    "rows": len(job_states),
+                    "steps": steps,
+                    "seconds": time.monotonic() - start,
+                }
+            )
+        return job_states
 
-        cursor.execute(
-            """
-        CREATE VIEW IF NOT EXISTS vw_jobs AS
-            SELECT
-                j.*,
-                (SELECT GROUP_CONCAT(d.child, ',') FROM deps d WHERE d.parent = j.id) AS children,
-                (SELECT GROUP_CONCAT(d2.parent, ',') FROM deps d2 WHERE d2.child = j.id) AS parents
-            FROM jobs j;
+    def _get_slurm_states(self, job_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Fetch job states from sacct in chunks of `sacct_chunk_size` IDs.
+
+        Chunks run concurrently (`sacct_workers` at a time) and are merged in
+        order. Only allocation rows are requested (`-X`), except for the
+        allocations of packed tasks, whose states come from their steps.
         """
+        plain_ids = list(dict.fromkeys(j for j in job_ids if not PACK_TASK_RE.match(j)))
+        packed_ids = list(
+            dict.fromkeys(m.group(1) for j in job_ids if (m := PACK_TASK_RE.match(j)))
         )
-        conn.commit()
-        conn.close()
+        size = max(1, self.sacct_chunk_size)
+        chunks = [(chunk, False) for chunk in batched(plain_ids, size)]
+        chunks += [(chunk, True) for chunk in batched(packed_ids, size)]
 
-    @staticmethod
-    def get_job_states(job_ids: list) -> Dict[str, Dict[str, str]]:
-        job_list = ",".join(str(j) for j in job_ids)
-        output = os.popen(
-            f"sacct -j {job_list} --format jobid,state,start,end,workdir --noheader --parsable2"
-        ).read()
-        job_states = {
-            parts[0]: {
-                "status": parts[1],
-                "start": parts[2],
-                "end": parts[3],
-                "workdir": parts[4],
-            }
-            for line in output.strip().split("\n")
-            if (parts := line.split("|")) and len(parts) >= 4
-        }
-
-        # Check if pending jobs are blocked
-        for job_id, jstate in job_states.items():
-            if jstate["status"] == "PENDING":
-                pd_reason = (
-                    os.popen(f"squeue -j {job_id} -o %R --noheader").read().strip()
+        if len(chunks) == 1:
+            results = [self._sacct_chunk(*chunks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, self.sacct_workers)) as pool:
+                results = list(pool.map(lambda c: self._sacct_chunk(*c), chunks))
+        job_states: Dict[str, Dict[str, str]] = {}
+        for result in results:
+            job_states.update(result)
+        return self._complete_states(job_ids, job_states)
+
+    def _complete_states(
+        self, job_ids: List[str], job_states: Dict[str, Dict[str, str]]
+    ) -> Dict[str, Dict[str, str]]:
+        """Add pending reasons to sacct states and fill in packed tasks without a step."""
+        # Pending reasons (one squeue call), blocked jobs will never start
+        if any(jstate["status"] == "PENDING" for jstate in job_states.values()):
+            reasons = self._get_pending_reasons()
+            for job_id, jstate in job_states.items():
+                if jstate["status"] == "PENDING":
+                    jstate["reason"] = reasons.get(job_id, "")
+                    if "DependencyNeverSatisfied".lower() in jstate["reason"].lower():
+                        jstate["status"] = "BLOCKED"
+
+        # Packed tasks without a step yet wait for their allocation (or a free slot)
+        for job_id in job_ids:
+            m = PACK_TASK_RE.match(job_id)
+            if not m or m.group(1) not in job_states:
+                continue
+            alloc = job_states[m.group(1)]
+            if job_id in job_states:
+                job_states[job_id]["workdir"] = (
+                    job_states[job_id]["workdir"] or alloc["workdir"]
                 )
-                if "DependencyNeverSatisfied".lower() in pd_reason.lower():
-                    jstate["status"] = "BLOCKED"
+            else:
+                job_states[job_id] = {
+                    "status": "PENDING" if alloc["status"] == "RUNNING" else alloc["status"],
+                    "start": "",
+                    "end": "",
+                    "workdir": alloc["workdir"],
+                    "reason": alloc.get("reason", ""),
+                }
 
         return job_states
 
-    def _parse_group_dict(self, d: Dict[str, Any]) -> PGroup:
-        """Convert the `group` sub-dict into a PGroup (recursive)."""
+    def _get_pending_reasons(self) -> Dict[str, str]:
+        """Map the user's pending job IDs to their pending reason (one squeue call)."""
+        output = self.slurm.run(
+            ["squeue", "--me", "-h", "-t", "PENDING", "-o", "%i|%R"]
+        ).stdout
+        reasons = {}
+        for line in output.strip().split("\n"):
+            job_id, sep, reason = line.strip().partition("|")
+            if not sep:
+                continue
+            for task_id in JobDB._expand_array_id(job_id):
+                reasons[task_id] = reason.strip().strip("()")
+        return reasons
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Get a value from the `meta` table (None if unset)."""
+        rows = self._run_query("SELECT value FROM meta WHERE key = ?", [key])
+        return rows[0]["value"] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Set a value in the `meta` table."""
+        self._execute_query(
+            "INSERT INTO meta (key, value) VALUES (:key, :value) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            {"key": key, "value": value},
+        )
+
+    def poller_alive(self) -> bool:
+        """Whether a status poller updated the DB within the last few poll intervals."""
+        heartbeat = self.get_meta(POLLER_HEARTBEAT_KEY)
+        if not heartbeat:
+            return False
+        polled_at, interval = map(float, heartbeat.split(","))
+        return time.time() - polled_at < POLLER_STALE_INTERVALS * interval
+
+    def report_fetch_stats(self) -> str:
+        """Return the IDs, rows and duration of every sacct call made so far."""
+        return "\n".join(
+            f"sacct chunk {i}: {stat['ids']} ids{' (steps)' if stat['steps'] else ''} | "
+            f"{stat['rows']} rows | {stat['seconds'] * 1000:.0f}ms"
+            for i, stat in enumerate(self.fetch_stats)
+        )
+
+    def _parse_group_dict(self, d: Dict[str, Any], array: bool = False) -> PGroup:
+        """Convert the `group` sub-dict into a PGroup (recursive).
+
+        Args:
+            d: The `group` sub-dict
+            array: Default for the `array` flag of sweep groups
+        """
         gtype = d["type"]
         sweep = d.get("sweep", {})
         preamble = d.get("preamble", "")
@@ -119,7 +616,7 @@ class JobDB:
                 jd = item["job"]
                 children.append(PJob(**jd))
             elif "group" in item:  # nested group
-                children.append(self._parse_group_dict(item["group"]))
+                children.append(self._parse_group_dict(item["group"], array=array))
             else:
                 raise ValueError(f"Unrecognized node: {item}")
 
@@ -132,54 +629,48 @@ class JobDB:
             name=name,
             loop_count=loop_count,
             loop_type=loop_type,
+            array=d.get("array", array),
+            sample=d.get("sample", {}),
+            pack=int(d.get("pack", 0)),
         )
 
-    @staticmethod
-    def _parse_filter(filter_str: str, param_name: str) -> Tuple[str, Any]:
-        """Parse filter like 'status=COMPLETED' or 'command~python'"""
-        if "~" in filter_str:
-            field, value = filter_str.split("~", 1)
-            return f"{field} LIKE :{param_name}", f"%{value}%"
-        elif "=" in filter_str:
-            field, value = filter_str.split("=", 1)
-            return f"{field} = :{param_name}", value
-        else:
-            raise ValueError(f"Invalid filter: {filter_str}")
-
     def _parse_preamble(self, preamble: str, job_id: str) -> Tuple[str, str]:
         """Parse the preamble to extract SLURM output and error paths."""
         output_match = re.search(r"#SBATCH\s+--output[=\s]+(\S+)", preamble)
         error_match = re.search(r"#SBATCH\s+--error[=\s]+(\S+)", preamble)
         output_path = output_match.group(1) if output_match else ""
         error_path = error_match.group(1) if error_match else ""
-        for spec in ["%j", "%J"]:
-            if spec in output_path:
-                output_path = output_path.replace(spec, job_id)
-            if spec in error_path:
-                error_path = error_path.replace(spec, job_id)
+        array_id, _, task_id = job_id.partition("_")
+        specs = {"%j": job_id, "%J": job_id, "%A": array_id, "%a": task_id}
+        for spec, value in specs.items():
+            output_path = output_path.replace(spec, value)
+            error_path = error_path.replace(spec, value)
         return output_path, error_path
 
     @contextmanager
     def get_connection(self):
-        """Get a database connection context manager with foreign keys enabled."""
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA foreign_keys = ON")
+        """Get this thread's connection, committing on success and rolling back on errors.
+
+        Nested uses join the outer transaction.
+        """
+        conn = self._connection()
+        if conn.in_transaction:
+            yield conn
+            return
         try:
             yield conn
             conn.commit()  # Auto-commit on success
         except Exception:
             conn.rollback()  # Rollback on error
             raise
-        finally:
-            conn.close()  # Always close
 
     def _run_query(
-        self, query: str, params: Optional[Dict] = None
+        self, query: str, params: Optional[Union[Dict, List]] = None
     ) -> List[sqlite3.Row]:
         """Execute a SELECT query that returns data."""
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             if params is None:
                 cursor.execute(query)
             else:
@@ -199,9 +690,14 @@ class JobDB:
     #                                CRUD operations (jobs)                    #
     ############################################################################
 
+    @staticmethod
+    def _job_row(rec: JobInsert) -> Dict[str, Any]:
+        """Column values of a job row (the record plus its command hash)."""
+        return {**rec.to_dict(), "command_hash": command_hash(rec.command)}
+
     def create_job(self, rec: JobInsert) -> None:
         """Insert a new job row (fails if job_id already exists)."""
-        job_dict = rec.to_dict()
+        job_dict = self._job_row(rec)
         attrs_str = ", ".join(job_dict.keys())
         vals_str = ", ".join(f":{k}" for k in job_dict.keys())
         query = f"INSERT INTO jobs ({attrs_str}) VALUES ({vals_str})"
@@ -217,79 +713,183 @@ class JobDB:
         cascade: bool = True,
         on_delete: Optional[Callable[[str], None]] = None,
     ) -> None:
-
-        jobs = self.get_jobs([f"id={job_id}"], ignore_status=True)
-        job = jobs[0] if jobs else None
-        if not job:
+        deleted = self.delete_jobs([job_id], cascade=cascade)
+        if not deleted:
             print(f"Job {job_id} not found, nothing to delete.")
-            return
+        for deleted_id in deleted:
+            on_delete(deleted_id) if on_delete else None
 
-        # Delete job from db
-        self._execute_query("DELETE FROM jobs WHERE id = :job_id", {"job_id": job_id})
-        on_delete(job_id) if on_delete else None
+    def delete_jobs(self, job_ids: List[str], cascade: bool = True) -> List[str]:
+        """Delete jobs (with `cascade`, also all their descendants) in one transaction.
 
-        if cascade:
-            for child_id in job.children:
-                self.delete_job(child_id, cascade=True)
+        Returns:
+            The IDs of the deleted jobs (unknown IDs are left out)
+        """
+        sub = (
+            """
+            WITH RECURSIVE sub(id) AS (
+                SELECT value FROM json_each(:job_ids)
+                UNION
+                SELECT d.child FROM deps d JOIN sub ON d.parent = sub.id
+            )
+            """
+            if cascade
+            else "WITH sub(id) AS (SELECT value FROM json_each(:job_ids))"
+        )
+        params = {"job_ids": json.dumps([str(j) for j in job_ids])}
+        with self.get_connection() as conn:
+            deleted = [
+                row[0]
+                for row in conn.execute(
+                    f"{sub} SELECT j.id FROM jobs j JOIN sub ON j.id = sub.id", params
+                )
+            ]
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT value FROM json_each(:deleted))",
+                {"deleted": json.dumps(deleted)},
+            )
+        return deleted
 
     def update_job(self, job_id: str, job: JobInsert) -> None:
         """Update job fields. Only updates fields that are provided."""
-        job_dict = job.to_dict()
+        job_dict = self._job_row(job)
         set_clause = ", ".join(f"{k} = :{k}" for k in job_dict.keys())
-        query = f"UPDATE jobs SET {set_clause}, updated_at = datetime('now') WHERE id = :old_id"
+        query = f"UPDATE jobs SET {set_clause}, {RESET_STATES}, updated_at = datetime('now') WHERE id = :old_id"
         params = {**job_dict, "old_id": job_id}
         self._execute_query(query, params)
 
+    def write_jobs(
+        self,
+        inserts: List[JobInsert],
+        updates: Optional[Dict[str, JobInsert]] = None,
+        deps: Optional[Dict[str, List[str]]] = None,
+        dep_type: Literal["afterok", "afterany"] = "afterok",
+    ) -> None:
+        """Persist jobs and their dependencies in a single transaction.
+
+        Args:
+            inserts: New job rows
+            updates: Existing job ID -> replacement row (e.g., resubmitted jobs)
+            deps: Child job ID -> parent job IDs (replaces existing dependencies)
+        """
+        updates = updates or {}
+        deps = deps or {}
+        if not (inserts or updates or deps):
+            return
+
+        with self.get_connection() as conn:
+            if updates:
+                keys = list(self._job_row(next(iter(updates.values()))).keys())
+                set_clause = ", ".join(f"{k} = :{k}" for k in keys)
+                conn.executemany(
+                    f"UPDATE jobs SET {set_clause}, {RESET_STATES}, updated_at = datetime('now') "
+                    "WHERE id = :old_id",
+                    [{**self._job_row(rec), "old_id": old_id} for old_id, rec in updates.items()],
+                )
+            if inserts:
+                keys = list(self._job_row(inserts[0]).keys())
+                conn.executemany(
+                    f"INSERT INTO jobs ({', '.join(keys)}) VALUES ({', '.join(f':{k}' for k in keys)})",
+                    [self._job_row(rec) for rec in inserts],
+                )
+            if deps:
+                conn.executemany(
+                    "DELETE FROM deps WHERE child = ?", [(child,) for child in deps]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO deps (parent, child, dep_type) VALUES (?, ?, ?)",
+                    [
+                        (parent, child, dep_type)
+                        for child, parents in deps.items()
+                        for parent in parents
+                    ],
+                )
+
     def get_jobs(
         self, filters: Optional[List[str]] = None, ignore_status: bool = False
     ) -> List[Job]:
-        query = "SELECT * FROM vw_jobs"
-        params = {}
-
-        # Remove status from filters
-        status_filter = None
-        if filters:
-            conditions = []
-            param_counter = 0
-            for f in filters:
-                if f.startswith("status"):
-                    status_filter = f
-                    continue
-
-                param_name = f"param_{param_counter}"
-                condition, param_value = self._parse_filter(f, param_name)
-                conditions.append(condition)
-                params[param_name] = param_value
-                param_counter += 1
-
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-
-        query += " ORDER BY created_at ASC"
-        jobs = self._run_query(query, params)
-        job_ids = [job[0] for job in jobs]
-
-        # Get job statuses from SLURM
-        job_states = {
-            str(job["id"]): {"status": "UNKNOWN", "start": None, "end": None}
-            for job in jobs
-        }
-        if not ignore_status:
-            job_states = self.get_job_states(job_ids)
-
-        # Filter out jobs based on status filter
-        if status_filter:
-            _, value = self._parse_filter(status_filter, "status")
-            jobs = [
-                job
-                for job in jobs
-                if job_states.get(job["id"], {}).get("status", "UNKNOWN").lower()
-                == value.lower()
+        """Get jobs matching all `filters` (e.g., 'status=FAILED,TIMEOUT' or 'node_name^=train').
+
+        See `agora.filters` for the filter syntax. Unless `ignore_status` is
+        set or a status poller (`agora daemon`) keeps the DB in sync, the
+        states of unfinished jobs that may match are refreshed first;
+        otherwise the stored states are used.
+        """
+        nodes = [parse_filter(f) for f in filters or []]
+        if not ignore_status and not self.poller_alive():
+            self._refresh_states(nodes)
+
+        condition, params = compile_filters(nodes)
+        return self._rows_to_jobs(
+            self._run_query(
+                f"SELECT * FROM vw_jobs WHERE {condition} ORDER BY created_at ASC", params
+            )
+        )
+
+    def _refresh_states(self, nodes: List[Any]) -> None:
+        """Refresh the states of unfinished jobs that may match parsed filters `nodes`."""
+        condition, params = compile_filters(nodes, relax_status=True)
+        active = self._run_query(
+            f"SELECT id FROM jobs WHERE ({condition}) AND (status IS NULL OR status NOT IN "
+            f"({', '.join(repr(s) for s in TERMINAL_STATES)}))",
+            params,
+        )
+        self.get_job_states([row["id"] for row in active])
+
+    def get_cursor(self) -> int:
+        """Get the current change cursor (see `get_changes`)."""
+        return self._run_query("SELECT value FROM change_counter")[0]["value"]
+
+    def get_changes(
+        self,
+        since: int,
+        filters: Optional[List[str]] = None,
+        ignore_status: bool = False,
+    ) -> Tuple[int, List[Job], List[str]]:
+        """Get the jobs inserted, changed or deleted after change cursor `since`.
+
+        Statuses are refreshed as in `get_jobs` first. Changed jobs that no
+        longer match `filters` are reported as removed.
+
+        Returns:
+            The new cursor, the changed jobs matching `filters` and the IDs of
+            removed jobs
+        """
+        nodes = [parse_filter(f) for f in filters or []]
+        if not ignore_status and not self.poller_alive():
+            self._refresh_states(nodes)
+
+        condition, params = compile_filters(nodes)
+        with self.get_connection() as conn:
+            conn.execute("BEGIN")  # one snapshot for the cursor and the rows
+            cursor = conn.execute("SELECT value FROM change_counter").fetchone()[0]
+            query = conn.cursor()
+            query.row_factory = sqlite3.Row
+            rows = query.execute(
+                "SELECT * FROM vw_jobs WHERE version > :since ORDER BY created_at ASC",
+                {"since": since},
+            ).fetchall()
+            matching = {
+                row[0]
+                for row in conn.execute(
+                    f"SELECT id FROM jobs WHERE version > :since AND ({condition})",
+                    {**params, "since": since},
+                )
+            }
+            removed = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM deleted_jobs WHERE version > ?", [since]
+                )
             ]
+        removed += [row["id"] for row in rows if row["id"] not in matching]
+        jobs = self._rows_to_jobs([row for row in rows if row["id"] in matching])
+        return cursor, jobs, removed
 
-        # Convert to JobSpec objects
+    def _rows_to_jobs(self, rows: List[sqlite3.Row]) -> List[Job]:
+        """Convert `vw_jobs` rows (with their stored states) to Job objects."""
         result = []
-        for row in jobs:
+        for row in rows:
             row_dict = dict(row)
             row_dict["parents"] = (
                 row_dict["parents"].split(",") if row_dict["parents"] else []
@@ -297,34 +897,41 @@ class JobDB:
             row_dict["children"] = (
                 row_dict["children"].split(",") if row_dict["children"] else []
             )
-            row_dict["status"] = job_states.get(row_dict["id"], {}).get(
-                "status", "UNKNOWN"
-            )
-            row_dict["start_time"] = job_states.get(row_dict["id"], {}).get(
-                "start", None
-            )
-            row_dict["end_time"] = job_states.get(row_dict["id"], {}).get("end", None)
+            row_dict["status"] = row_dict["status"] or "UNKNOWN"
+            workdir = row_dict.pop("workdir", None) or ""
+            row_dict.pop("last_polled_at", None)
+            row_dict.pop("command_hash", None)
+            row_dict.pop("version", None)
             out_path, err_path = self._parse_preamble(
                 row_dict.get("preamble", ""), row_dict["id"]
             )
-            row_dict["slurm_out"] = (
-                osp.join(
-                    job_states.get(row_dict["id"], {}).get("workdir", ""), out_path
-                )
-                if out_path
-                else None
-            )
-            row_dict["slurm_err"] = (
-                osp.join(
-                    job_states.get(row_dict["id"], {}).get("workdir", ""), err_path
-                )
-                if err_path
-                else None
-            )
+            row_dict["slurm_out"] = osp.join(workdir, out_path) if out_path else None
+            row_dict["slurm_err"] = osp.join(workdir, err_path) if err_path else None
             result.append(Job(**row_dict))
 
         return result
 
+    def get_subgraph(self, job_ids: List[str]) -> List[Job]:
+        """Get jobs and all their descendants (without SLURM states) in one query.
+
+        Jobs are returned in creation order; unknown IDs are left out.
+        """
+        rows = self._run_query(
+            """
+            WITH RECURSIVE sub(id) AS (
+                SELECT value FROM json_each(:job_ids)
+                UNION
+                SELECT d.child FROM deps d JOIN sub ON d.parent = sub.id
+            )
+            SELECT v.* FROM sub
+            JOIN jobs j ON j.id = sub.id
+            JOIN vw_jobs v ON v.id = sub.id
+            ORDER BY j.created_at ASC, j.rowid ASC
+            """,
+            {"job_ids": json.dumps([str(j) for j in job_ids])},
+        )
+        return self._rows_to_jobs(rows)
+
     ############################################################################
     #                                CRUD operations (deps)                    #
     ############################################################################
@@ -0,0 +1,424 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import contextlib
+import multiprocessing
+import os
+import re
+import signal
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional
+
+from agora.slurm import SlurmClient
+
+if TYPE_CHECKING:
+    from agora._base import JobDB
+
+JOB_RE = re.compile(r"Submitted batch job (\d+)")
+SBATCH_RE = re.compile(r"^#SBATCH[ \t]+(--?[\w-]+)(?:[= \t]+(\S+))?", re.MULTILINE)
+SHORT_FLAGS = {
+    "-c": "--cpus-per-task",
+    "-o": "--output",
+    "-e": "--error",
+    "-d": "--dependency",
+    "-a": "--array",
+    "-J": "--job-name",
+}
+# Statuses after which a local job never changes again
+LOCAL_TERMINAL = ["COMPLETED", "FAILED", "CANCELLED", "BLOCKED"]
+
+
+def parse_sbatch_directives(script: str) -> Dict[str, str]:
+    """Parse `#SBATCH` lines into a {--long-flag: value} dict (short flags are expanded)."""
+    directives = {}
+    for flag, value in SBATCH_RE.findall(script):
+        directives[SHORT_FLAGS.get(flag, flag)] = value
+    return directives
+
+
+def parse_array_spec(spec: str) -> List[int]:
+    """Expand an array spec like '0-3,7' or '0-10:2%4' into task IDs."""
+    spec = spec.split("%")[0]  # drop throttle suffix
+    task_ids = []
+    for part in spec.split(","):
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            step = 1
+            if ":" in hi:
+                hi, step = hi.split(":", 1)
+            task_ids.extend(range(int(lo), int(hi) + 1, int(step)))
+        elif part:
+            task_ids.append(int(part))
+    return task_ids
+
+
+class Executor:
+    """Runs job scripts (with `#SBATCH` directives) for a `JobSubmitter`."""
+
+    def submit(self, script: str) -> str:
+        """Submit a job script and return its job ID (the array ID for array scripts)."""
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> None:
+        """Cancel a job. Raises `subprocess.CalledProcessError` on failure."""
+        raise NotImplementedError
+
+    def wait(self) -> None:
+        """Block until all submitted jobs are done (no-op for batch schedulers)."""
+
+
+class SlurmExecutor(Executor):
+    """Submit jobs with `sbatch` and cancel them with `scancel`."""
+
+    def __init__(self, slurm: SlurmClient):
+        self.slurm = slurm
+
+    def submit(self, script: str) -> str:
+        result = self.slurm.run(["sbatch"], input=script)
+        output = result.stdout + result.stderr
+        m = JOB_RE.search(output)
+        if not m:
+            raise RuntimeError(f"Could not parse job id from sbatch output:\n{output}")
+        return m.group(1)
+
+    def cancel(self, job_id: str) -> None:
+        self.slurm.run(["scancel", str(job_id)]).check_returncode()
+
+
+def _run_local_job(
+    db_path: str,
+    job_id: str,
+    script: str,
+    env: Dict[str, str],
+    workdir: str,
+    out_path: str,
+    err_path: str,
+) -> int:
+    """Run one job script with bash (in a pool worker) and return its exit code."""
+    out_path = os.path.join(workdir, out_path)
+    err_path = os.path.join(workdir, err_path)
+    for path in {out_path, err_path}:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    fd, script_path = tempfile.mkstemp(prefix=f"agora-{job_id}-", suffix=".sh")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(script)
+        with contextlib.ExitStack() as stack:
+            out = stack.enter_context(open(out_path, "a"))
+            err = (
+                stack.enter_context(open(err_path, "a"))
+                if err_path != out_path
+                else subprocess.STDOUT
+            )
+            proc = subprocess.Popen(
+                ["bash", script_path],
+                cwd=workdir,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=out,
+                stderr=err,
+                start_new_session=True,  # own process group, so cancel can kill it
+            )
+            with sqlite3.connect(db_path, timeout=30) as conn:
+                conn.execute("UPDATE local_jobs SET pid = ? WHERE id = ?", (proc.pid, job_id))
+                (status,) = conn.execute(
+                    "SELECT status FROM local_jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+            conn.close()
+            if status == "CANCELLED":  # cancelled before the pid was recorded
+                os.killpg(proc.pid, signal.SIGTERM)
+            return proc.wait()
+    finally:
+        os.remove(script_path)
+
+
+def cancel_local_job(db: "JobDB", job_id: str) -> None:
+    """Cancel a job of the local executor (from any process).
+
+    Pending jobs are marked CANCELLED so the scheduler skips them; running jobs
+    also get their process group killed.
+    """
+    with db.get_connection() as conn:
+        row = conn.execute(
+            "SELECT status, pid FROM local_jobs WHERE id = :id", {"id": job_id}
+        ).fetchone()
+        if row is None or row[0] not in ["PENDING", "RUNNING"]:
+            return
+        conn.execute(
+            "UPDATE local_jobs SET status = 'CANCELLED', end_time = :now WHERE id = :id",
+            {"id": job_id, "now": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        )
+    status, pid = row
+    if status == "RUNNING" and pid:
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class _LocalJob:
+    __slots__ = (
+        "id",
+        "script",
+        "cpus",
+        "env",
+        "out",
+        "err",
+        "deptype",
+        "parents",
+        "children",
+        "waiting",
+        "status",
+    )
+
+    def __init__(
+        self,
+        job_id: str,
+        script: str,
+        cpus: int,
+        env: Dict[str, str],
+        out: str,
+        err: str,
+        deptype: str,
+        parents: List[str],
+    ):
+        self.id = job_id
+        self.script = script
+        self.cpus = cpus
+        self.env = env
+        self.out = out
+        self.err = err
+        self.deptype = deptype
+        self.parents = parents
+        self.children: List[str] = []
+        self.waiting = 0  # parents that are not done yet
+        self.status = "PENDING"
+
+
+class LocalExecutor(Executor):
+    """Run jobs on this machine with a process pool instead of SLURM.
+
+    Job scripts are run with bash in the current directory. `--dependency`
+    (afterok/afterany), `--cpus-per-task`, `--output`/`--error` (with %j, %A
+    and %a) and `--array` are honoured; other `#SBATCH` directives are
+    ignored. Jobs start in submission order once their parents are done and
+    enough CPUs are free. A job whose dependency can never be satisfied
+    (e.g., afterok on a failed parent) is marked BLOCKED.
+
+    States are written to the `local_jobs` table of the job DB, so
+    `agora status`, `viz` and `serve` show local jobs like SLURM jobs.
+    """
+
+    def __init__(self, db: "JobDB", cpus: Optional[int] = None):
+        """Initialize the executor.
+
+        Args:
+            db: Job DB to record job states in
+            cpus: CPUs to share between jobs (env: AGORA_LOCAL_CPUS, default: all)
+        """
+        self.db = db
+        self.cpus = cpus or int(os.environ.get("AGORA_LOCAL_CPUS", 0)) or os.cpu_count() or 1
+        self.free_cpus = self.cpus
+        self.workdir = os.getcwd()
+        self.jobs: Dict[str, _LocalJob] = {}
+        self.arrays: Dict[str, List[str]] = {}  # array ID -> task IDs
+        self.external: Dict[str, List[str]] = {}  # unfinished parent from another run -> children
+        self.ready: Deque[_LocalJob] = deque()
+        self.unfinished = 0
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self._next_id: Optional[int] = None
+        self.cond = threading.Condition()
+
+    def _now(self) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def _new_id(self, conn: sqlite3.Connection) -> int:
+        """Next numeric job ID (above every job ID in the DB)."""
+        if self._next_id is None:
+            (max_id,) = conn.execute(
+                "SELECT MAX(m) FROM ("
+                "SELECT MAX(CAST(id AS INTEGER)) AS m FROM jobs "
+                "UNION ALL SELECT MAX(CAST(id AS INTEGER)) FROM local_jobs)"
+            ).fetchone()
+            self._next_id = (max_id or 0) + 1
+        self._next_id += 1
+        return self._next_id - 1
+
+    def submit(self, script: str) -> str:
+        directives = parse_sbatch_directives(script)
+        cpus = min(self.cpus, max(1, int(directives.get("--cpus-per-task") or 1)))
+        deptype, _, parent_str = (directives.get("--dependency") or "afterok").partition(":")
+        parents = parent_str.split(":") if parent_str else []
+        if deptype not in ["afterok", "afterany"]:
+            raise ValueError(f"Unsupported dependency type for local jobs: {deptype}")
+
+        with self.cond:
+            with self.db.get_connection() as conn:
+                while True:
+                    job_id = str(self._new_id(conn))
+                    task_ids = (
+                        [f"{job_id}_{t}" for t in parse_array_spec(directives["--array"])]
+                        if directives.get("--array")
+                        else [job_id]
+                    )
+                    try:
+                        conn.executemany(
+                            "INSERT INTO local_jobs (id, status, workdir, cpus) VALUES (?, 'PENDING', ?, ?)",
+                            [(task_id, self.workdir, cpus) for task_id in task_ids],
+                        )
+                        break
+                    except sqlite3.IntegrityError:  # ID taken by another process
+                        self._next_id = None
+            if directives.get("--array"):
+                self.arrays[job_id] = task_ids
+
+            parent_ids = [t for p in parents for t in self.arrays.get(p, [p])]
+            parent_states = self.db.get_local_states(
+                [p for p in parent_ids if p not in self.jobs]
+            )
+            for task_id in task_ids:
+                array_id, _, array_task = task_id.partition("_")
+                out, err = self.db._parse_preamble(script, task_id)
+                out = out or f"slurm-{task_id}.out"
+                env = {
+                    **os.environ,
+                    "SLURM_JOB_ID": task_id,
+                    "SLURM_CPUS_PER_TASK": str(cpus),
+                    "SLURM_SUBMIT_DIR": self.workdir,
+                }
+                if array_task:
+                    env.update(SLURM_ARRAY_JOB_ID=array_id, SLURM_ARRAY_TASK_ID=array_task)
+                job = _LocalJob(task_id, script, cpus, env, out, err or out, deptype, parent_ids)
+                self.jobs[task_id] = job
+                self.unfinished += 1
+                for parent_id in parent_ids:
+                    if parent_id in self.jobs:
+                        parent = self.jobs[parent_id]
+                        if parent.status not in LOCAL_TERMINAL:
+                            parent.children.append(task_id)
+                            job.waiting += 1
+                    elif parent_states.get(parent_id, {}).get("status") not in [None, *LOCAL_TERMINAL]:
+                        # Still running in another agora process, polled in `wait`
+                        self.external.setdefault(parent_id, []).append(task_id)
+                        job.waiting += 1
+                if job.waiting == 0:
+                    self._resolve(job)
+            self._schedule()
+        return job_id
+
+    def _parent_status(self, parent_id: str) -> Optional[str]:
+        if parent_id in self.jobs:
+            return self.jobs[parent_id].status
+        # Parents not run by this executor (missing ones are SLURM jobs or deleted)
+        return self.db.get_local_states([parent_id]).get(parent_id, {}).get("status")
+
+    def _resolve(self, job: _LocalJob) -> None:
+        """Queue a job whose parents are done, or block it."""
+        statuses = [self._parent_status(p) for p in job.parents]
+        blocked = "BLOCKED" in statuses or (
+            job.deptype == "afterok"
+            and any(s not in [None, "COMPLETED"] for s in statuses)
+        )
+        if blocked:
+            self._set_status(job, "BLOCKED")
+        else:
+            self.ready.append(job)
+
+    def _set_status(self, job: _LocalJob, status: str, exit_code: Optional[int] = None) -> None:
+        """Record a final status and release the job's children (holding `cond`)."""
+        job.status = status
+        self.unfinished -= 1
+        with self.db.get_connection() as conn:
+            conn.execute(
+                "UPDATE local_jobs SET status = :status, end_time = :now, exit_code = :exit_code "
+                "WHERE id = :id AND status IN ('PENDING', 'RUNNING')",
+                {"status": status, "now": self._now(), "exit_code": exit_code, "id": job.id},
+            )
+        for child_id in job.children:
+            self._release(self.jobs[child_id])
+        self.cond.notify_all()
+
+    def _release(self, child: _LocalJob) -> None:
+        child.waiting -= 1
+        if child.waiting == 0:
+            self._resolve(child)
+
+    def _schedule(self) -> None:
+        """Start queued jobs (in order) while enough CPUs are free (holding `cond`)."""
+        while self.ready and self.ready[0].cpus <= self.free_cpus:
+            job = self.ready.popleft()
+            with self.db.get_connection() as conn:
+                claimed = conn.execute(
+                    "UPDATE local_jobs SET status = 'RUNNING', start_time = :now "
+                    "WHERE id = :id AND status = 'PENDING'",
+                    {"now": self._now(), "id": job.id},
+                ).rowcount
+            if not claimed:  # cancelled while pending
+                self._set_status(job, "CANCELLED")
+                continue
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.cpus, mp_context=multiprocessing.get_context("spawn")
+                )
+            job.status = "RUNNING"
+            self.free_cpus -= job.cpus
+            future = self.pool.submit(
+                _run_local_job,
+                self.db.db_path,
+                job.id,
+                job.script,
+                job.env,
+                self.workdir,
+                job.out,
+                job.err,
+            )
+            future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+
+    def _on_done(self, job: _LocalJob, future: Future) -> None:
+        """Record the result of a finished job (its children are started by `wait`)."""
+        with self.cond:
+            self.free_cpus += job.cpus
+            try:
+                exit_code = future.result()
+            except Exception as e:
+                print(f"Local job {job.id} could not be run: {e}")
+                exit_code = None
+            status = self.db.get_local_states([job.id]).get(job.id, {}).get("status")
+            if status != "CANCELLED":
+                status = "COMPLETED" if exit_code == 0 else "FAILED"
+            self._set_status(job, status, exit_code)
+
+    def _poll_external(self) -> None:
+        """Release jobs waiting on parents that run in another process (holding `cond`)."""
+        states = self.db.get_local_states(list(self.external))
+        for parent_id in list(self.external):
+            if states.get(parent_id, {}).get("status") in [None, *LOCAL_TERMINAL]:
+                for child_id in self.external.pop(parent_id):
+                    self._release(self.jobs[child_id])
+
+    def cancel(self, job_id: str) -> None:
+        cancel_local_job(self.db, job_id)
+
+    def wait(self) -> None:
+        """Block until every submitted job has finished (Ctrl-C cancels the rest)."""
+        try:
+            with self.cond:
+                while self.unfinished > 0:
+                    self.cond.wait(timeout=1.0)
+                    if self.external:
+                        self._poll_external()
+                    self._schedule()
+        except KeyboardInterrupt:
+            print("Interrupted, cancelling local jobs...")
+            for job in list(self.jobs.values()):
+                if job.status in ["PENDING", "RUNNING"]:
+                    cancel_local_job(self.db, job.id)
+            raise
+        finally:
+            if self.pool is not None and self.unfinished == 0:
+                self.pool.shutdown()
+                self.pool = None
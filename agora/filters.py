@@ -0,0 +1,235 @@
+"""Job filter expressions, compiled to parameterised SQL over the `jobs` columns.
+
+A filter is one or more terms `field OP value` combined with `and`/`&`,
+`or`/`|`, `not`/`!` and parentheses (adjacent terms are ANDed):
+
+    status=FAILED,TIMEOUT                  # IN-list
+    status!=COMPLETED                      # negation
+    node_name^=train | command~"eval.py"   # prefix match, substring match
+    created_at>=2024-05-01 created_at<2024-06-01
+    not (status=RUNNING or reason~Priority)
+
+Operators: `=`, `!=` (comma-separated values form an IN-list), `~`, `!~`
+(substring, case-insensitive), `^=` (prefix) and `>`, `>=`, `<`, `<=`
+(time columns only). Only the fields in `FILTER_COLUMNS` are accepted.
+
+Values end at whitespace, so quote values with spaces. For compatibility
+with the original `command~python train.py` filters, bare words following
+an unquoted `~`/`!~` value (that are no terms or keywords) extend it.
+"""
+
+import itertools
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+# Filter field -> jobs column
+FILTER_COLUMNS = {
+    "id": "id",
+    "job_id": "id",
+    "command": "command",
+    "preamble": "preamble",
+    "node_id": "node_id",
+    "node_name": "node_name",
+    "group": "node_name",
+    "status": "status",
+    "reason": "reason",
+    "exit_code": "exit_code",
+    "workdir": "workdir",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "start_time": "start_time",
+    "end_time": "end_time",
+}
+# Time columns (ranges are allowed) -> date/time separator used in the column
+TIME_COLUMNS = {
+    "created_at": " ",
+    "updated_at": " ",
+    "start_time": "T",  # sacct format
+    "end_time": "T",
+}
+
+TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<term>(?P<field>\w+)\s*(?P<op>!=|!~|\^=|>=|<=|=|~|>|<)\s*
+            (?P<value>"[^"]*"|'[^']*'|[^\s()|&]*))
+        |(?P<lparen>\()
+        |(?P<rparen>\))
+        |(?P<or>\|\|?|or\b)
+        |(?P<and>&&?|and\b)
+        |(?P<not>!|not\b)
+    )""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+# A word that is not a term, keyword or parenthesis (continues an unquoted ~ value)
+BARE_WORD_RE = re.compile(r"\s+[^\s()|&]+")
+
+# Parsed filters: ("term", column, op, [values]), ("not", node), ("and" | "or", [nodes])
+Node = Tuple[Any, ...]
+
+
+def _tokenize(text: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    pos = 0
+    substring = None  # Values of the previous term if it is an unquoted ~ or !~
+    while text[pos:].strip():
+        m = TOKEN_RE.match(text, pos)
+        if not m:
+            word = BARE_WORD_RE.match(text, pos)
+            if substring is None or not word:
+                raise ValueError(f"Invalid filter: {text!r} (at position {pos})")
+            # e.g., command~python train.py (as the original LIKE filters)
+            substring[0] += word.group()
+            pos = word.end()
+            continue
+        substring = None
+        if m.group("term"):
+            op, value = m.group("op"), m.group("value")
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                values = [value[1:-1]]  # quoted: commas are literal
+            elif op in ("=", "!=", "^="):
+                values = value.split(",")
+            else:
+                values = [value]
+                substring = values
+            tokens.append(("term", (m.group("field").lower(), op, values)))
+        else:
+            tokens.append((m.lastgroup, None))
+        pos = m.end()
+    return tokens
+
+
+def parse_filter(text: str) -> Node:
+    """Parse one filter expression (raises ValueError if it is malformed)."""
+    tokens = _tokenize(text)
+    if not tokens:
+        raise ValueError(f"Invalid filter: {text!r} (empty)")
+    pos = 0
+
+    def peek() -> Optional[str]:
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def parse_or() -> Node:
+        nonlocal pos
+        nodes = [parse_and()]
+        while peek() == "or":
+            pos += 1
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and() -> Node:
+        nonlocal pos
+        nodes = [parse_unary()]
+        while peek() in ("and", "term", "not", "lparen"):
+            if peek() == "and":
+                pos += 1
+            nodes.append(parse_unary())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_unary() -> Node:
+        nonlocal pos
+        kind = peek()
+        if kind == "not":
+            pos += 1
+            return ("not", parse_unary())
+        if kind == "lparen":
+            pos += 1
+            node = parse_or()
+            if peek() != "rparen":
+                raise ValueError(f"Invalid filter: {text!r} (missing ')')")
+            pos += 1
+            return node
+        if kind == "term":
+            field, op, values = tokens[pos][1]
+            pos += 1
+            if field not in FILTER_COLUMNS:
+                raise ValueError(
+                    f"Unknown filter field: {field!r} (use one of {', '.join(FILTER_COLUMNS)})"
+                )
+            if op in (">", ">=", "<", "<=") and FILTER_COLUMNS[field] not in TIME_COLUMNS:
+                raise ValueError(
+                    f"Range filters only work on {', '.join(TIME_COLUMNS)}, not {field!r}"
+                )
+            return ("term", FILTER_COLUMNS[field], op, values)
+        raise ValueError(f"Invalid filter: {text!r} (expected a term like status=FAILED)")
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Invalid filter: {text!r} (unexpected {tokens[pos][0]!r})")
+    return node
+
+
+def compile_filters(
+    filters: Optional[List[Union[str, Node]]], relax_status: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """Compile filters (ANDed) to an SQL condition over `jobs` columns and its parameters.
+
+    With `relax_status`, status terms are treated as unknown: the condition
+    then matches every job that could match once its status is refreshed.
+    """
+    names = (f"f{i}" for i in itertools.count())
+    params: Dict[str, Any] = {}
+    nodes = [parse_filter(f) if isinstance(f, str) else f for f in filters or []]
+    if not nodes:
+        return "1", params
+    sql = " AND ".join(
+        f"({_compile(node, params, names, relax_status, False)})" for node in nodes
+    )
+    return sql, params
+
+
+def _compile(
+    node: Node,
+    params: Dict[str, Any],
+    names: Iterator[str],
+    relax_status: bool,
+    negated: bool,
+) -> str:
+    kind = node[0]
+    if kind == "not":
+        inner = _compile(node[1], params, names, relax_status, not negated)
+        return f"NOT COALESCE(({inner}), 0)"  # NULL columns don't match the inner term
+    if kind in ("and", "or"):
+        parts = [_compile(n, params, names, relax_status, negated) for n in node[1]]
+        return f" {kind.upper()} ".join(f"({part})" for part in parts)
+
+    _, column, op, values = node
+    if column == "status" and relax_status:
+        return "0" if negated else "1"
+
+    def param(v: Any) -> str:
+        name = next(names)
+        params[name] = v
+        return f":{name}"
+
+    expr = column
+    if column == "status":
+        expr = "COALESCE(status, 'UNKNOWN')"
+        values = [v.upper() for v in values]
+    if column in TIME_COLUMNS:
+        sep = TIME_COLUMNS[column]
+        values = [v.replace("T" if sep == " " else " ", sep) for v in values]
+
+    if op in ("=", "!="):
+        placeholders = ", ".join(param(v) for v in values)
+        if op == "=":
+            return f"{expr} IN ({placeholders})"
+        return f"COALESCE({expr}, '') NOT IN ({placeholders})"
+    if op in ("~", "!~"):
+        escaped = re.sub(r"([%_\\])", r"\\\1", values[0])
+        like = f"LIKE {param(f'%{escaped}%')} ESCAPE '\\'"
+        if op == "~":
+            return f"{expr} {like}"
+        return f"COALESCE({expr}, '') NOT {like}"
+    if op == "^=":
+        # A range instead of LIKE 'prefix%', so the column index is used
+        ranges = []
+        for v in values:
+            if not v:
+                ranges.append(f"{expr} IS NOT NULL")
+                continue
+            upper = v[:-1] + chr(ord(v[-1]) + 1)
+            ranges.append(f"({expr} >= {param(v)} AND {expr} < {param(upper)})")
+        return " OR ".join(ranges)
+    # Ranges, ignoring times like "Unknown" or "None" (e.g., of pending jobs)
+    return f"{expr} GLOB '[0-9]*' AND {expr} {op} {param(values[0])}"
@@ -1,6 +1,10 @@
 from dataclasses import asdict, dataclass, field
+import itertools
+import random
+import re
+import shlex
 import time
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Dict, Iterator, List, Literal, Optional, Union
 
 
 @dataclass
@@ -36,9 +40,12 @@ class Job:
     updated_at: str = time.strftime("%Y-%m-%d %H:%M:%S")
     start_time: Optional[str] = None
     end_time: Optional[str] = None
+    reason: Optional[str] = None  # Why a pending job is waiting (from squeue)
+    exit_code: Optional[str] = None
     inactive_parents: List[str] = field(
         default_factory=list
     )  # Parents that are completed
+    pack: int = 0  # Slots of the packed allocation this job may share (0: own job)
 
     @property
     def preamble_sbatch(self) -> List[str]:
@@ -62,9 +69,16 @@ class Job:
         """Convert the dataclass instance to a dictionary."""
         return asdict(self)
 
-    def to_script(self, deptype: Literal["afterok", "afterany"] = "afterok") -> str:
+    def to_script(
+        self,
+        deptype: Literal["afterok", "afterany"] = "afterok",
+        array_sizes: Optional[Dict[str, int]] = None,
+    ) -> str:
         """Convert job spec to a SLURM script.
 
+        Args:
+            array_sizes: Sizes of parent arrays (see `dependency_ids`)
+
         Returns:
             String containing the complete SLURM script
         """
@@ -78,7 +92,9 @@ class Job:
             # Convert job IDs to a colon-separated string
             # (e.g., "123:456:789")
             # Filter out inactive dependencies
-            active_parents = [p for p in self.parents if p not in self.inactive_parents]
+            active_parents = dependency_ids(
+                [p for p in self.parents if p not in self.inactive_parents], array_sizes
+            )
             if len(active_parents) != 0:
                 dependencies = ":".join(active_parents)
                 script_lines.append(f"#SBATCH --dependency={deptype}:{dependencies}")
@@ -94,6 +110,159 @@ class Job:
         return "\n".join(script_lines)
 
 
+def dependency_ids(
+    parents: List[str], array_sizes: Optional[Dict[str, int]] = None
+) -> List[str]:
+    """Map parent job IDs to the IDs SLURM accepts in ``--dependency``.
+
+    Packed tasks (``<allocation id>.<i>``) are ``srun`` steps, which cannot
+    be depended on, so they map to their allocation (which fails if any of
+    its tasks fails). Tasks of an array with a known size (``array_sizes``:
+    array ID -> number of tasks) collapse to the array ID if all of them
+    are parents.
+    """
+    array_sizes = array_sizes or {}
+    tasks: Dict[str, set] = {}
+    for p in parents:
+        array_id, sep, _ = p.partition("_")
+        if sep and array_id in array_sizes:
+            tasks.setdefault(array_id, set()).add(p)
+    whole = {a for a, t in tasks.items() if len(t) == array_sizes[a]}
+
+    ids = []
+    for p in parents:
+        array_id = p.partition("_")[0]
+        ids.append(array_id if array_id in whole else re.sub(r"^(\d+)\.\d+$", r"\1", p))
+    return list(dict.fromkeys(ids))
+
+
+def to_array_script(
+    jobs: List[Job],
+    deptype: Literal["afterok", "afterany"] = "afterok",
+    array_sizes: Optional[Dict[str, int]] = None,
+) -> str:
+    """Convert jobs sharing a preamble and parents to a SLURM job array script.
+
+    Each array task looks up its command by ``SLURM_ARRAY_TASK_ID`` in a bash
+    array, so task ``i`` runs ``jobs[i].command``.
+
+    Returns:
+        String containing the complete SLURM script
+    """
+    head = jobs[0]
+    script_lines = [array_log_paths(line) for line in head.preamble_sbatch]
+    script_lines.append(f"#SBATCH --array=0-{len(jobs) - 1}")
+
+    active_parents = dependency_ids(
+        [p for p in head.parents if p not in head.inactive_parents], array_sizes
+    )
+    if active_parents:
+        dependencies = ":".join(active_parents)
+        script_lines.append(f"#SBATCH --dependency={deptype}:{dependencies}")
+
+    script_lines.extend(array_log_paths(line) for line in head.preamble_setup)
+
+    # Lookup table (task id -> command)
+    script_lines.append("AGORA_CMDS=(")
+    script_lines.extend(f"  {shlex.quote(job.command)}" for job in jobs)
+    script_lines.append(")")
+    script_lines.append('eval "${AGORA_CMDS[$SLURM_ARRAY_TASK_ID]}"')
+
+    return "\n".join(script_lines)
+
+
+def single_log_paths(preamble: str) -> str:
+    """Rewrite ``%A_%a`` in --output/--error paths back to ``%j`` (an array task run alone)."""
+    return "\n".join(
+        (
+            line.replace("%A_%a", "%j")
+            if re.search(r"#SBATCH\s+--(output|error)", line)
+            else line
+        )
+        for line in preamble.split("\n")
+    )
+
+
+def array_log_paths(preamble: str) -> str:
+    """Rewrite ``%j`` in --output/--error paths to ``%A_%a`` (per array task)."""
+    return "\n".join(
+        (
+            re.sub(r"%[jJ]", "%A_%a", line)
+            if re.search(r"#SBATCH\s+--(output|error)", line)
+            else line
+        )
+        for line in preamble.split("\n")
+    )
+
+
+PACK_TASK_PREFIX = "agora-task-"
+
+
+def to_pack_script(
+    jobs: List[Job],
+    slots: int,
+    deptype: Literal["afterok", "afterany"] = "afterok",
+    array_sizes: Optional[Dict[str, int]] = None,
+) -> str:
+    """Convert jobs sharing a preamble and parents to one packed SLURM allocation.
+
+    The allocation runs ``jobs[i].command`` as an ``srun`` step named
+    ``agora-task-<i>``, at most ``slots`` steps at a time. Each step writes to
+    the job's own --output/--error path, with ``%j`` expanded to
+    ``<allocation id>.<i>``.
+
+    The allocation fails if any step fails.
+
+    Returns:
+        String containing the complete SLURM script
+    """
+    head = jobs[0]
+    slots = max(1, min(slots, len(jobs)))
+    script_lines = head.preamble_sbatch.copy()
+    script_lines.append(f"#SBATCH --ntasks={slots}")
+
+    active_parents = dependency_ids(
+        [p for p in head.parents if p not in head.inactive_parents], array_sizes
+    )
+    if active_parents:
+        dependencies = ":".join(active_parents)
+        script_lines.append(f"#SBATCH --dependency={deptype}:{dependencies}")
+
+    script_lines.extend(head.preamble_setup)
+
+    def step_paths(flag: str, default: str) -> List[str]:
+        m = re.search(rf"#SBATCH\s+--{flag}[=\s]+(\S+)", head.preamble)
+        path = m.group(1) if m else default
+        return [shlex.quote(re.sub(r"%[jJ]", f"%j.{i}", path)) for i in range(len(jobs))]
+
+    # Lookup tables (task index -> command, log paths)
+    script_lines.append("AGORA_CMDS=(")
+    script_lines.extend(f"  {shlex.quote(job.command)}" for job in jobs)
+    script_lines.append(")")
+    script_lines.append(f"AGORA_OUTS=({' '.join(step_paths('output', 'slurm-%j.out'))})")
+    srun_args = '--output="${AGORA_OUTS[$i]}"'
+    if re.search(r"#SBATCH\s+--error", head.preamble):
+        script_lines.append(f"AGORA_ERRS=({' '.join(step_paths('error', ''))})")
+        srun_args += ' --error="${AGORA_ERRS[$i]}"'
+
+    script_lines.extend(
+        [
+            # Exit 1 if any task failed, so afterok children of the allocation don't run
+            "AGORA_PIDS=()",
+            "AGORA_FAILED=0",
+            'for i in "${!AGORA_CMDS[@]}"; do',
+            f"  while (( $(jobs -rp | wc -l) >= {slots} )); do wait -n || AGORA_FAILED=1; done",
+            "  srun --exact --ntasks=1 --cpus-per-task=${SLURM_CPUS_PER_TASK:-1} "
+            f'--job-name="{PACK_TASK_PREFIX}$i" {srun_args} bash -c "${{AGORA_CMDS[$i]}}" &',
+            "  AGORA_PIDS+=($!)",
+            "done",
+            'for pid in "${AGORA_PIDS[@]}"; do wait "$pid" || AGORA_FAILED=1; done',
+            "exit $AGORA_FAILED",
+        ]
+    )
+    return "\n".join(script_lines)
+
+
 @dataclass
 class PJob:
     preamble: str
@@ -111,3 +280,121 @@ class PGroup:
     loop_count: int = 1
     loop_type: Literal["parallel", "sequential"] = "sequential"
     name: str = ""
+    array: bool = False
+    sample: Dict[str, Any] = field(default_factory=dict)
+    pack: int = 0
+
+
+@dataclass
+class SweepSpec:
+    """A lazily expanded sweep: one job per (sampled) combination of `sweep`.
+
+    `sample` selects a subset without materialising the full product:
+        {"mode": "random", "k": 100, "seed": 0}  # k distinct combinations
+        {"mode": "latin", "k": 100, "seed": 0}   # Latin hypercube over value indices
+        {"mode": "stride", "step": 10, "offset": 0}  # every step-th combination
+    """
+
+    template: str
+    sweep: Dict[str, List[Any]]
+    preamble: str = ""
+    parents: List[str] = field(default_factory=list)
+    node_id: Optional[str] = None
+    node_name: str = ""
+    group_id: Optional[str] = None
+    sample: Dict[str, Any] = field(default_factory=dict)
+    array: bool = False
+    pack: int = 0
+
+    @property
+    def size(self) -> int:
+        """Number of combinations in the full grid."""
+        size = 1
+        for values in self.sweep.values():
+            size *= len(values)
+        return size
+
+    def _combination(self, idx: int) -> Dict[str, Any]:
+        """Decode a grid index (last key varies fastest, as in itertools.product)."""
+        params = {}
+        for key, values in reversed(list(self.sweep.items())):
+            idx, i = divmod(idx, len(values))
+            params[key] = values[i]
+        return {key: params[key] for key in self.sweep}
+
+    def iter_params(self) -> Iterator[Dict[str, Any]]:
+        """Yield the parameter combinations to run, one at a time."""
+        mode = self.sample.get("mode", "grid")
+        keys, values = list(self.sweep.keys()), list(self.sweep.values())
+        rng = random.Random(self.sample.get("seed"))
+        k = min(int(self.sample.get("k", self.size)), self.size)
+
+        if mode == "grid":
+            for combination in itertools.product(*values):
+                yield dict(zip(keys, combination))
+        elif mode == "random":
+            for idx in rng.sample(range(self.size), k):
+                yield self._combination(idx)
+        elif mode == "stride":
+            step = int(self.sample.get("step", 1))
+            for idx in range(int(self.sample.get("offset", 0)), self.size, step):
+                yield self._combination(idx)
+        elif mode == "latin":
+            # One stratum per sample in each dimension, strata shuffled independently
+            strata = [rng.sample(range(k), k) for _ in keys]
+            for i in range(k):
+                yield {
+                    key: vals[int((strata[d][i] + rng.random()) * len(vals) / k)]
+                    for d, (key, vals) in enumerate(zip(keys, values))
+                }
+        else:
+            raise ValueError(f"Unknown sweep sample mode: {mode}")
+
+
+@dataclass
+class PlanNode:
+    """A submission unit of an in-memory workflow plan (a job or a sweep).
+
+    `key` is a placeholder ID; jobs and sweeps depend on the placeholder IDs
+    of other plan nodes until they are resolved at submit time.
+    """
+
+    key: str
+    job: Optional[Job] = None
+    sweep: Optional[SweepSpec] = None
+
+    @property
+    def parents(self) -> List[str]:
+        """Placeholder IDs this node depends on."""
+        if self.sweep is not None:
+            return self.sweep.parents
+        return self.job.parents if self.job is not None else []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialise the node (job nodes include their rendered script)."""
+        d: Dict[str, Any] = {"key": self.key, "parents": self.parents}
+        if self.job is not None:
+            d["job"] = {
+                k: getattr(self.job, k)
+                for k in [
+                    "id",
+                    "command",
+                    "preamble",
+                    "node_id",
+                    "node_name",
+                    "parents",
+                    "pack",
+                ]
+            }
+            d["script"] = self.job.to_script()
+        if self.sweep is not None:
+            d["sweep"] = asdict(self.sweep)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "PlanNode":
+        return cls(
+            key=d["key"],
+            job=Job(**d["job"]) if "job" in d else None,
+            sweep=SweepSpec(**d["sweep"]) if "sweep" in d else None,
+        )
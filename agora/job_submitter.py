@@ -1,27 +1,276 @@
-import copy
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
 import itertools
+import json
 import os
 import random
 import re
-import subprocess
-import tempfile
+import sqlite3
+import threading
 import time
-from typing import Callable, Dict, List, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import yaml
-from agora._base import JobDB
-from agora.interfaces import Job, JobInsert, Job, PGroup, PJob
+from agora._base import PACK_TASK_RE, JobDB, batched, command_hash
+from agora.executors import (
+    JOB_RE,
+    Executor,
+    LocalExecutor,
+    SlurmExecutor,
+    cancel_local_job,
+)
+from agora.interfaces import (
+    PACK_TASK_PREFIX,
+    Job,
+    JobInsert,
+    PGroup,
+    PJob,
+    PlanNode,
+    SweepSpec,
+    array_log_paths,
+    single_log_paths,
+    to_array_script,
+    to_pack_script,
+)
 
-JOB_RE = re.compile(r"Submitted batch job (\d+)")
+# Symbolic random IDs in compiled plans, replaced by fresh IDs when loaded
+ID_TOKEN_RE = re.compile(r"\x00(\d+)\x00")
+PLAN_VERSION = 2
 INACTIVE_PARENT_RULES = [
     lambda id, status, force: status in ["COMPLETED"],
     lambda id, status, force: status in ["FAILED", "CANCELLED"] and force,
 ]
 
 
+class _WalkFrame:
+    """State of one group (or leaf) visited by `JobSubmitter.walk`."""
+
+    __slots__ = (
+        "node",
+        "kind",
+        "depends_on",
+        "group_id",
+        "node_id",
+        "node_name",
+        "loop_idx",
+        "pack",
+        "names",
+        "i",
+        "t",
+        "acc",
+        "last",
+    )
+
+    def __init__(
+        self,
+        node: Union[PGroup, PJob],
+        depends_on: Tuple[str, ...],
+        group_id: Optional[str],
+        node_id: Optional[str],
+        node_name: str,
+        loop_idx: Optional[int],
+        pack: int = 0,
+    ):
+        self.node = node
+        self.kind = None if isinstance(node, PJob) else node.type
+        self.depends_on = depends_on
+        self.group_id = group_id
+        self.node_id = node_id
+        self.node_name = node_name
+        self.loop_idx = loop_idx
+        self.pack = pack  # set on the jobs of packed parallel groups
+        self.names: Optional[List[str]] = None
+        self.i = 0  # next child
+        self.t = 0  # loop iteration
+        self.acc: List[str] = []
+        self.last: Tuple[str, ...] = ()
+
+    def child_name(self, i: int) -> str:
+        """Group name of child `i` (computed once per group, reused across loop iterations)."""
+        if self.names is None:
+            self.names = [
+                ":".join([p for p in [self.node_name, entry.name] if p])
+                for entry in self.node.jobs
+            ]
+        return self.names[i]
+
+
 class JobSubmitter(JobDB):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        script_cache_dir: Optional[str] = None,
+        plan_cache_dir: Optional[str] = None,
+        executor: Literal["slurm", "local"] = "slurm",
+        local_cpus: Optional[int] = None,
+        **kwargs,
+    ):
+        """Initialize the job submitter.
+
+        Args:
+            script_cache_dir: Directory to keep submitted scripts in (by content hash)
+            plan_cache_dir: Directory to cache compiled workflow plans in (by file hash)
+            executor: Run jobs with SLURM or on this machine (see `LocalExecutor`)
+            local_cpus: CPUs the local executor may use (default: all)
+        """
         super().__init__(*args, **kwargs)
+        self.executor: Executor = (
+            LocalExecutor(self, cpus=local_cpus)
+            if executor == "local"
+            else SlurmExecutor(self.slurm)
+        )
+        self.script_cache_dir = (
+            os.path.expanduser(script_cache_dir) if script_cache_dir else None
+        )
+        self.plan_cache_dir = (
+            os.path.expanduser(plan_cache_dir) if plan_cache_dir else None
+        )
+        for cache_dir in [self.script_cache_dir, self.plan_cache_dir]:
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+        # Counter for symbolic IDs, only set while compiling a plan
+        self._id_tokens: Optional[Iterator[int]] = None
+        # command hash -> (job id, status), only set inside `submit_session`
+        self._command_index: Optional[Dict[str, Tuple[str, str]]] = None
+        # Task counts of the arrays submitted by this submitter (see `dependency_ids`)
+        self._array_sizes: Dict[str, int] = {}
+        # Pending DB writes, only set inside `bulk_writes`
+        self._write_buffer: Optional[Dict[str, Any]] = None
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def submit_session(self):
+        """Index the latest job of every command once for duplicate checks.
+
+        Inside the session `_find_prev_job` is a dict lookup instead of a
+        `vw_jobs` scan plus an sacct call per submitted job. The index is
+        updated as new jobs are recorded.
+        """
+        rows = self._run_query("SELECT id, command_hash FROM jobs ORDER BY created_at, rowid")
+        latest = {row["command_hash"]: row["id"] for row in rows}
+        job_states = self.get_job_states(list(latest.values())) if latest else {}
+        self._command_index = {
+            key: (job_id, job_states.get(job_id, {}).get("status", "UNKNOWN"))
+            for key, job_id in latest.items()
+        }
+        try:
+            yield self._command_index
+        finally:
+            self._command_index = None
+
+    def _find_prev_job(self, command: str) -> Optional[Job]:
+        """Find the latest job submitted with `command` (only id/command/status are set)."""
+        if self._command_index is not None:
+            entry = self._command_index.get(command_hash(command))
+        else:
+            rows = self._run_query(
+                "SELECT id FROM jobs WHERE command_hash = :hash AND command = :command "
+                "ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                {"hash": command_hash(command), "command": command},
+            )
+            entry = None
+            if rows:
+                job_id = rows[0]["id"]
+                state = self.get_job_states([job_id]).get(job_id, {})
+                entry = (job_id, state.get("status", "UNKNOWN"))
+        if entry is None:
+            return None
+        return Job(id=entry[0], command=command, preamble="", status=entry[1])
+
+    @contextmanager
+    def bulk_writes(self):
+        """Buffer job records and persist them in one transaction on exit.
+
+        The buffer is flushed even if a submission fails, so every job that
+        was sbatched is recorded. If the transaction fails, the jobs are
+        written one by one and the ones that still fail are reported (the
+        error of a failed submission is re-raised either way).
+        """
+        self._write_buffer = {"inserts": [], "updates": {}, "deps": {}}
+        try:
+            yield
+        finally:
+            buffer, self._write_buffer = self._write_buffer, None
+            try:
+                self.write_jobs(buffer["inserts"], buffer["updates"], buffer["deps"])
+            except sqlite3.Error as e:
+                print(f"⚠️  Recording {len(buffer['deps'])} jobs failed ({e}), retrying one by one")
+                self._write_one_by_one(buffer)
+
+    def _write_one_by_one(self, buffer: Dict[str, Any]) -> None:
+        """Write buffered jobs in one transaction each, then their dependencies.
+
+        Job rows go first, so that a job is recorded even if one of its
+        parents could not be; dependencies on such parents are skipped.
+        """
+        rows = [(None, rec) for rec in buffer["inserts"]] + list(buffer["updates"].items())
+        for prev_job_id, rec in rows:
+            try:
+                self.write_jobs(
+                    [] if prev_job_id else [rec], {prev_job_id: rec} if prev_job_id else None
+                )
+            except sqlite3.Error as e:
+                print(
+                    f"❌ Could not record submitted job {rec.id} "
+                    f"(replacing {prev_job_id or 'nothing'}): {e}\n   command: {rec.command}"
+                )
+
+        for child, parents in buffer["deps"].items():
+            ids = [child, *parents]
+            found = self._run_query(
+                f"SELECT id FROM jobs WHERE id IN ({', '.join('?' * len(ids))})", ids
+            )
+            known = {row["id"] for row in found}
+            if child not in known:
+                continue  # Reported above
+            missing = [parent for parent in parents if parent not in known]
+            if missing:
+                print(f"⚠️  Not recording dependencies of job {child} on unrecorded jobs {missing}")
+            try:
+                self.write_jobs([], None, {child: [p for p in parents if p in known]})
+            except sqlite3.Error as e:
+                print(f"❌ Could not record dependencies of job {child}: {e}")
+
+    def _record_job(
+        self, rec: JobInsert, parents: List[str], prev_job_id: Optional[str] = None
+    ) -> None:
+        """Insert (or replace `prev_job_id` with) a submitted job and its dependencies."""
+        if prev_job_id:
+            print(f"Updating existing job: {prev_job_id} => {rec.id}")
+        else:
+            print(f"Inserting new job: {rec.id}")
+
+        with self._write_lock:
+            if self._write_buffer is not None:
+                if prev_job_id:
+                    self._write_buffer["updates"][prev_job_id] = rec
+                else:
+                    self._write_buffer["inserts"].append(rec)
+                self._write_buffer["deps"][rec.id] = parents
+                return
+
+        if prev_job_id:
+            self.update_job(prev_job_id, rec)
+        else:
+            self.create_job(rec)
+        self.upsert_deps(rec.id, parents)
+
+    def _index_job(self, command: str, job_id: str) -> None:
+        """Record a freshly submitted job in the session command index."""
+        if self._command_index is not None:
+            self._command_index[command_hash(command)] = (job_id, "PENDING")
 
     def _parse_job_id(self, result: str) -> str:
         m = JOB_RE.search(result)
@@ -31,6 +280,21 @@ class JobSubmitter(JobDB):
         else:
             raise RuntimeError(f"Could not parse job id from sbatch output:\n{result}")
 
+    def _submit_script(self, script: str) -> str:
+        """Submit a job script with the executor (e.g., piped to `sbatch`) and return its job ID.
+
+        If `script_cache_dir` is set, the script is also kept there under its
+        content hash (for debugging).
+        """
+        if self.script_cache_dir:
+            digest = hashlib.sha256(script.encode()).hexdigest()[:16]
+            script_path = os.path.join(self.script_cache_dir, f"{digest}.sh")
+            if not os.path.exists(script_path):
+                with open(script_path, "w") as f:
+                    f.write(script)
+
+        return self.executor.submit(script)
+
     def _submit_job(
         self,
         job: Job,
@@ -47,145 +311,333 @@ class JobSubmitter(JobDB):
             The job ID as a string
         """
 
+        # A retried array task runs alone, so it logs to %j instead of %A_%a
+        job.preamble = single_log_paths(job.preamble)
+
         if debug:
             print(f"\nDEBUG:\n{job.to_script(self.deptype)}\n")
             return "debug-job-id"
 
-        if dry:
+        if dry and not job.command.endswith(" --dry"):  # Retried dry jobs already have it
             job.command += " --dry"
 
-        # 1. Create a temporary file from script
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".sh", delete=False) as f:
-            script_path = f.name
-            f.write(job.to_script(deptype=self.deptype))
+        # 1. Check for prev job
+        prev_job = None
+        if prev_job_id:  # Replace the given job
+            prev_job = Job(id=prev_job_id, command=job.command, preamble=job.preamble)
+        else:  # Lookup by command
+            prev_job = self._find_prev_job(job.command)
+            if prev_job and prev_job.status in ignore_statuses:
+                print(
+                    f"Job {prev_job.id} already submitted with status {prev_job.status}."
+                )
+                return prev_job.id
+
+        # 2. Submit job (sbatch)
+        job.id = self._submit_script(
+            job.to_script(deptype=self.deptype, array_sizes=self._array_sizes)
+        )
+        print(f"Submitted job with ID {job.id}")
 
-        try:
-            # 2. Check for prev job
-            prev_job = None
-            if prev_job_id:  # Lookup by ID
-                prev_jobs = self.get_jobs([f"id={prev_job_id}"])
-                prev_job = prev_jobs[0] if prev_jobs else None
-            else:  # Lookup by command
-                prev_jobs = self.get_jobs([f"command='{job.command}'"])
-                prev_job = prev_jobs[0] if prev_jobs else None
-                if prev_job and prev_job.status in ignore_statuses:
-                    print(
-                        f"Job {prev_job.id} already submitted with status {prev_job.status}."
-                    )
-                    return prev_job.id
-
-            # 3. Submit job (sbatch)
-            result = os.popen(f"sbatch {script_path}").read()
-            job.id = self._parse_job_id(result)
-            print(f"Submitted job with ID {job.id}")
-
-            # 4. Upsert job in the database
-            upsert_job = JobInsert(
-                **{
-                    k: v
-                    for k, v in job.to_dict().items()
-                    if k in JobInsert.__dataclass_fields__
-                }
-            )
+        # 3. Upsert job in the database
+        upsert_job = JobInsert(
+            **{
+                k: v
+                for k, v in job.to_dict().items()
+                if k in JobInsert.__dataclass_fields__
+            }
+        )
+
+        self._record_job(upsert_job, job.parents, prev_job.id if prev_job else None)
+        self._index_job(job.command, job.id)
+        return job.id
+
+    def _split_submitted(
+        self, jobs: List[Job], dry: bool, ignore_statuses: List[str]
+    ) -> Tuple[List[Optional[str]], Dict[int, Job], List[int]]:
+        """Split jobs into already submitted ones and ones still to submit.
 
-            # clean up
+        Returns:
+            The job IDs so far (None for jobs to submit), the previous jobs to
+            replace (by index) and the indices of the jobs to submit
+        """
+        job_ids: List[Optional[str]] = [None] * len(jobs)
+        prev_jobs: Dict[int, Job] = {}
+        pending = []
+        for i, job in enumerate(jobs):
+            if dry and not job.command.endswith(" --dry"):
+                job.command += " --dry"
+            prev_job = self._find_prev_job(job.command)
+            if prev_job and prev_job.status in ignore_statuses:
+                print(
+                    f"Job {prev_job.id} already submitted with status {prev_job.status}."
+                )
+                job_ids[i] = prev_job.id
+                continue
             if prev_job:
-                print(f"Updating existing job: {prev_job.id} => {upsert_job.id}")
-                self.update_job(prev_job.id, upsert_job)
-            else:
-                print(f"Inserting new job: {upsert_job.id}")
-                self.create_job(upsert_job)
-            self.upsert_deps(upsert_job.id, job.parents)
-            time.sleep(0.1)
-            return job.id
-        finally:
-            # Clean up the temporary file
-            os.unlink(script_path)
+                prev_jobs[i] = prev_job
+            pending.append(i)
+        return job_ids, prev_jobs, pending
+
+    def _record_task(self, job: Job, prev_job: Optional[Job]) -> None:
+        """Record one task of a job array or packed allocation."""
+        upsert_job = JobInsert(
+            **{
+                k: v
+                for k, v in job.to_dict().items()
+                if k in JobInsert.__dataclass_fields__
+            }
+        )
+        self._record_job(upsert_job, job.parents, prev_job.id if prev_job else None)
+        self._index_job(job.command, job.id)
+
+    def _submit_array(
+        self,
+        jobs: List[Job],
+        dry: bool = False,
+        ignore_statuses: List[str] = ["PENDING", "RUNNING", "COMPLETED"],
+        max_array_size: int = 1000,
+    ) -> List[str]:
+        """Submit jobs sharing a preamble and parents as SLURM job arrays.
+
+        Jobs whose command was already submitted (with a status in
+        `ignore_statuses`) are skipped. The remaining jobs are submitted as one
+        array per `max_array_size` tasks and recorded as `<array_id>_<task_id>`.
+
+        Args:
+            jobs: The job specifications to submit (one per array task)
+        Returns:
+            The job IDs, in the same order as `jobs`
+        """
+        job_ids, prev_jobs, pending = self._split_submitted(jobs, dry, ignore_statuses)
+
+        for start in range(0, len(pending), max_array_size):
+            chunk = pending[start : start + max_array_size]
+            script = to_array_script(
+                [jobs[i] for i in chunk], deptype=self.deptype, array_sizes=self._array_sizes
+            )
+            array_id = self._submit_script(script)
+            self._array_sizes[array_id] = len(chunk)
+            print(f"Submitted job array with ID {array_id} ({len(chunk)} tasks)")
+
+            for task_id, i in enumerate(chunk):
+                job = jobs[i]
+                job.id = f"{array_id}_{task_id}"
+                job.preamble = array_log_paths(job.preamble)
+                self._record_task(job, prev_jobs.get(i))
+                job_ids[i] = job.id
+
+        return [str(job_id) for job_id in job_ids]
+
+    def _submit_pack(
+        self,
+        jobs: List[Job],
+        slots: int,
+        dry: bool = False,
+        ignore_statuses: List[str] = ["PENDING", "RUNNING", "COMPLETED"],
+    ) -> List[str]:
+        """Submit jobs sharing a preamble and parents as one packed allocation.
+
+        The allocation runs the jobs as `srun` steps, `slots` at a time (see
+        `to_pack_script`). Each job is recorded as `<allocation id>.<i>` (for
+        display, status and cancelling; children depend on the allocation). Jobs
+        whose command was already submitted are skipped. Executors other than
+        SLURM submit the jobs one by one.
+
+        Returns:
+            The job IDs, in the same order as `jobs`
+        """
+        if not isinstance(self.executor, SlurmExecutor):
+            return [self._submit_job(job, dry=dry, ignore_statuses=ignore_statuses) for job in jobs]
+
+        job_ids, prev_jobs, pending = self._split_submitted(jobs, dry, ignore_statuses)
+        if pending:
+            script = to_pack_script(
+                [jobs[i] for i in pending], slots, self.deptype, self._array_sizes
+            )
+            alloc_id = self._submit_script(script)
+            print(f"Submitted packed job with ID {alloc_id} ({len(pending)} tasks)")
+            for task_id, i in enumerate(pending):
+                jobs[i].id = f"{alloc_id}.{task_id}"
+                self._record_task(jobs[i], prev_jobs.get(i))
+                job_ids[i] = jobs[i].id
+
+        return [str(job_id) for job_id in job_ids]
 
     def cancel(self, job_id: str):
-        """Cancel jobs with the given job IDs."""
-        try:
-            subprocess.run(["scancel", str(job_id)], check=True)
-            print(f"Cancelled job {job_id}")
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to cancel job {job_id}: {e}")
+        """Cancel the job with the given job ID."""
+        self.cancel_jobs([job_id])
+
+    def cancel_jobs(self, job_ids: List[str], chunk_size: int = 500) -> None:
+        """Cancel jobs with a few `scancel id1 id2 ...` calls (`chunk_size` IDs each).
+
+        Jobs of the local executor are cancelled directly and packed tasks by
+        their `srun` step.
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        local_ids = self.get_local_states(job_ids)
+        for job_id in local_ids:
+            cancel_local_job(self, job_id)
+
+        slurm_ids = [
+            j for j in job_ids if j not in local_ids and not PACK_TASK_RE.match(j)
+        ]
+        slurm_ids += self._packed_step_ids(
+            [j for j in job_ids if j not in local_ids and PACK_TASK_RE.match(j)]
+        )
+        failed = 0
+        for chunk in batched(slurm_ids, chunk_size):
+            result = self.slurm.run(["scancel", *chunk])
+            if result.returncode != 0:
+                failed += 1
+                print(f"scancel failed for some jobs: {result.stderr.strip()}")
+        if job_ids and not failed:
+            print(
+                f"Cancelled job {job_ids[0]}"
+                if len(job_ids) == 1
+                else f"Cancelled {len(job_ids)} jobs"
+            )
+
+    def _packed_step_ids(self, task_ids: List[str]) -> List[str]:
+        """Find the `srun` steps running packed tasks (by step name, one sacct call)."""
+        if not task_ids:
+            return []
+        alloc_ids = dict.fromkeys(task_id.partition(".")[0] for task_id in task_ids)
+        output = self.slurm.run(
+            [
+                "sacct",
+                "-j",
+                ",".join(alloc_ids),
+                "--format",
+                "jobid,jobname",
+                "--noheader",
+                "--parsable2",
+            ]
+        ).stdout
+        steps = {}
+        for line in output.strip().split("\n"):
+            step_id, _, name = line.partition("|")
+            if "." in step_id and name.startswith(PACK_TASK_PREFIX):
+                task_id = f"{step_id.split('.')[0]}.{name[len(PACK_TASK_PREFIX):]}"
+                steps[task_id] = step_id
+
+        for task_id in task_ids:
+            if task_id not in steps:
+                print(
+                    f"Packed task {task_id} has not started yet; "
+                    f"cancel its allocation ({task_id.partition('.')[0]}) to stop it."
+                )
+        return [steps[task_id] for task_id in task_ids if task_id in steps]
 
     def cancel_all(self):
         """Cancel all jobs in the database."""
-        jobs = self.get_jobs()
-        for job in jobs:
-            self.cancel(job.id)
+        rows = self._run_query("SELECT id FROM jobs ORDER BY created_at, rowid")
+        self.cancel_jobs([row["id"] for row in rows])
 
     def delete(self, job_ids: Optional[List[str]] = None, cascade: bool = False):
-        """Delete jobs with the given job IDs."""
+        """Delete jobs with the given job IDs (in one transaction) and cancel them."""
         if not job_ids:
             print("No job IDs provided, deleting all jobs in the database.")
-            job_ids = [job.id for job in self.get_jobs(ignore_status=True)]
+            job_ids = [row["id"] for row in self._run_query("SELECT id FROM jobs")]
 
-        for id in job_ids:
-            print(f"Deleting job {id}")
-            self.delete_job(id, on_delete=lambda id: self.cancel(id), cascade=cascade)
+        deleted = self.delete_jobs(job_ids, cascade=cascade)
+        for job_id in set(map(str, job_ids)) - set(deleted):
+            print(f"Job {job_id} not found, nothing to delete.")
+        print(f"Deleted {len(deleted)} jobs")
+        self.cancel_jobs(deleted)
 
     def delete_by_node(self, node_ids: List[str]):
-        """Delete all jobs associated with specific node IDs."""
+        """Delete all jobs associated with specific node IDs (and their descendants)."""
         if not node_ids:
             print("No node IDs provided, deleting all jobs in the database.")
             return
+        rows = self._run_query(
+            "SELECT id, node_id FROM jobs WHERE node_id IN (SELECT value FROM json_each(:node_ids))",
+            {"node_ids": json.dumps(node_ids)},
+        )
         for node_id in node_ids:
-            jobs = self.get_jobs([f"node_id={node_id}"])
-            if not jobs:
+            if not any(row["node_id"] == node_id for row in rows):
                 print(f"No jobs found for node ID {node_id}.")
-                continue
-
-            for job in jobs:
-                print(f"Deleting job {job.id} associated with node {node_id}")
-                self.delete_job(
-                    job.id, on_delete=lambda id: self.cancel(id), cascade=True
-                )
+        if rows:
+            self.delete([row["id"] for row in rows], cascade=True)
 
-    def retry_by_node(self, node_ids: List[str]):
-        """Retry all jobs associated with specific node IDs."""
+    def retry_by_node(self, node_ids: List[str], dry: bool = False):
+        """Retry all jobs associated with specific node IDs (as one plan)."""
         if not node_ids:
             print("No node IDs provided, retrying all jobs in the database.")
             return
+        rows = self._run_query(
+            "SELECT id, node_id FROM jobs WHERE node_id IN (SELECT value FROM json_each(:node_ids)) "
+            "ORDER BY created_at, rowid",
+            {"node_ids": json.dumps(node_ids)},
+        )
         for node_id in node_ids:
-            jobs = self.get_jobs([f"node_id={node_id}"])
-            if not jobs:
+            if not any(row["node_id"] == node_id for row in rows):
                 print(f"No jobs found for node ID {node_id}.")
-                continue
-            for job in jobs:
-                print(f"Retrying job {job.id} associated with node {node_id}")
-                self.retry(job.id, force=True)
+        for row in rows:
+            print(f"Retrying job {row['id']} associated with node {row['node_id']}")
+        self.retry_jobs([row["id"] for row in rows], force=True, dry=dry)
 
     def retry(self, job_id: str, force: bool = False, debug: bool = False):
-        """Retry a job with the given job ID."""
-        job = self.get_jobs([f"id={job_id}"])[0]
-        parent_states = self.get_job_states(job.parents)
+        """Retry a job with the given job ID (and everything downstream of it)."""
+        self.retry_jobs([job_id], force=force, debug=debug)
 
-        if job:
-            print(f"Retrying job {job_id}")
-            ignore_statuses = ["COMPLETED"] if not force else []
+    def retry_jobs(
+        self,
+        job_ids: List[str],
+        force: bool = False,
+        debug: bool = False,
+        dry: bool = False,
+        max_workers: int = 4,
+    ) -> Dict[str, List[str]]:
+        """Resubmit jobs and all their descendants as one plan.
 
-            # Add inactive parents to the job
-            for parent_id in job.parents:
-                for rule in INACTIVE_PARENT_RULES:
-                    parent_state = parent_states.get(parent_id, {})
-                    if rule(parent_id, parent_state.get("status", ""), force):
-                        job.inactive_parents.append(parent_id)
-
-            self._submit_job(
-                job,
-                dry=False,
-                ignore_statuses=ignore_statuses,
-                prev_job_id=job_id,
-                debug=debug,
-            )
+        The affected sub-DAG is loaded with one query and the states of the
+        parents outside of it with one sacct call. Every job is resubmitted
+        once, in topological order, replacing its old row. Completed parents
+        outside the sub-DAG (and, with `force`, failed or cancelled parents of
+        the given jobs) are not waited for.
 
-            # Get children -- should be resubmitted too
+        Returns:
+            Mapping from old to new job IDs
+        """
+        jobs = self.get_subgraph(job_ids)
+        by_id = {job.id: job for job in jobs}
+        for job_id in job_ids:
+            if str(job_id) not in by_id:
+                print(f"Job {job_id} not found in the database.")
+        if not jobs:
+            return {}
+
+        roots = {str(job_id) for job_id in job_ids}
+        external = sorted({p for job in jobs for p in job.parents if p not in by_id})
+        parent_states = self.get_job_states(external)
+
+        # Topological order (Kahn), ties in creation order
+        waiting = {job.id: sum(p in by_id for p in job.parents) for job in jobs}
+        ready = deque(job for job in jobs if waiting[job.id] == 0)
+        plan: List[PlanNode] = []
+        while ready:
+            job = ready.popleft()
+            print(f"Retrying job {job.id}")
+            for parent_id in job.parents:
+                if parent_id in by_id:
+                    continue
+                status = parent_states.get(parent_id, {}).get("status", "")
+                job_force = force and job.id in roots
+                if any(rule(parent_id, status, job_force) for rule in INACTIVE_PARENT_RULES):
+                    job.inactive_parents.append(parent_id)
+            plan.append(PlanNode(key=job.id, job=job))
             for child_id in job.children:
-                self.retry(child_id)
-        else:
-            print(f"Job {job_id} not found in the database.")
+                if child_id in waiting:
+                    waiting[child_id] -= 1
+                    if waiting[child_id] == 0:
+                        ready.append(by_id[child_id])
+
+        if debug:
+            self._print_debug_plan(plan)
+            return {}
+        return self.submit_plan(plan, dry=dry, max_workers=max_workers, retry=True)
 
     def submit(
         self,
@@ -193,23 +645,291 @@ class JobSubmitter(JobDB):
         dry: bool = False,
         debug: bool = False,
         use_group_id: bool = False,
+        array: bool = False,
+        max_workers: int = 4,
+        batch_size: int = 1000,
     ):
-        """Parse the YAML file and submit jobs."""
-        cfg = yaml.safe_load(open(file))
+        """Parse the YAML file and submit jobs.
+
+        Args:
+            array: Submit every sweep group as a SLURM job array
+            max_workers: Number of concurrent sbatch calls per submit wave
+            batch_size: Number of sweep jobs expanded and recorded at a time
+        """
+        plan = self.load_plan(self.compile_plan(file, array=array))
+        if debug:
+            self._print_debug_plan(plan)
+            return
 
+        with self.submit_session():
+            self.submit_plan(
+                plan, dry=dry, max_workers=max_workers, batch_size=batch_size
+            )
+        self.executor.wait()
+
+    def _new_id(self) -> str:
+        """Return a random group/node ID (a symbolic token while compiling a plan)."""
+        if self._id_tokens is not None:
+            return f"\x00{next(self._id_tokens)}\x00"
+        return f"{random.randint(100000, 999999)}"
+
+    def compile_plan(self, file: str, array: bool = False) -> Dict[str, Any]:
+        """Compile a YAML workflow into a serialised, flat execution plan.
+
+        The plan (nodes, parent edges, rendered scripts and symbolic group/node
+        IDs) is cached in `plan_cache_dir`, keyed by the hash of the file, so
+        unchanged workflows are not re-parsed and re-walked.
+
+        Returns:
+            The compiled plan (see `load_plan`)
+        """
+        with open(file, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(
+            content + f"\0version={PLAN_VERSION}\0array={array}".encode()
+        ).hexdigest()
+
+        cache_path = None
+        if self.plan_cache_dir:
+            cache_path = os.path.join(self.plan_cache_dir, f"{digest}.json")
+            if os.path.exists(cache_path):
+                with open(cache_path) as f:
+                    return json.load(f)
+
+        cfg = yaml.safe_load(content)
         preamble_map = {
             name: "\n".join(lines) for name, lines in cfg["preambles"].items()
         }
+        node = self._parse_group_dict(cfg["group"], array=array)
+
+        self._id_tokens = itertools.count()
+        try:
+            plan = self.build_plan(node, preamble_map)
+        finally:
+            self._id_tokens = None
+
+        compiled = {
+            "version": PLAN_VERSION,
+            "source": os.path.abspath(file),
+            "hash": digest,
+            "nodes": [pnode.to_dict() for pnode in plan],
+        }
+        if cache_path:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(compiled, f, default=str)
+            os.replace(tmp_path, cache_path)
+        return compiled
+
+    def load_plan(self, compiled: Dict[str, Any]) -> List[PlanNode]:
+        """Instantiate a compiled plan, giving its symbolic IDs fresh random values."""
+        ids: Dict[str, str] = defaultdict(lambda: self._new_id())
+        sub = lambda s: ID_TOKEN_RE.sub(lambda m: ids[m.group(1)], s) if s else s
+
+        plan = []
+        for d in compiled["nodes"]:
+            pnode = PlanNode.from_dict(d)
+            if pnode.job is not None:
+                pnode.job.command = sub(pnode.job.command)
+                pnode.job.node_id = sub(pnode.job.node_id)
+            if pnode.sweep is not None:
+                pnode.sweep.node_id = sub(pnode.sweep.node_id)
+                pnode.sweep.group_id = sub(pnode.sweep.group_id)
+            plan.append(pnode)
+        return plan
+
+    def _print_debug_plan(self, plan: List[PlanNode]) -> None:
+        """Print the scripts of a plan instead of submitting it."""
+        for pnode in plan:
+            if pnode.job is not None:
+                print(f"\nDEBUG:\n{pnode.job.to_script(self.deptype)}")
+                print(f"NODE_ID: {pnode.job.node_id}\n")
+                print("-" * 20)
+            if pnode.sweep is not None:
+                self._print_debug_sweep(pnode.sweep)
+
+    def _print_debug_sweep(self, spec: SweepSpec) -> List[str]:
+        """Print the scripts of a sweep instead of submitting it."""
+        job_ids = []
+        for batch in batched(self._iter_sweep_jobs(spec), 1000):
+            if spec.pack:
+                scripts = [to_pack_script(batch, spec.pack, self.deptype)]
+            elif spec.array:
+                scripts = [to_array_script(batch, self.deptype)]
+            else:
+                scripts = [job.to_script(self.deptype) for job in batch]
+            for script in scripts:
+                print(f"\nDEBUG:\n{script}")
+                print(f"NODE_ID: {spec.node_id} | GROUP_ID: {spec.group_id}\n")
+                print("-" * 20)
+            job_ids.extend(job.id for job in batch)
+        return job_ids
+
+    def build_plan(
+        self, node: Union[PGroup, PJob], preamble_map: Dict[str, str]
+    ) -> List[PlanNode]:
+        """Walk the job tree without submitting and return the workflow DAG.
+
+        Jobs and sweeps get placeholder IDs (``plan-<n>``) and depend on the
+        placeholder IDs of their parents. Sweeps are not expanded. Nodes are
+        returned in submission (DFS) order.
+        """
+        plan: List[PlanNode] = []
+        counter = itertools.count()
+
+        def collect(job: Optional[Job] = None, sweep: Optional[SweepSpec] = None):
+            key = f"plan-{next(counter)}"
+            if job is not None:
+                job.id = key
+            plan.append(PlanNode(key=key, job=job, sweep=sweep))
+            return key
 
-        submit_fn = lambda job: self._submit_job(job, dry=dry)
         self.walk(
-            node=self._parse_group_dict(cfg["group"]),
+            node=node,
             preamble_map=preamble_map,
-            debug=debug,
             depends_on=[],
             submitted_jobs=[],
-            submit_fn=submit_fn,
+            submit_fn=lambda job: collect(job=job),
+            sweep_fn=lambda spec: [collect(sweep=spec)],
         )
+        return plan
+
+    @staticmethod
+    def _plan_waves(plan: List[PlanNode]) -> List[List[PlanNode]]:
+        """Split a plan into topological waves (nodes whose parents are in earlier waves)."""
+        owner = {pnode.key: i for i, pnode in enumerate(plan)}
+        levels: List[int] = []
+        for pnode in plan:
+            parent_levels = [levels[owner[p]] for p in pnode.parents if p in owner]
+            levels.append(max(parent_levels, default=-1) + 1)
+
+        waves: List[List[PlanNode]] = [[] for _ in range(max(levels, default=-1) + 1)]
+        for pnode, level in zip(plan, levels):
+            waves[level].append(pnode)
+        return waves
+
+    def submit_plan(
+        self,
+        plan: List[PlanNode],
+        dry: bool = False,
+        max_workers: int = 4,
+        batch_size: int = 1000,
+        retry: bool = False,
+    ) -> Dict[str, List[str]]:
+        """Submit a workflow plan wave by wave with a bounded thread pool.
+
+        All nodes of a wave only depend on earlier waves, so they are submitted
+        concurrently once their parents' SLURM IDs are known. Sweeps are
+        expanded lazily and submitted and recorded `batch_size` jobs at a time.
+
+        Args:
+            retry: Plan keys are IDs of existing jobs, which are resubmitted
+                and replaced (see `retry_jobs`)
+
+        Returns:
+            Mapping from placeholder IDs to SLURM job IDs
+        """
+        resolved: Dict[str, List[str]] = {}
+
+        def resolve(parents: List[str]) -> List[str]:
+            return [job_id for p in parents for job_id in resolved.get(p, [p])]
+
+        def submit_one(job: Job) -> str:
+            if retry:
+                return self._submit_job(job, dry=dry, prev_job_id=job.id)
+            return self._submit_job(job, dry=dry)
+
+        def submit_many(jobs: List[Job]) -> List[str]:
+            # Concurrent duplicates would all miss each other in `_find_prev_job`,
+            # so each command is submitted once and its duplicates get its ID
+            if retry:  # Every job replaces its own row
+                return list(pool.map(submit_one, jobs))
+            first: Dict[str, int] = {}
+            unique: List[Job] = []
+            for job in jobs:
+                key = command_hash(job.command)
+                if key not in first:
+                    first[key] = len(unique)
+                    unique.append(job)
+            job_ids = list(pool.map(submit_one, unique))
+            return [job_ids[first[command_hash(job.command)]] for job in jobs]
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            for wave in self._plan_waves(plan):
+                # Single jobs of the wave, one DB transaction per batch
+                singles = [pnode for pnode in wave if pnode.job is not None]
+                for batch in batched(singles, batch_size):
+                    with self.bulk_writes():
+                        # Jobs of packed groups that can share an allocation
+                        packs: Dict[Tuple[int, str, Tuple[str, ...]], List[PlanNode]] = (
+                            defaultdict(list)
+                        )
+                        unpacked = []
+                        for pnode in batch:
+                            job = pnode.job
+                            job.parents = resolve(job.parents)
+                            if job.pack:
+                                packs[(job.pack, job.preamble, tuple(job.parents))].append(pnode)
+                            else:
+                                unpacked.append(pnode)
+                        job_ids = submit_many([pnode.job for pnode in unpacked])
+                        for pnode, job_id in zip(unpacked, job_ids):
+                            resolved[pnode.key] = [job_id]
+                        for (slots, _, _), pnodes in packs.items():
+                            job_ids = self._submit_pack(
+                                [pnode.job for pnode in pnodes], slots, dry=dry
+                            )
+                            for pnode, job_id in zip(pnodes, job_ids):
+                                resolved[pnode.key] = [job_id]
+
+                # Sweeps of the wave, streamed in batches
+                for pnode in wave:
+                    if pnode.sweep is None:
+                        continue
+                    spec = pnode.sweep
+                    spec.parents = resolve(spec.parents)
+                    resolved[pnode.key] = []
+                    for batch in batched(self._iter_sweep_jobs(spec), batch_size):
+                        with self.bulk_writes():
+                            if spec.pack:
+                                job_ids = self._submit_pack(batch, spec.pack, dry=dry)
+                            elif spec.array:
+                                job_ids = self._submit_array(batch, dry=dry)
+                            else:
+                                job_ids = submit_many(batch)
+                        resolved[pnode.key].extend(job_ids)
+        return resolved
+
+    def _iter_sweep_jobs(self, spec: SweepSpec) -> Iterator[Job]:
+        """Yield one job per sweep combination, without materialising the sweep."""
+        for i, params in enumerate(spec.iter_params()):
+            yield Job(
+                id=self._new_id(),
+                command=spec.template.format(
+                    **params, group_id=spec.group_id, sweep_idx=i
+                ),
+                preamble=spec.preamble,
+                parents=list(spec.parents),
+                node_id=spec.node_id,
+                node_name=spec.node_name,
+            )
+
+    def _submit_sweep(
+        self,
+        spec: SweepSpec,
+        submit_fn: Callable[[Job], str],
+        batch_size: int = 1000,
+    ) -> List[str]:
+        """Stream the jobs of a sweep into `submit_fn` (or `_submit_array`)."""
+        job_ids: List[str] = []
+        for batch in batched(self._iter_sweep_jobs(spec), batch_size):
+            if spec.pack:
+                job_ids.extend(self._submit_pack(batch, spec.pack))
+            elif spec.array:
+                job_ids.extend(self._submit_array(batch))
+            else:
+                job_ids.extend(submit_fn(job) for job in batch)
+        return job_ids
 
     def walk(
         self,
@@ -219,16 +939,19 @@ class JobSubmitter(JobDB):
         depends_on: List[str] = [],
         submitted_jobs: List[str] = [],
         submit_fn: Optional[Callable[[Job], str]] = None,
+        sweep_fn: Optional[Callable[[SweepSpec], List[str]]] = None,
         group_id: Optional[str] = None,
         node_id: Optional[str] = None,
         node_name: str = "",
         loop_idx: Optional[int] = None,
     ):
-        """Recursively walk the job tree and submit jobs.
+        """Walk the job tree and submit jobs.
 
-        This will recursively walk the job tree and submit jobs, creating a tree of nodes. A Node is a
+        This will walk the job tree and submit jobs, creating a tree of nodes. A Node is a
         group of jobs in which all jobs in the node are within a loop, sequence or parallel group.
 
+        The tree is walked with an explicit stack (no recursion limit). Dependency lists
+        are shared immutable tuples, so visiting a child does not copy its parents.
 
         Args:
             node (Union[PGroup, PJob]): The current node to process
@@ -237,6 +960,8 @@ class JobSubmitter(JobDB):
             depends_on (List[str], optional): A list of job IDs that this job depends on. Defaults to [].
             submitted_jobs (List[str], optional): A list of job IDs that have already been submitted. Defaults to [].
             submit_fn (Optional[Callable[[Job], str]], optional): A function to submit a job. Defaults to None.
+            sweep_fn (Optional[Callable[[SweepSpec], List[str]]], optional): A function to submit the jobs of a
+                sweep. Defaults to streaming them into `submit_fn` (or a job array for `array` sweeps).
             group_id (Optional[str], optional): The ID of the group this job belongs to. Defaults to None.
             node_id (Optional[str], optional): The ID of the node this job belongs to. Defaults to None.
             node_name (str, optional): The name of the node this job belongs to. Defaults to "".
@@ -246,188 +971,139 @@ class JobSubmitter(JobDB):
             List[str]: A list of job IDs that have been submitted.
         """
         submit_fn = submit_fn if submit_fn is not None else self._submit_job
-        subgroup_id = f"{random.randint(100000, 999999)}"
-        group_id = subgroup_id if group_id is None else f"{group_id}-{subgroup_id}"
+        if sweep_fn is None:
+            sweep_fn = lambda spec: self._submit_sweep(spec, submit_fn=submit_fn)
+
+        stack = [
+            _WalkFrame(node, tuple(str(_id) for _id in depends_on), group_id, node_id, node_name, loop_idx)
+        ]
+        ret: Tuple[str, ...] = ()
+        entered = False  # whether `ret` holds the result of the top frame's child
+        while stack:
+            f = stack[-1]
+            if not entered:
+                subgroup_id = self._new_id()
+                f.group_id = (
+                    subgroup_id if f.group_id is None else f"{f.group_id}-{subgroup_id}"
+                )
+                leaf = self._walk_leaf(f, preamble_map, debug, submit_fn, sweep_fn)
+                if leaf is not None:
+                    submitted_jobs.extend(leaf)
+                    stack.pop()
+                    ret, entered = leaf, True
+                    continue
+                if f.kind not in ("sequential", "parallel", "parallel:root", "loop"):
+                    stack.pop()
+                    ret, entered = tuple(submitted_jobs), True
+                    continue
+                if f.kind == "parallel" and f.node_id is None:
+                    f.node_id = self._new_id()
+                elif f.kind == "loop":
+                    f.node_id = self._new_id()
+            else:
+                # Child returned `ret`
+                if ret and f.kind in ("parallel", "parallel:root", "loop"):
+                    f.acc.extend(ret)
+                if f.kind == "sequential":
+                    f.last = ret
+                if ret and (
+                    f.kind == "sequential"
+                    or (f.kind == "loop" and f.node.loop_type == "sequential")
+                ):
+                    f.depends_on = ret
 
+            # Next child (or finish)
+            entries = f.node.jobs
+            loop_count = f.node.loop_count if f.kind == "loop" else 1
+            if f.i == len(entries):
+                f.t, f.i = f.t + 1, 0
+            if f.t >= loop_count or not entries:
+                stack.pop()
+                ret, entered = self._walk_result(f), True
+                continue
+
+            entry = entries[f.i]
+            if f.kind == "parallel:root":
+                # root parallel case: all jobs have unique node_ids
+                f.node_id = self._new_id()
+            stack.append(
+                _WalkFrame(
+                    entry,
+                    f.depends_on,
+                    f.group_id,
+                    f.node_id,
+                    f.child_name(f.i),
+                    f.t if f.kind == "loop" else f.loop_idx,
+                    f.node.pack if f.kind in ("parallel", "parallel:root") else 0,
+                )
+            )
+            f.i += 1
+            entered = False
+
+        return list(ret)
+
+    def _walk_leaf(
+        self,
+        f: "_WalkFrame",
+        preamble_map: Dict[str, str],
+        debug: bool,
+        submit_fn: Callable[[Job], str],
+        sweep_fn: Callable[[SweepSpec], List[str]],
+    ) -> Optional[Tuple[str, ...]]:
+        """Submit a leaf job or sweep frame. Returns None for groups."""
         # Base case (single leaf)
-        if isinstance(node, PJob):
-            # Leaf node
-            # generate rand job id int
-            job_id = f"{random.randint(100000, 999999)}"
-            cmd = node.command.format(group_id=group_id, loop_idx=loop_idx)
+        if isinstance(f.node, PJob):
+            job_id = self._new_id()
             job = Job(
                 id=job_id,
-                command=cmd,
-                preamble=preamble_map.get(node.preamble, ""),
-                node_id=copy.deepcopy(node_id),
-                node_name=node_name,
-                parents=[str(_id) for _id in depends_on],
+                command=f.node.command.format(group_id=f.group_id, loop_idx=f.loop_idx),
+                preamble=preamble_map.get(f.node.preamble, ""),
+                node_id=f.node_id,
+                node_name=f.node_name,
+                parents=list(f.depends_on),
+                pack=f.pack,
             )
-            # job.command = job.command.format(group_id=group_id)
             if debug:
                 print(f"\nDEBUG:\n{job.to_script(self.deptype)}")
-                print(f"NODE_ID: {node_id} | GROUP_ID: {group_id}\n")
+                print(f"NODE_ID: {f.node_id} | GROUP_ID: {f.group_id}\n")
                 print("-" * 20)
             else:
                 job_id = submit_fn(job)
-            submitted_jobs.append(job_id)
-
-            return [job_id]
+            return (job_id,)
 
         # Base case (sweep)
-        elif node.type == "sweep":
-            job_ids = []
-            cmd_template = node.sweep_template
-            sweep = node.sweep
-            # Generate all combinations of the sweep parameters
-            keys = list(sweep.keys())
-
-            values = list(sweep.values())
-            # Generate all combinations of the sweep parameters
-            combinations = [dict(zip(keys, v)) for v in itertools.product(*values)]
-            node_id = (
-                f"{random.randint(100000, 999999)}" if node_id is None else node_id
+        if f.kind == "sweep":
+            node_id = self._new_id() if f.node_id is None else f.node_id
+            # Sweep combinations are generated lazily (and optionally sampled)
+            spec = SweepSpec(
+                template=f.node.sweep_template,
+                sweep=f.node.sweep,
+                preamble=preamble_map.get(f.node.preamble, ""),
+                parents=list(f.depends_on),
+                node_id=node_id,
+                node_name=f.node_name,
+                group_id=f.group_id,
+                sample=f.node.sample,
+                array=f.node.array,
+                pack=f.node.pack,
             )
-            # Iterate over the combinations
-            for i, params in enumerate(combinations):
-                job_id = f"{random.randint(100000, 999999)}"
-                cmd = cmd_template.format(**params, group_id=group_id, sweep_idx=i)
-                job = Job(
-                    id=job_id,
-                    command=cmd,
-                    preamble=preamble_map.get(node.preamble, ""),
-                    parents=[str(_id) for _id in depends_on],
-                    node_id=copy.deepcopy(node_id),
-                    node_name=node_name,
-                )
+            return tuple(self._print_debug_sweep(spec) if debug else sweep_fn(spec))
 
-                if debug:
-                    print(f"\nDEBUG:\n{job.to_script(self.deptype)}")
-                    print(f"NODE_ID: {node_id} | GROUP_ID: {group_id}\n")
-                    print("-" * 20)
-                else:
-                    job_id = submit_fn(job)
-                submitted_jobs.append(job_id)
-                job_ids.append(job_id)
-            return job_ids
-
-        # Recursive case:
-        elif node.type == "sequential":
-            # Sequential group
-            for i, entry in enumerate(node.jobs):
-                group_name_i = ":".join(
-                    [p for p in [copy.deepcopy(node_name), entry.name] if p]
-                )
-                job_ids = self.walk(
-                    entry,
-                    debug=debug,
-                    preamble_map=preamble_map,
-                    # depends_on=depends_on,
-                    # make a copy of depends_on
-                    depends_on=copy.deepcopy(depends_on),
-                    submitted_jobs=submitted_jobs,
-                    submit_fn=submit_fn,
-                    group_id=copy.deepcopy(group_id),
-                    node_name=copy.deepcopy(group_name_i),
-                    node_id=copy.deepcopy(node_id),
-                    loop_idx=copy.deepcopy(loop_idx),
-                )
-                if job_ids:
-                    depends_on = copy.deepcopy(job_ids)
-            return job_ids
-
-        elif node.type == "parallel":
-            # Parallel group
-            parallel_job_ids = []
-            node_id = (
-                f"{random.randint(100000, 999999)}" if node_id is None else node_id
-            )
-            for entry in node.jobs:
-                group_name_i = ":".join(
-                    [p for p in [copy.deepcopy(node_name), entry.name] if p]
-                )
-                job_ids = self.walk(
-                    entry,
-                    debug=debug,
-                    preamble_map=preamble_map,
-                    depends_on=copy.deepcopy(depends_on),
-                    submitted_jobs=submitted_jobs,
-                    submit_fn=submit_fn,
-                    group_id=copy.deepcopy(group_id),
-                    node_name=copy.deepcopy(group_name_i),
-                    node_id=copy.deepcopy(node_id),
-                    loop_idx=copy.deepcopy(loop_idx),
-                )
-                if job_ids:
-                    parallel_job_ids.extend(job_ids)
-            return parallel_job_ids
-
-        elif node.type == "parallel:root":
-            # Parallel group
-            parallel_job_ids = []
-            for entry in node.jobs:
-                # root parallel case: all jobs have unique node_ids
-                node_id = f"{random.randint(100000, 999999)}"
-                group_name_i = ":".join(
-                    [p for p in [copy.deepcopy(node_name), entry.name] if p]
-                )
-                job_ids = self.walk(
-                    entry,
-                    debug=debug,
-                    preamble_map=preamble_map,
-                    depends_on=copy.deepcopy(depends_on),
-                    submitted_jobs=submitted_jobs,
-                    submit_fn=submit_fn,
-                    group_id=copy.deepcopy(group_id),
-                    node_name=copy.deepcopy(group_name_i),
-                    node_id=copy.deepcopy(node_id),
-                    loop_idx=copy.deepcopy(loop_idx),
-                )
-                if job_ids:
-                    parallel_job_ids.extend(job_ids)
-            return parallel_job_ids
-
-        elif node.type == "loop":
-            # Sequential group
-            loop_node_ids = []
-            node_id = f"{random.randint(100000, 999999)}"
-            for t in range(node.loop_count):
-                for i, entry in enumerate(node.jobs):
-                    group_name_i = ":".join(
-                        [p for p in [copy.deepcopy(node_name), entry.name] if p]
-                    )
-                    job_ids = self.walk(
-                        entry,
-                        debug=debug,
-                        preamble_map=preamble_map,
-                        # depends_on=depends_on,
-                        # make a copy of depends_on
-                        depends_on=copy.deepcopy(depends_on),
-                        submitted_jobs=submitted_jobs,
-                        submit_fn=submit_fn,
-                        group_id=copy.deepcopy(group_id),
-                        node_name=copy.deepcopy(group_name_i),
-                        node_id=copy.deepcopy(node_id),
-                        loop_idx=copy.deepcopy(t),
-                    )
-                    if job_ids:
-                        loop_node_ids.extend(job_ids)
-                        if node.loop_type == "sequential":
-                            depends_on = copy.deepcopy(job_ids)
-
-            deps = (
-                loop_node_ids[-1:] or loop_node_ids
-                if node.loop_type == "sequential"
-                else loop_node_ids
-            )
-            return deps
+        return None
 
-        return submitted_jobs
+    @staticmethod
+    def _walk_result(f: "_WalkFrame") -> Tuple[str, ...]:
+        """Job IDs a finished group frame returns to its parent."""
+        if f.kind == "sequential":
+            return f.last
+        if f.kind == "loop" and f.node.loop_type == "sequential":
+            return tuple(f.acc[-1:])
+        return tuple(f.acc)
 
     def sbatch(self, args: list):
-        result = subprocess.run(
-            ["sbatch"] + args, check=True, capture_output=True, text=True
-        ).stdout.strip()
+        result = self.slurm.run(["sbatch"] + args)
+        result.check_returncode()
+        result = result.stdout.strip()
         print(result)
         job_id = self._parse_job_id(result)
         self.create_job(
@@ -1,11 +1,17 @@
 import json
-from typing import Dict, List, Optional, Tuple, Union
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 from tabulate import tabulate
 from collections import Counter, defaultdict
 from html import escape
 
 from agora._base import JobDB
 from agora.interfaces import Job
+from agora.logs import LogMatch, search_logs
+
+# Array task (<array id>_<i>) or packed task (<allocation id>.<i>) IDs
+TASK_ID_RE = re.compile(r"^(\d+)([_.])(\d+)$")
 
 SABBRV = {
     "COMPLETED": "✅",
@@ -42,7 +48,21 @@ class JobViewer(JobDB):
         return groups
 
     def _smart_range_display(self, job_ids_mixed: List[Union[int, str]]) -> str:
-        """Create a smart range display that handles gaps."""
+        """Create a smart range display that handles gaps and array tasks."""
+        if not job_ids_mixed:
+            return ""
+
+        # Array tasks (e.g., 123_7) of a single array are shown as 123_[lo-hi],
+        # packed tasks (e.g., 123.7) of a single allocation as 123.[lo-hi]
+        tasks = [TASK_ID_RE.match(str(job_id)) for job_id in job_ids_mixed]
+        if all(tasks) and len({m.group(1, 2) for m in tasks}) == 1:
+            base, sep = tasks[0].group(1, 2)
+            task_range = self._smart_range_display([m.group(3) for m in tasks])
+            return f"{base}{sep}[{task_range}]"
+        elif not all(str(job_id).isdigit() for job_id in job_ids_mixed):
+            job_ids_str = sorted(str(job_id) for job_id in job_ids_mixed)
+            return f"{job_ids_str[0]}...{job_ids_str[-1]} ({len(job_ids_str)})"
+
         job_ids = [int(job_id) for job_id in job_ids_mixed]
         job_ids = sorted(job_ids)
 
@@ -286,3 +306,55 @@ class JobViewer(JobDB):
             "\n" + tabulate(table_data, headers=cols, tablefmt="grid", maxcolwidths=100)
         )
         print(self._get_footer(jobs))
+
+    def search_logs(
+        self,
+        pattern: str,
+        filters: Optional[List[str]] = None,
+        streams: Sequence[str] = ("out", "err"),
+        ignore_case: bool = False,
+        workers: Optional[int] = None,
+        max_count: Optional[int] = None,
+    ) -> Iterator[LogMatch]:
+        """Search the logs of the jobs matching `filters` for the regex `pattern`.
+
+        The jobs and the pattern are resolved up front (raising ValueError for
+        invalid filters or patterns); the logs are scanned as the result is
+        iterated (see `agora.logs.search_logs`).
+
+        Args:
+            streams: Logs to search, "out" (slurm_out) and/or "err" (slurm_err)
+        """
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        try:
+            regex = re.compile(pattern.encode(), flags)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern {pattern!r}: {e}") from e
+        files, seen = [], set()
+        for job in self.get_jobs(filters=filters):
+            for stream in streams:
+                path = getattr(job, f"slurm_{stream}")
+                if path and path not in seen:  # --error defaults to --output
+                    seen.add(path)
+                    files.append((job.id, path))
+        return search_logs(files, regex, workers=workers, max_count=max_count)
+
+    def grep(
+        self,
+        pattern: str,
+        filters: Optional[List[str]] = None,
+        streams: Sequence[str] = ("out", "err"),
+        ignore_case: bool = False,
+        workers: Optional[int] = None,
+        max_count: Optional[int] = None,
+    ) -> None:
+        """Print the log lines of the jobs matching `filters` that match `pattern`."""
+        count, files = 0, set()
+        for match in self.search_logs(
+            pattern, filters, streams, ignore_case, workers, max_count
+        ):
+            print(f"{match.job_id}:{match.path}:{match.line_number}:{match.line}")
+            count += 1
+            files.add(match.path)
+        # To stderr, so the matches can be piped
+        print(f"{count} matches in {len(files)} files", file=sys.stderr)
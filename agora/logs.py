@@ -0,0 +1,346 @@
+"""Reading and searching (possibly huge, growing) job log files without loading them whole.
+
+Line ranges are resolved through a line-offset index: the byte offset of
+every `INDEX_STRIDE`-th line, stored in a small sidecar file and extended
+with only the bytes appended since it was last read. The last N lines are
+read backwards from the end of the file instead.
+"""
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+import hashlib
+import itertools
+import os
+import struct
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+# One checkpoint (line start offset) every this many lines
+INDEX_STRIDE = 1024
+CHUNK_SIZE = 1 << 20
+# magic, stride, inode, indexed size, line count, last line start, guard length, guard
+INDEX_HEADER = struct.Struct("<8sQQQQQB32s")
+INDEX_MAGIC = b"AGORAIX1"
+GUARD_SIZE = 32
+# Matched lines longer than this are cut (e.g., progress bars redrawn with \r)
+MATCH_LINE_MAX = 2000
+
+
+@dataclass
+class LogChunk:
+    """Part of a log file, as returned by `/api/logs`."""
+
+    content: str
+    total_lines: int  # Lines in the file (a final line without newline counts)
+    start: Optional[int]  # Line range of `content` (None for byte reads)
+    end: Optional[int]
+    offset: int  # Byte range of `content`
+    next_offset: int
+    truncated: bool = False  # Cut to `max_bytes`
+
+
+class LogFile:
+    """Line-range, tail and byte-range reads of one log file."""
+
+    def __init__(
+        self,
+        path: str,
+        index_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """Initialize the reader.
+
+        Args:
+            path: Path to the log file
+            index_dir: Directory the line-offset index is kept in (None: not persisted)
+            max_bytes: Most bytes returned per read (default: AGORA_LOG_MAX_BYTES or 4 MiB)
+        """
+        self.path = path
+        self.index_path = None
+        if index_dir is not None:
+            key = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=16)
+            self.index_path = os.path.join(index_dir, f"{key.hexdigest()}.idx")
+        self.max_bytes = max_bytes or int(os.environ.get("AGORA_LOG_MAX_BYTES", 4 << 20))
+        self._reset(0)
+        self._loaded = index_dir is None
+
+    def _reset(self, inode: int) -> None:
+        self.inode = inode
+        self.size = 0
+        self.indexed_size = 0
+        self.line_count = 0  # Newlines in the indexed bytes
+        self.last_line_start = 0  # Offset after the last indexed newline
+        self.checkpoints = array("Q", [0])  # Offset of line k * INDEX_STRIDE
+        self._guard = b""
+
+    @property
+    def total_lines(self) -> int:
+        return self.line_count + (self.size > self.last_line_start)
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+                magic, stride, inode, size, lines, last, guard_len, guard = INDEX_HEADER.unpack(header)
+                checkpoints = array("Q")
+                checkpoints.frombytes(f.read())
+        except (OSError, TypeError, struct.error, ValueError):
+            return
+        if magic != INDEX_MAGIC or stride != INDEX_STRIDE:
+            return
+        self.inode, self.indexed_size, self.line_count, self.last_line_start = inode, size, lines, last
+        self.checkpoints = checkpoints
+        self._guard = guard[:guard_len]
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(
+                    INDEX_HEADER.pack(
+                        INDEX_MAGIC,
+                        INDEX_STRIDE,
+                        self.inode,
+                        self.indexed_size,
+                        self.line_count,
+                        self.last_line_start,
+                        len(self._guard),
+                        self._guard,
+                    )
+                )
+                self.checkpoints.tofile(f)
+            os.replace(tmp, self.index_path)  # Concurrent readers see a whole index
+        except OSError:
+            pass  # The index is only a cache
+
+    def _guard_bytes(self, f: BinaryIO) -> bytes:
+        """The bytes before `indexed_size` (a rewritten file won't match them)."""
+        start = max(0, self.indexed_size - GUARD_SIZE)
+        f.seek(start)
+        return f.read(self.indexed_size - start)
+
+    def _update(self, f: BinaryIO) -> None:
+        """Extend the index with the bytes appended since it was last updated."""
+        stat = os.fstat(f.fileno())
+        if not self._loaded:
+            self._load()
+            self._loaded = True
+        self.size = stat.st_size
+        if (
+            stat.st_ino != self.inode
+            or self.size < self.indexed_size
+            or self._guard_bytes(f) != self._guard
+        ):
+            self._reset(stat.st_ino)  # Truncated or replaced
+            self.size = stat.st_size
+        if self.size == self.indexed_size:
+            return
+
+        pos = self.indexed_size
+        f.seek(pos)
+        while pos < self.size:
+            chunk = f.read(min(CHUNK_SIZE, self.size - pos))
+            if not chunk:
+                break
+            parts = chunk.split(b"\n")
+            n = len(parts) - 1
+            if n:
+                # The k-th newline of the chunk ends at lengths[k] + k + 1
+                lengths = list(itertools.accumulate(map(len, parts)))
+                first = INDEX_STRIDE - self.line_count % INDEX_STRIDE - 1
+                for k in range(first, n, INDEX_STRIDE):
+                    self.checkpoints.append(pos + lengths[k] + k + 1)
+                self.line_count += n
+                self.last_line_start = pos + lengths[n - 1] + n
+            pos += len(chunk)
+        self.size = self.indexed_size = pos
+        self._guard = self._guard_bytes(f)
+        if self.index_path is not None:
+            self._save()
+
+    def _line_offset(self, f: BinaryIO, line: int) -> int:
+        """Byte offset of the start of `line` (0 <= line <= total_lines)."""
+        if line >= self.line_count:
+            return self.last_line_start if line == self.line_count else self.size
+        offset = self.checkpoints[line // INDEX_STRIDE]
+        skip = line % INDEX_STRIDE
+        f.seek(offset)
+        while skip:
+            chunk = f.read(CHUNK_SIZE)
+            n = chunk.count(b"\n")
+            if n < skip:
+                skip -= n
+                offset += len(chunk)
+                continue
+            i = -1
+            for _ in range(skip):
+                i = chunk.index(b"\n", i + 1)
+            return offset + i + 1
+        return offset
+
+    def _chunk(self, data: bytes, start: Optional[int], offset: int, truncated: bool) -> LogChunk:
+        lines = data.count(b"\n") + (not data.endswith(b"\n") and len(data) > 0)
+        return LogChunk(
+            content=data.decode(errors="replace"),
+            total_lines=self.total_lines,
+            start=start,
+            end=None if start is None else start + lines,
+            offset=offset,
+            next_offset=offset + len(data),
+            truncated=truncated,
+        )
+
+    def lines(self, start: Optional[int] = None, end: Optional[int] = None) -> LogChunk:
+        """Read lines [start, end) (negative values count from the end, as in slices)."""
+        with open(self.path, "rb") as f:
+            self._update(f)
+            start, end, _ = slice(start, end).indices(self.total_lines)
+            end = max(start, end)
+            begin = self._line_offset(f, start)
+            stop = self.size if end >= self.total_lines else self._line_offset(f, end)
+            truncated = stop - begin > self.max_bytes
+            f.seek(begin)
+            data = f.read(min(stop - begin, self.max_bytes))
+        if truncated and b"\n" in data:
+            data = data[: data.rindex(b"\n") + 1]  # Whole lines only
+        return self._chunk(data, start, begin, truncated)
+
+    def tail(self, n: int) -> LogChunk:
+        """Read the last `n` lines, seeking back from the end of the file."""
+        with open(self.path, "rb") as f:
+            self._update(f)
+            # A final newline ends the last line rather than starting a new one
+            f.seek(max(0, self.size - 1))
+            pos = self.size - (f.read(1) == b"\n")
+            begin = 0 if n > 0 else self.size
+            need = n
+            while need > 0 and pos > 0:
+                read_from = max(0, pos - CHUNK_SIZE)
+                f.seek(read_from)
+                block = f.read(pos - read_from)
+                count = block.count(b"\n")
+                if count >= need:
+                    i = len(block)
+                    for _ in range(need):
+                        i = block.rindex(b"\n", 0, i)
+                    begin = read_from + i + 1
+                    break
+                need -= count
+                pos = read_from
+                if self.size - pos > self.max_bytes:
+                    begin = pos
+                    break
+            truncated = self.size - begin > self.max_bytes
+            if truncated:
+                begin = self.size - self.max_bytes
+            f.seek(begin)
+            data = f.read(self.size - begin)
+        if truncated and b"\n" in data:
+            cut = data.index(b"\n") + 1  # Whole lines only
+            data, begin = data[cut:], begin + cut
+        lines = data.count(b"\n") + (not data.endswith(b"\n") and len(data) > 0)
+        return self._chunk(data, self.total_lines - lines, begin, truncated)
+
+    def read(self, offset: int = 0, length: Optional[int] = None) -> LogChunk:
+        """Read `length` bytes (default: up to the end) from `offset`.
+
+        An offset past the end (the file was truncated) reads from the start.
+        """
+        with open(self.path, "rb") as f:
+            self._update(f)
+            if offset > self.size:
+                offset = 0
+            offset = max(0, offset)
+            length = self.size - offset if length is None else max(0, length)
+            truncated = length > self.max_bytes
+            f.seek(offset)
+            data = f.read(min(length, self.max_bytes))
+        return self._chunk(data, None, offset, truncated)
+
+
+@dataclass
+class LogMatch:
+    """A log line found by `search_logs`."""
+
+    job_id: str
+    path: str
+    line_number: int  # 1-based, as in grep
+    line: str
+
+
+def _search_file(
+    path: str, regex: Pattern[bytes], max_count: Optional[int]
+) -> List[Tuple[int, bytes]]:
+    """Scan a file chunk by chunk and return its matching (line number, line) pairs."""
+    matches: List[Tuple[int, bytes]] = []
+    line_number = 1  # Of the first line in `buffer`
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            buffer, rest = rest + chunk, b""
+            if chunk:  # Keep the incomplete last line for the next chunk
+                cut = buffer.rfind(b"\n") + 1
+                if len(buffer) - cut > CHUNK_SIZE:
+                    # No line end in sight (e.g., \r progress output): search
+                    # up to the last \r, keeping at most MATCH_LINE_MAX bytes
+                    cut = max(cut, buffer.rfind(b"\r") + 1, len(buffer) - MATCH_LINE_MAX)
+                buffer, rest = buffer[:cut], buffer[cut:]
+            pos = 0  # Start of line `line_number`
+            m = regex.search(buffer) if buffer else None
+            while m:
+                # Matched lines are delimited by \n or \r (but only \n counts as a new line)
+                start = max(buffer.rfind(sep, 0, m.start()) for sep in (b"\n", b"\r")) + 1
+                ends = [buffer.find(sep, m.start()) for sep in (b"\n", b"\r")]
+                end = min((i for i in ends if i != -1), default=len(buffer))
+                line_number += buffer.count(b"\n", pos, start)
+                pos = start
+                matches.append((line_number, buffer[start:end]))
+                if max_count and len(matches) >= max_count:
+                    return matches
+                m = regex.search(buffer, end + 1)
+            line_number += buffer.count(b"\n", pos)
+            if not chunk:
+                return matches
+
+
+def search_logs(
+    files: Iterable[Tuple[str, str]],
+    regex: Pattern[bytes],
+    workers: Optional[int] = None,
+    max_count: Optional[int] = None,
+) -> Iterator[LogMatch]:
+    """Search (job ID, path) log files concurrently for lines matching `regex`.
+
+    Matches are yielded file by file as scans finish; files that do not
+    exist (yet) are skipped. Closing the iterator cancels pending scans.
+
+    Args:
+        files: Job IDs and the paths of their logs
+        regex: Compiled bytes pattern (use re.MULTILINE for ^ and $ per line)
+        workers: Files scanned at a time (default: AGORA_LOG_SEARCH_WORKERS or 16)
+        max_count: Stop scanning a file after this many matches
+    """
+    pool = ThreadPoolExecutor(
+        max_workers=workers or int(os.environ.get("AGORA_LOG_SEARCH_WORKERS", 16))
+    )
+    futures = {}
+    try:
+        futures = {
+            pool.submit(_search_file, path, regex, max_count): (job_id, path)
+            for job_id, path in files
+        }
+        for future in as_completed(futures):
+            job_id, path = futures[future]
+            try:
+                found = future.result()
+            except OSError:
+                continue
+            for line_number, line in found:
+                text = line.rstrip(b"\r")[:MATCH_LINE_MAX].decode(errors="replace")
+                yield LogMatch(job_id, path, line_number, text)
+    finally:
+        for future in futures:  # shutdown(cancel_futures=True) needs Python 3.9
+            future.cancel()
+        pool.shutdown(wait=False)
@@ -1,4 +1,6 @@
+import json
 import os
+import re
 import sys
 import appdirs
 import argparse
@@ -8,6 +10,7 @@ from typing import Callable, Optional
 from pathlib import Path
 from agora.job_submitter import JobSubmitter
 from agora.job_viewer import JobViewer
+from agora.poller import StatusPoller
 from agora.server import serve
 
 
@@ -29,6 +32,18 @@ def get_cache_directory():
     return appdirs.user_cache_dir("agora")
 
 
+def get_plan_cache_dir() -> str:
+    """Get the directory compiled workflow plans are cached in."""
+    return str(Path(get_cache_directory()) / "plans")
+
+
+def get_script_cache_dir(args) -> Optional[str]:
+    """Get the script cache directory if `--keep-scripts` was passed."""
+    if getattr(args, "keep_scripts", False):
+        return str(Path(get_cache_directory()) / "scripts")
+    return None
+
+
 def ask_user_yes_no_question(
     question: str = "Are you sure you want to delete the database? (y/n): ",
     on_yes: Optional[Callable] = None,
@@ -64,6 +79,55 @@ def parse_args():
     p_submit.add_argument(
         "--deptype", choices=["afterok", "afterany"], default="afterok"
     )
+    p_submit.add_argument(
+        "--array",
+        action="store_true",
+        help="Submit every sweep group as a single SLURM job array",
+    )
+    p_submit.add_argument(
+        "--max-workers",
+        type=int,
+        default=4,
+        help="Number of concurrent sbatch calls per submit wave (default: 4)",
+    )
+    p_submit.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Number of sweep jobs expanded and recorded at a time (default: 1000)",
+    )
+    p_submit.add_argument(
+        "--keep-scripts",
+        action="store_true",
+        help="Keep submitted scripts in <cache dir>/scripts (named by content hash)",
+    )
+    p_submit.add_argument(
+        "--executor",
+        choices=["slurm", "local"],
+        default="slurm",
+        help="Run jobs with SLURM or in a process pool on this machine (default: slurm)",
+    )
+    p_submit.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="CPUs the local executor may use (default: all)",
+    )
+    p_submit.add_argument(
+        "--slurm-stats",
+        action="store_true",
+        help="Print SLURM call counts, retries and latencies when done",
+    )
+
+    ###### agora plan --file workflow.yaml (show the compiled execution plan)
+    p_plan = sub.add_parser("plan", help="Compile a YAML workflow and print its plan")
+    p_plan.add_argument("--file", required=True, help="Path to workflow.yaml")
+    p_plan.add_argument("--db", default=default_db, help="SQLite DB path")
+    p_plan.add_argument(
+        "--array",
+        action="store_true",
+        help="Submit every sweep group as a single SLURM job array",
+    )
 
     ###### agora status (get job status)
     p_status = sub.add_parser("status", help="Show job status table")
@@ -71,14 +135,56 @@ def parse_args():
     p_status.add_argument(
         "filters",
         nargs="*",
-        help="Filter jobs (e.g, job_id=123  or command~train)",
+        help="Filter jobs, all filters must match (e.g., job_id=123, status=FAILED,TIMEOUT, "
+        "'node_name^=train | command~eval' or created_at>=2024-05-01; quote values with "
+        "spaces, e.g., 'command=\"python train.py\"'; see agora/filters.py)",
         default=None,
     )
     p_status.add_argument(
         "--cols",
         nargs="*",
         default=["id", "node_name", "node_id", "command", "status"],
-        help="Columns to display in the status table (default: id, node_name, node_id, command, status)",
+        help="Columns to display in the status table (default: id, node_name, node_id, command, status; "
+        "also: reason, start_time, end_time, slurm_out, ...)",
+    )
+    p_status.add_argument(
+        "--slurm-stats",
+        action="store_true",
+        help="Print the size and duration of every sacct chunk and SLURM call stats",
+    )
+
+    ###### agora grep <pattern> [filters] (search job logs)
+    p_grep = sub.add_parser("grep", help="Search the logs of jobs for a regex")
+    p_grep.add_argument("--db", default=default_db, help="SQLite DB path")
+    p_grep.add_argument("pattern", help="Regular expression (e.g., 'CUDA out of memory')")
+    p_grep.add_argument(
+        "filters",
+        nargs="*",
+        help="Filter jobs, all filters must match (e.g., status=FAILED node_name^=train; "
+        "see agora/filters.py)",
+        default=None,
+    )
+    p_grep.add_argument(
+        "--stream",
+        choices=["out", "err", "both"],
+        default="both",
+        help="Search slurm_out, slurm_err or both (default: both)",
+    )
+    p_grep.add_argument(
+        "-i", "--ignore-case", action="store_true", help="Case-insensitive matching"
+    )
+    p_grep.add_argument(
+        "-m",
+        "--max-count",
+        type=int,
+        default=None,
+        help="Stop reading a log after this many matches",
+    )
+    p_grep.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Logs scanned at a time (default: AGORA_LOG_SEARCH_WORKERS or 16)",
     )
 
     ###### agora sbatch (pass args straight to sbatch)
@@ -91,7 +197,8 @@ def parse_args():
     p_viz.add_argument(
         "--filters",
         nargs="*",
-        help="Filter jobs (e.g, job_id=123  or command~train)",
+        help="Filter jobs, all filters must match (e.g., job_id=123 or status!=COMPLETED; "
+        "see agora/filters.py)",
         default=None,
     )
     p_viz.add_argument(
@@ -151,6 +258,23 @@ def parse_args():
     p_retry.add_argument(
         "--debug", action="store_true", help="Don't call sbatch, just print & record"
     )
+    p_retry.add_argument(
+        "--keep-scripts",
+        action="store_true",
+        help="Keep submitted scripts in <cache dir>/scripts (named by content hash)",
+    )
+    p_retry.add_argument(
+        "--executor",
+        choices=["slurm", "local"],
+        default="slurm",
+        help="Run jobs with SLURM or in a process pool on this machine (default: slurm)",
+    )
+    p_retry.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="CPUs the local executor may use (default: all)",
+    )
     p_retry.add_argument(
         "-n",
         "--node_ids",
@@ -170,6 +294,35 @@ def parse_args():
     p_serve.add_argument(
         "--no-browser", action="store_true", help="Don't open browser automatically"
     )
+    p_serve.add_argument(
+        "--ttl",
+        type=float,
+        default=None,
+        help="Seconds /api/jobs responses are cached for (default: AGORA_API_TTL or 5)",
+    )
+    p_serve.add_argument(
+        "--poll",
+        action="store_true",
+        help="Keep job states in sync in the background (like `agora daemon`)",
+    )
+    p_serve.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help="Seconds between polls with --poll (default: AGORA_POLL_INTERVAL or 30)",
+    )
+
+    ###### agora daemon (keep job states in sync)
+    p_daemon = sub.add_parser(
+        "daemon", help="Poll SLURM periodically and store job states in the DB"
+    )
+    p_daemon.add_argument("--db", default=default_db, help="SQLite DB path")
+    p_daemon.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help="Seconds between polls (default: AGORA_POLL_INTERVAL or 30)",
+    )
 
     ###### agora pit (tmux cockpit)
     p_pit = sub.add_parser("pit", help="Launch tmux cockpit with command monitoring")
@@ -225,21 +378,79 @@ def main():
 
     # Submit yaml workflow
     if args.cmd == "submit":
-        jr = JobSubmitter(args.db, deptype=args.deptype)
-        jr.submit(args.file, debug=args.debug, dry=args.dry)
+        jr = JobSubmitter(
+            args.db,
+            deptype=args.deptype,
+            script_cache_dir=get_script_cache_dir(args),
+            plan_cache_dir=get_plan_cache_dir(),
+            executor=args.executor,
+            local_cpus=args.cpus,
+        )
+        jr.submit(
+            args.file,
+            debug=args.debug,
+            dry=args.dry,
+            array=args.array,
+            max_workers=args.max_workers,
+            batch_size=args.batch_size,
+        )
+        if args.slurm_stats:
+            print(jr.slurm.report())
+
+    # Show the compiled plan of a yaml workflow
+    elif args.cmd == "plan":
+        jr = JobSubmitter(args.db, plan_cache_dir=get_plan_cache_dir())
+        compiled = jr.compile_plan(args.file, array=args.array)
+        # Show symbolic group/node IDs (assigned at submit time) as <idN>
+        print(
+            re.sub(
+                r"\\u0000(\d+)\\u0000",
+                r"<id\1>",
+                json.dumps(compiled, indent=2, default=str),
+            )
+        )
 
     elif args.cmd == "retry":
-        jr = JobSubmitter(args.db, deptype=args.deptype)
+        jr = JobSubmitter(
+            args.db,
+            deptype=args.deptype,
+            script_cache_dir=get_script_cache_dir(args),
+            executor=args.executor,
+            local_cpus=args.cpus,
+        )
         if args.node_ids:
-            jr.retry_by_node(args.node_ids)
+            jr.retry_by_node(args.node_ids, dry=args.dry)
         else:
-            for job_id in args.job_ids:
-                jr.retry(job_id, force=args.force, debug=args.debug)
+            jr.retry_jobs(args.job_ids, force=args.force, debug=args.debug, dry=args.dry)
+        jr.executor.wait()
 
     # Show job statuses
     elif args.cmd == "status":
         jr = JobViewer(args.db)
-        jr.status(args.filters, args.cols)
+        try:
+            jr.status(args.filters, args.cols)
+        except ValueError as e:
+            print(f"❌ {e}")
+            exit(1)
+        if args.slurm_stats:
+            print(jr.report_fetch_stats())
+            print(jr.slurm.report())
+
+    # Search job logs
+    elif args.cmd == "grep":
+        jr = JobViewer(args.db)
+        try:
+            jr.grep(
+                args.pattern,
+                args.filters,
+                streams=("out", "err") if args.stream == "both" else (args.stream,),
+                ignore_case=args.ignore_case,
+                workers=args.workers,
+                max_count=args.max_count,
+            )
+        except ValueError as e:
+            print(f"❌ {e}")
+            exit(1)
 
     # Visualize job dependencies
     elif args.cmd == "viz":
@@ -250,7 +461,11 @@ def main():
             "group": jr.visualize_grouped,
             "json": jr.visualize_json,
         }[args.mode]
-        viz_fn(args.filters)
+        try:
+            viz_fn(args.filters)
+        except ValueError as e:
+            print(f"❌ {e}")
+            exit(1)
 
     # Pass args straight to sbatch
     elif args.cmd == "sbatch":
@@ -279,22 +494,33 @@ def main():
         jr = JobSubmitter(args.db)
         if len(args.job_ids) == 0:
             return jr.cancel_all()
-        for job_id in args.job_ids:
-            jr.cancel(job_id)
+        jr.cancel_jobs(args.job_ids)
 
     # Start web server
     elif args.cmd == "serve":
         try:
+            if args.poll:
+                StatusPoller(args.db, interval=args.interval).start()
             serve(
                 db=args.db,
                 host=args.host,
                 port=args.port,
                 web_folder=os.path.join(os.path.dirname(__file__), "web"),
+                ttl=args.ttl,
             )
         except Exception as e:
             print(f"❌ Failed to start server: {e}")
             exit(1)
 
+    # Keep job states in sync
+    elif args.cmd == "daemon":
+        poller = StatusPoller(args.db, interval=args.interval)
+        print(f"🔄 Polling SLURM every {poller.interval:g}s (DB: {args.db})")
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            pass
+
     # Show agora data
     elif args.cmd == "data":
         jr = JobViewer(args.db)
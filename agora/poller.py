@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from agora._base import (
+    PACK_TASK_RE,
+    POLLER_HEARTBEAT_KEY,
+    TERMINAL_STATES,
+    JobDB,
+)
+from agora.slurm import SlurmClient
+
+# Incremental polls look this many seconds further back than the previous poll
+# (clock skew between this host and slurmctld)
+POLL_OVERLAP = 60
+
+
+class StatusPoller(JobDB):
+    """Keeps the stored job states in sync with SLURM (`agora daemon`).
+
+    The first poll fetches every unfinished job by ID; later polls make one
+    `sacct -S <previous poll>` call, which reports exactly the jobs that were
+    pending, running or ended since then. While the poller runs, readers use
+    the stored states instead of calling SLURM themselves.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "~/.cache/jobrunner/jobs.db",
+        interval: Optional[float] = None,
+        slurm: Optional[SlurmClient] = None,
+    ):
+        """Initialize the poller.
+
+        Args:
+            db_path: Path to SQLite database for job tracking
+            interval: Seconds between polls (default: AGORA_POLL_INTERVAL or 30)
+            slurm: Client used for all SLURM calls (defaults to the shared client)
+        """
+        super().__init__(db_path, slurm=slurm)
+        self.interval = (
+            interval
+            if interval is not None
+            else float(os.environ.get("AGORA_POLL_INTERVAL", 30))
+        )
+        self.last_poll: Optional[float] = None
+
+    def poll_once(self) -> List[Tuple[str, str, str]]:
+        """Poll SLURM once, store the states and return (job_id, old, new) transitions."""
+        started = time.time()
+        rows = self._run_query(
+            "SELECT id, status FROM jobs WHERE status IS NULL OR status NOT IN "
+            f"({', '.join('?' * len(TERMINAL_STATES))})",
+            TERMINAL_STATES,
+        )
+        previous = {row["id"]: row["status"] or "UNKNOWN" for row in rows}
+        job_ids = list(previous)
+
+        if self.last_poll is None:
+            job_states = self.get_job_states(job_ids)
+        else:
+            job_states = self.get_local_states(job_ids)
+            slurm_ids = [j for j in job_ids if j not in job_states]
+            if slurm_ids:
+                since = time.strftime(
+                    "%Y-%m-%dT%H:%M:%S", time.localtime(self.last_poll - POLL_OVERLAP)
+                )
+                steps = any(PACK_TASK_RE.match(j) for j in slurm_ids)
+                fetched = self._complete_states(
+                    slurm_ids, self._sacct(["-S", since], steps)
+                )
+                job_states.update({j: fetched[j] for j in slurm_ids if j in fetched})
+            # Jobs sacct did not report have not changed since the previous poll
+            self._store_states(job_states, job_ids)
+
+        self.last_poll = started
+        self.set_meta(POLLER_HEARTBEAT_KEY, f"{time.time()},{self.interval}")
+        return [
+            (job_id, previous[job_id], job_states[job_id]["status"])
+            for job_id in job_ids
+            if job_id in job_states and job_states[job_id]["status"] != previous[job_id]
+        ]
+
+    def run(self, stop: Optional[threading.Event] = None, verbose: bool = True) -> None:
+        """Poll every `interval` seconds until `stop` is set (or forever)."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                transitions = self.poll_once()
+            except Exception as e:
+                print(f"⚠️  Status poll failed: {e}")
+            else:
+                if verbose:
+                    for job_id, old, new in transitions:
+                        print(f"{job_id}: {old} -> {new}")
+            stop.wait(self.interval)
+
+    def start(self) -> threading.Event:
+        """Run the poller in a daemon thread; set the returned event to stop it."""
+        stop = threading.Event()
+        threading.Thread(
+            target=self.run, kwargs={"stop": stop, "verbose": False}, daemon=True
+        ).start()
+        return stop
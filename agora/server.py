@@ -1,49 +1,340 @@
 # agora/serve.py
 
+from dataclasses import asdict
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
 from waitress import serve as waitress_serve
 from flask import Flask, jsonify, send_from_directory, request
 from pathlib import Path
+from typing import Callable, Dict, Hashable, Optional, Tuple
 from agora.job_viewer import JobViewer
+from agora.logs import LogFile
 
 
-def create_app(default_db: str, web_folder: Path) -> Flask:
+class SnapshotCache:
+    """Caches serialised API responses for `ttl` seconds.
+
+    Concurrent requests for a stale key share one refresh (single flight):
+    the first one rebuilds the snapshot, the others wait for it. Expired
+    snapshots are dropped whenever one is stored, and at most `max_entries`
+    are kept (oldest first out), since keys come from query parameters.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._snapshots: Dict[Hashable, Tuple[float, bytes, str]] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """Return the (body, ETag) of `key`, calling `build` if it is stale."""
+        snapshot = self._fresh(key)
+        if snapshot is None:
+            with self._lock:
+                key_lock = self._locks.setdefault(key, threading.Lock())
+            with key_lock:
+                snapshot = self._fresh(key)  # refreshed while we waited
+                if snapshot is None:
+                    body = build()
+                    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+                    snapshot = (time.monotonic(), body, etag)
+                    with self._lock:
+                        self._snapshots.pop(key, None)  # Re-insert as the newest
+                        self._snapshots[key] = snapshot
+                        self._evict(snapshot[0])
+        return snapshot[1], snapshot[2]
+
+    def _evict(self, now: float) -> None:
+        """Drop expired snapshots, then the oldest ones over `max_entries` (holding `_lock`)."""
+        for key, (created_at, _, _) in list(self._snapshots.items()):
+            if now - created_at >= self.ttl or len(self._snapshots) > self.max_entries:
+                del self._snapshots[key]
+        # Locks of keys without a snapshot, unless a refresh holds them
+        for key in [k for k, lock in self._locks.items() if k not in self._snapshots]:
+            if not self._locks[key].locked():
+                del self._locks[key]
+
+    def _fresh(self, key: Hashable) -> Optional[Tuple[float, bytes, str]]:
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and time.monotonic() - snapshot[0] < self.ttl:
+            return snapshot
+        return None
+
+
+class EventHub:
+    """Pushes job changes and new log bytes of one DB to `/api/events` subscribers.
+
+    One producer thread per DB runs while anyone is subscribed: every
+    `interval` seconds it reads the jobs changed since its cursor (refreshing
+    statuses every `refresh_interval` seconds, unless a status poller runs)
+    and the bytes appended to the followed log files (at most `max_bytes` per
+    file and interval), and puts them into the subscribers' queues.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        interval: float,
+        refresh_interval: float,
+        max_bytes: Optional[int] = None,
+    ):
+        self.db_path = db_path
+        self.interval = interval
+        self.refresh_interval = refresh_interval
+        # Most log bytes per event (as `LogFile.max_bytes`)
+        self.max_bytes = max_bytes or int(os.environ.get("AGORA_LOG_MAX_BYTES", 4 << 20))
+        # Subscriber queue -> followed log file (None: job changes)
+        self._subscribers: Dict[queue.Queue, Optional[str]] = {}
+        self._log_offsets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, log_path: Optional[str] = None) -> queue.Queue:
+        """Subscribe to job changes, or to the bytes appended to `log_path`."""
+        q: queue.Queue = queue.Queue()
+        with self._lock:
+            self._subscribers[q] = log_path
+            if log_path is not None and log_path not in self._log_offsets:
+                self._log_offsets[log_path] = self._log_size(log_path)
+            if self._thread is None:
+                cursor = JobViewer(self.db_path).get_cursor()
+                self._thread = threading.Thread(target=self._run, args=(cursor,), daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.pop(q, None)
+            followed = set(self._subscribers.values())
+            for path in list(self._log_offsets):
+                if path not in followed:
+                    del self._log_offsets[path]
+
+    @staticmethod
+    def _log_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _publish(self, event: str, data: dict, log_path: Optional[str] = None) -> None:
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            for q, path in self._subscribers.items():
+                if path == log_path:
+                    q.put(message)
+
+    def _run(self, cursor: int) -> None:
+        try:
+            self._produce(cursor)
+        finally:
+            # Also on errors, so that the next subscribe() starts a new producer
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _produce(self, cursor: int) -> None:
+        viewer = JobViewer(self.db_path)
+        last_refresh = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                log_offsets = dict(self._log_offsets)
+
+            try:
+                refresh = time.monotonic() - last_refresh >= self.refresh_interval
+                if refresh:
+                    last_refresh = time.monotonic()
+                new_cursor, jobs, deleted = viewer.get_changes(cursor, ignore_status=not refresh)
+                if jobs or deleted:
+                    self._publish(
+                        "jobs",
+                        {"cursor": new_cursor, "jobs": [asdict(job) for job in jobs], "deleted": deleted},
+                    )
+                cursor = new_cursor
+            except Exception as e:
+                print(f"⚠️  Event producer failed: {e}")
+
+            for path, offset in log_offsets.items():
+                try:
+                    size = os.path.getsize(path)
+                    if size < offset:  # truncated or replaced
+                        offset = 0
+                    if size == offset:
+                        continue
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        content = f.read(min(size - offset, self.max_bytes))
+                except OSError:  # rotated, deleted or unreadable: try again next interval
+                    continue
+                if offset + len(content) < size and b"\n" in content:
+                    content = content[: content.rindex(b"\n") + 1]  # Whole lines only
+                next_offset = offset + len(content)  # The rest follows next interval
+                with self._lock:
+                    if path in self._log_offsets:
+                        self._log_offsets[path] = next_offset
+                self._publish(
+                    "log",
+                    {
+                        "path": path,
+                        "offset": offset,
+                        "next_offset": next_offset,
+                        "content": content.decode(errors="replace"),
+                    },
+                    log_path=path,
+                )
+
+
+def create_app(default_db: str, web_folder: Path, ttl: Optional[float] = None) -> Flask:
     app = Flask(__name__, static_folder=str(web_folder), static_url_path="")
+    # /api/jobs responses are shared by all clients for `ttl` seconds
+    cache = SnapshotCache(
+        ttl if ttl is not None else float(os.environ.get("AGORA_API_TTL", 5))
+    )
 
     @app.route("/api/jobs")
     @app.route("/api/jobs/")  # Handle both variations
     def api_jobs():
         db_path = request.args.get("db", default_db) or default_db
-        viewer = JobViewer(db_path)
-        jobs_data = viewer.get_jobs(filters=None, ignore_status=False)
+        # e.g., /api/jobs?filter=status=FAILED,TIMEOUT&filter=node_name^=train
+        filters = request.args.getlist("filter") or None
+        wrap = request.args.get("format") == "json"
+        # Delta mode: only jobs changed after this cursor (0: all jobs)
+        since = request.args.get("since", type=int)
+
+        def build() -> bytes:
+            viewer = JobViewer(db_path)
+            if since is not None:
+                cursor, jobs_data, deleted = viewer.get_changes(since, filters=filters)
+                data = {"cursor": cursor, "jobs": jobs_data, "deleted": deleted}
+                return app.json.dumps(data).encode()
+            jobs_data = viewer.get_jobs(filters=filters, ignore_status=False)
+            # If they asked for JSON mode, wrap with stats/count
+            if wrap:
+                stats = viewer._get_status_totals(jobs_data)
+                data = {"jobs": jobs_data, "stats": stats, "count": len(jobs_data)}
+            else:  # Otherwise just return array
+                data = jobs_data
+            return app.json.dumps(data).encode()
+
+        try:
+            body, etag = cache.get((db_path, tuple(filters or ()), wrap, since), build)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        response = app.response_class(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.cache_control.no_cache = True  # always revalidate (cheap 304s)
+        return response.make_conditional(request)
+
+    # One event producer per DB, shared by all subscribers
+    hubs: Dict[str, EventHub] = {}
+    hubs_lock = threading.Lock()
+
+    @app.route("/api/events")
+    def api_events():
+        """Server-sent events: `jobs` (as /api/jobs?since=) or, with ?log=<path>, `log` bytes."""
+        db_path = request.args.get("db", default_db) or default_db
+        log_path = request.args.get("log")
+        if log_path is not None and not os.path.exists(log_path):
+            return jsonify({"error": "File not found"}), 404
+        with hubs_lock:
+            if db_path not in hubs:
+                hubs[db_path] = EventHub(
+                    db_path,
+                    interval=float(os.environ.get("AGORA_EVENTS_INTERVAL", 1)),
+                    refresh_interval=cache.ttl,
+                )
+            hub = hubs[db_path]
+        q = hub.subscribe(log_path)
 
-        # If they asked for JSON mode, wrap with stats/count
-        if request.args.get("format") == "json":
-            stats = viewer._get_status_totals(jobs_data)
-            return jsonify({"jobs": jobs_data, "stats": stats, "count": len(jobs_data)})
+        def stream():
+            try:
+                yield ": connected\n\n"
+                while True:
+                    try:
+                        yield q.get(timeout=15)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"  # also detects closed connections
+            finally:
+                hub.unsubscribe(q)
 
-        # Otherwise just return array
-        return jsonify(jobs_data)
+        return app.response_class(
+            stream(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # Line-offset indexes of the log files, kept next to the database
+    log_index_dir = str(Path(default_db).expanduser().parent / "log-index")
+
+    @app.route("/api/logs/search")
+    def api_logs_search():
+        """Stream the log lines of the ?filter= jobs matching ?pattern= as NDJSON.
+
+        One {"job_id", "path", "line_number", "line"} object per line, in the
+        order the files finish scanning; ?stream=out or err limits the logs.
+        """
+        db_path = request.args.get("db", default_db) or default_db
+        pattern = request.args.get("pattern")
+        if not pattern:
+            return jsonify({"error": "Missing pattern"}), 400
+        stream = request.args.get("stream")
+        try:
+            matches = JobViewer(db_path).search_logs(
+                pattern,
+                filters=request.args.getlist("filter") or None,
+                streams=(stream,) if stream in ("out", "err") else ("out", "err"),
+                ignore_case=request.args.get("ignore_case") in ("1", "true"),
+                max_count=request.args.get("max_count", type=int),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        def generate():
+            try:
+                for match in matches:
+                    yield json.dumps(asdict(match)) + "\n"
+            finally:
+                matches.close()  # client gone: cancel pending scans
+
+        return app.response_class(
+            generate(),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     @app.route("/api/logs/<job_id>")
     def api_logs(job_id):
+        """Read a log: lines ?start=&end=, the last ?tail=N lines or bytes from ?offset=."""
         path = request.args.get("path")
         start = request.args.get("start", type=int)
         end = request.args.get("end", type=int)
+        tail = request.args.get("tail", type=int)
+        offset = request.args.get("offset", type=int)
 
-        if not path or not os.path.exists(path):
+        if not path or not os.path.isfile(path):
             return jsonify({"error": "File not found"}), 404
 
+        log = LogFile(path, log_index_dir)
         try:
-            with open(path, "r") as f:
-                lines = f.readlines()
-
-            if start is not None or end is not None:
-                lines = lines[start:end]
-
-            return jsonify({"content": "".join(lines), "total_lines": len(lines)})
-        except:
+            if tail is not None:
+                chunk = log.tail(tail)
+            elif offset is not None:
+                chunk = log.read(offset, request.args.get("length", type=int))
+            else:
+                chunk = log.lines(start, end)
+        except OSError:
             return jsonify({"error": "Read failed"}), 500
+        return jsonify(asdict(chunk))
 
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
@@ -56,7 +347,13 @@ def create_app(default_db: str, web_folder: Path) -> Flask:
     return app
 
 
-def serve(db: str, host: str = "localhost", port: int = 3000, web_folder: str = "web"):
+def serve(
+    db: str,
+    host: str = "localhost",
+    port: int = 3000,
+    web_folder: str = "web",
+    ttl: Optional[float] = None,
+):
     project_root = Path(__file__).resolve().parent.parent
     web_path = Path(web_folder)
     if not web_path.is_absolute():
@@ -64,7 +361,7 @@ def serve(db: str, host: str = "localhost", port: int = 3000, web_folder: str =
     if not (web_path / "index.html").exists():
         raise FileNotFoundError(f"Cannot find web/index.html at {web_path!r}")
 
-    app = create_app(default_db=db, web_folder=web_path)
+    app = create_app(default_db=db, web_folder=web_path, ttl=ttl)
     # print(f"🔌 Serving on http://{host}:{port}  (DB: {db})")
 
     print("🚀 agora web server")
@@ -74,4 +371,7 @@ def serve(db: str, host: str = "localhost", port: int = 3000, web_folder: str =
     print("   Open the URL above to view job graph.")
     print("   Press Ctrl+C to stop")
 
-    waitress_serve(app, host=host, port=port)
+    # Every open /api/events stream holds a worker thread
+    waitress_serve(
+        app, host=host, port=port, threads=int(os.environ.get("AGORA_SERVER_THREADS", 16))
+    )
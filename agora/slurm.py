@@ -0,0 +1,277 @@
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# sbatch/sacct/squeue/scancel errors worth retrying (slurmctld overloaded or restarting)
+TRANSIENT_ERRORS = [
+    "socket timed out",
+    "unable to contact slurm controller",
+    "slurm_receive_msg",
+    "resource temporarily unavailable",
+    "connection refused",
+    "try again",
+]
+
+# Transient sbatch errors after which slurmctld may still have queued the job
+AMBIGUOUS_SBATCH_ERRORS = ["socket timed out", "slurm_receive_msg"]
+
+JOB_NAME_RE = re.compile(r"^#SBATCH[ \t]+(?:--job-name[= \t]+|-J[ \t]*)(\S+)", re.MULTILINE)
+
+
+class SlurmUnavailableError(RuntimeError):
+    """Raised when the circuit breaker is open (SLURM keeps failing)."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket with an adjustable refill rate."""
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available. Returns the time waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self) -> None:
+        """Halve the rate (multiplicative decrease)."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self) -> None:
+        """Increase the rate by 10% of its maximum (additive increase)."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate)
+
+
+class CircuitBreaker:
+    """Fail fast after `threshold` consecutive failures, for `cooldown` seconds."""
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """Raise if the breaker is open. After the cooldown one trial call is let through."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise SlurmUnavailableError(
+                    f"SLURM failed {self.failures} times in a row, "
+                    f"not calling it for {self.cooldown:.0f}s"
+                )
+            self.opened_at = None  # half-open: allow a trial call
+
+    def record(self, success: bool) -> None:
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    retries: int = 0
+    failures: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    throttled: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+
+class SlurmClient:
+    """Run SLURM commands through a shared rate limiter, retry policy and circuit breaker.
+
+    Each command (sbatch, sacct, ...) gets its own token bucket. Transient
+    errors (e.g., "Socket timed out") are retried with jittered exponential
+    backoff and halve the command's rate; successful calls slowly restore it.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        rates: Optional[Dict[str, float]] = None,
+        max_retries: Optional[int] = None,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60.0,
+    ):
+        """Initialize the client. Unset values are read from the environment.
+
+        Args:
+            rate: Calls per second per command (env: AGORA_SLURM_RATE, default: 10)
+            burst: Calls allowed back to back (env: AGORA_SLURM_BURST, default: 20)
+            rates: Per-command overrides of `rate` (e.g., {"sbatch": 5})
+            max_retries: Retries for transient errors (env: AGORA_SLURM_RETRIES, default: 5)
+            backoff: Base delay of the exponential backoff (seconds)
+            max_backoff: Maximum delay between retries (seconds)
+            breaker_threshold: Consecutive failed calls before failing fast
+            breaker_cooldown: Seconds to fail fast for once the breaker opens
+        """
+        env = os.environ
+        self.rate = rate if rate is not None else float(env.get("AGORA_SLURM_RATE", 10))
+        self.burst = burst if burst is not None else int(env.get("AGORA_SLURM_BURST", 20))
+        self.rates = rates or {}
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(env.get("AGORA_SLURM_RETRIES", 5))
+        )
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.stats: Dict[str, CallStats] = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, cmd: str) -> TokenBucket:
+        with self.lock:
+            if cmd not in self.buckets:
+                self.buckets[cmd] = TokenBucket(self.rates.get(cmd, self.rate), self.burst)
+                self.stats[cmd] = CallStats()
+            return self.buckets[cmd]
+
+    @staticmethod
+    def _is_transient(result: subprocess.CompletedProcess) -> bool:
+        output = f"{result.stdout}\n{result.stderr}".lower()
+        return result.returncode != 0 and any(e in output for e in TRANSIENT_ERRORS)
+
+    def _may_be_queued(
+        self, args: List[str], input: Optional[str], result: subprocess.CompletedProcess
+    ) -> bool:
+        """Whether a failed sbatch call may have queued its job anyway.
+
+        On "Socket timed out" and similar errors slurmctld may have accepted
+        the job before the reply was lost. The job is then looked up by name
+        with `squeue --me`; without a job name (or if squeue fails) it is
+        assumed to be queued, so that it is never submitted twice.
+        """
+        output = f"{result.stdout}\n{result.stderr}".lower()
+        if args[0] != "sbatch" or not any(e in output for e in AMBIGUOUS_SBATCH_ERRORS):
+            return False
+        names = [a.split("=", 1)[1] for a in args if a.startswith("--job-name=")]
+        names += JOB_NAME_RE.findall(input or "")
+        if not names:
+            return True
+        name = names[0].strip("'\"")
+        found = self.run(["squeue", "--me", "--noheader", "--format=%i", f"--name={name}"])
+        return found.returncode != 0 or bool(found.stdout.strip())
+
+    def run(
+        self, args: List[str], input: Optional[str] = None
+    ) -> subprocess.CompletedProcess:
+        """Run a SLURM command (argv list, no shell) and return the completed process.
+
+        Non-transient failures are returned as is (check `returncode`), and a
+        command that cannot be run (e.g., SLURM is not installed) as a failed
+        process with empty output. A timed out sbatch is only retried if its
+        job is not in the queue (see `_may_be_queued`). Raises `SlurmUnavailableError` if the
+        circuit breaker is open.
+        """
+        cmd = args[0]
+        bucket = self._bucket(cmd)
+        stats = self.stats[cmd]
+        attempt = 0
+        while True:
+            self.breaker.check()
+            throttled = bucket.acquire()
+            start = time.monotonic()
+            try:
+                result = subprocess.run(args, input=input, capture_output=True, text=True)
+            except OSError as e:  # e.g., not installed on this host
+                with self.lock:
+                    stats.calls += 1
+                    stats.failures += 1
+                return subprocess.CompletedProcess(args, 127, "", str(e))
+            latency = time.monotonic() - start
+            transient = self._is_transient(result)
+            self.breaker.record(not transient)
+
+            with self.lock:
+                stats.calls += 1
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+                stats.throttled += throttled
+
+            if not transient:
+                bucket.speed_up()
+                return result
+
+            bucket.slow_down()
+            error = result.stderr.strip() or result.stdout.strip()
+            if attempt >= self.max_retries or self._may_be_queued(args, input, result):
+                if attempt < self.max_retries:
+                    print(f"{cmd} failed ({error}), not retrying: the job may have been queued")
+                with self.lock:
+                    stats.failures += 1
+                return result
+
+            # Full jitter exponential backoff
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+            print(f"{cmd} failed ({error}), retrying in {delay:.1f}s")
+            with self.lock:
+                stats.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def report(self) -> str:
+        """Return per-command call counts, retries and latencies."""
+        lines = []
+        with self.lock:
+            for cmd, s in sorted(self.stats.items()):
+                lines.append(
+                    f"{cmd}: {s.calls} calls | {s.retries} retries | {s.failures} failures | "
+                    f"latency mean {s.mean_latency * 1000:.0f}ms max {s.max_latency * 1000:.0f}ms | "
+                    f"throttled {s.throttled:.1f}s | rate {self.buckets[cmd].rate:.1f}/s"
+                )
+        return "\n".join(lines)
+
+
+_default_client: Optional[SlurmClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> SlurmClient:
+    """Return the process-wide SLURM client (shared by all JobDB instances)."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = SlurmClient()
+        return _default_client
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Benchmark JobSubmitter.walk on synthetic job trees (no SLURM calls).
+
+Each tree is also walked by `recursive_walk`, the recursive walk that the
+explicit-stack walker replaced, as the baseline.
+
+Usage:
+    python benchmarks/bench_walk.py [--leaves 100000] [--depth 5000] [--no-baseline]
+"""
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from agora.interfaces import Job, PGroup, PJob
+from agora.job_submitter import JobSubmitter
+
+
+def wide_tree(leaves: int) -> PGroup:
+    """A sequential of parallel groups with `leaves` leaves in total."""
+    width = 1000
+    return PGroup(
+        type="sequential",
+        name="root",
+        jobs=[
+            PGroup(
+                type="parallel",
+                name=f"stage{s}",
+                jobs=[
+                    PJob(preamble="base", command=f"echo {s} {i} --group_id {{group_id}}")
+                    for i in range(width)
+                ],
+            )
+            for s in range(leaves // width)
+        ],
+    )
+
+
+def nested_loop_tree(leaves: int) -> PGroup:
+    """Loops of sequential groups of parallel groups (loop-in-sequential-in-parallel)."""
+    width = 100
+    return PGroup(
+        type="parallel",
+        name="root",
+        jobs=[
+            PGroup(
+                type="sequential",
+                name=f"seq{s}",
+                jobs=[
+                    PGroup(
+                        type="loop",
+                        loop_count=10,
+                        loop_type="sequential",
+                        jobs=[
+                            PJob(
+                                preamble="base",
+                                command=f"echo {s} {i} --loop_idx {{loop_idx}}",
+                            )
+                            for i in range(width // 10)
+                        ],
+                    )
+                ],
+            )
+            for s in range(leaves // width)
+        ],
+    )
+
+
+def deep_tree(depth: int) -> PGroup:
+    """`depth` nested sequential groups around a single leaf."""
+    node = PGroup(type="sequential", jobs=[PJob(preamble="base", command="echo deep")])
+    for _ in range(depth):
+        node = PGroup(type="sequential", jobs=[node])
+    return node
+
+
+def recursive_walk(
+    submitter: JobSubmitter,
+    node,
+    preamble_map,
+    depends_on,
+    submitted_jobs,
+    submit_fn,
+    group_id=None,
+    node_id=None,
+    node_name="",
+    loop_idx=None,
+):
+    """The former recursive JobSubmitter.walk (without debug output and sweeps)."""
+    subgroup_id = submitter._new_id()
+    group_id = subgroup_id if group_id is None else f"{group_id}-{subgroup_id}"
+
+    if isinstance(node, PJob):
+        job = Job(
+            id=submitter._new_id(),
+            command=node.command.format(group_id=group_id, loop_idx=loop_idx),
+            preamble=preamble_map.get(node.preamble, ""),
+            node_id=copy.deepcopy(node_id),
+            node_name=node_name,
+            parents=[str(_id) for _id in depends_on],
+        )
+        job_id = submit_fn(job)
+        submitted_jobs.append(job_id)
+        return [job_id]
+
+    def walk_entry(entry, depends_on, node_id, loop_idx):
+        return recursive_walk(
+            submitter,
+            entry,
+            preamble_map=preamble_map,
+            depends_on=copy.deepcopy(depends_on),
+            submitted_jobs=submitted_jobs,
+            submit_fn=submit_fn,
+            group_id=copy.deepcopy(group_id),
+            node_id=copy.deepcopy(node_id),
+            node_name=":".join(p for p in [copy.deepcopy(node_name), entry.name] if p),
+            loop_idx=copy.deepcopy(loop_idx),
+        )
+
+    if node.type == "sequential":
+        job_ids = []
+        for entry in node.jobs:
+            job_ids = walk_entry(entry, depends_on, node_id, loop_idx)
+            if job_ids:
+                depends_on = copy.deepcopy(job_ids)
+        return job_ids
+
+    if node.type in ("parallel", "parallel:root"):
+        node_id = submitter._new_id() if node_id is None else node_id
+        parallel_job_ids = []
+        for entry in node.jobs:
+            if node.type == "parallel:root":
+                node_id = submitter._new_id()
+            parallel_job_ids.extend(walk_entry(entry, depends_on, node_id, loop_idx))
+        return parallel_job_ids
+
+    if node.type == "loop":
+        loop_node_ids = []
+        node_id = submitter._new_id()
+        for t in range(node.loop_count):
+            for entry in node.jobs:
+                job_ids = walk_entry(entry, depends_on, node_id, t)
+                if job_ids:
+                    loop_node_ids.extend(job_ids)
+                    if node.loop_type == "sequential":
+                        depends_on = copy.deepcopy(job_ids)
+        return loop_node_ids[-1:] if node.loop_type == "sequential" else loop_node_ids
+
+    return submitted_jobs
+
+
+def bench(submitter: JobSubmitter, name: str, tree: PGroup, baseline: bool = False) -> None:
+    counter = iter(range(10**9))
+    walk = submitter.walk
+    if baseline:
+        walk = lambda **kwargs: recursive_walk(submitter, **kwargs)
+        name = f"{name} (rec)"
+    start = time.perf_counter()
+    try:
+        walk(
+            node=tree,
+            preamble_map={"base": "#!/bin/bash"},
+            depends_on=[],
+            submitted_jobs=[],
+            submit_fn=lambda job: str(next(counter)),
+        )
+    except RecursionError:
+        print(f"{name:<18} RecursionError")
+        return
+    elapsed = time.perf_counter() - start
+    print(f"{name:<18} {next(counter):>8} jobs  {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--leaves", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=5000)
+    parser.add_argument(
+        "--no-baseline", action="store_true", help="skip the recursive walk (slow on wide trees)"
+    )
+    args = parser.parse_args()
+
+    trees = [
+        ("wide", wide_tree(args.leaves)),
+        ("nested-loop", nested_loop_tree(args.leaves)),
+        ("deep", deep_tree(args.depth)),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        submitter = JobSubmitter(os.path.join(tmp_dir, "bench.db"))
+        for name, tree in trees:
+            if not args.no_baseline:
+                bench(submitter, name, tree, baseline=True)
+            bench(submitter, name, tree)
+
+
+if __name__ == "__main__":
+    main()